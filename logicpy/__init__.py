@@ -20,7 +20,8 @@
 
 from .core import Universe, Underscore
 from .builtin import *
+from .dcg import phrase
 
 _ = Underscore()
 
-__all__ = ('_', 'Universe', 'evaluated', 'runnable', 'provable') + shell_builtins
+__all__ = ('_', 'Universe', 'evaluated', 'runnable', 'provable', 'nondeterministic', 'unbound', 'phrase') + shell_builtins
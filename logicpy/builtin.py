@@ -1,12 +1,20 @@
 
 import operator
-from functools import wraps
+import re
+from functools import wraps, partial
+from itertools import count, product
 
 from logicpy.structure import Structure, MultiArg, BinaryArg, MonoArg
-from logicpy.data import Compound, EvalCompound, Variable, Term, instantiate
-from logicpy.result import ResultException, UnificationFail
+from logicpy.data import Atom, Compound, EvalCompound, Variable, Term, ListTerm, instantiate, with_scope, \
+    list_segments, list_elements, list_from_segments, is_nil, is_ground, cons, nil, order_key, occurences, \
+    Text, as_text
+from logicpy.result import ResultException, UnificationFail, Uninstantiated
+from logicpy.limits import PAUSE, QueryStats, QueryCancelled, query_stats
 
-shell_builtins = ('True_', 'Fail', 'and_', 'or_', 'max_', 'min_', 'abs_', 'cut', 'neg', 'write')
+shell_builtins = ('True_', 'Fail', 'and_', 'or_', 'max_', 'min_', 'abs_', 'cut', 'neg', 'write',
+                  'cons', 'nil', 'append', 'length', 'nth', 'member', 'compare', 'sort', 'msort', 'keysort',
+                  'freeze', 'when', 'dif', 'par_and', 'between', 'succ', 'plus', 'repeat', 'forall',
+                  'atom_length', 'sub_atom', 'atom_concat', 'atom_codes', 'split_string')
 
 
 class TrueCls(Structure):
@@ -49,7 +57,16 @@ class and_(MultiArg):
         
         arg = self.args[n]
         for new_result in arg.prove(result, dbg.from_next()):
-            yield from self.prove_arg(n+1, new_result, dbg)
+            if new_result is PAUSE:
+                yield new_result
+            elif new_result.delayed:
+                for woken in wake(new_result, dbg):
+                    if woken is PAUSE:
+                        yield woken
+                    else:
+                        yield from self.prove_arg(n+1, woken, dbg)
+            else:
+                yield from self.prove_arg(n+1, new_result, dbg)
 
 
 class or_(MultiArg):
@@ -78,7 +95,8 @@ class unify(BinaryArg):
             dbg.proven(self, mgu)
             yield mgu
         except UnificationFail as e:
-            dbg.output(f"Unification failed: {e}")
+            if dbg:
+                dbg.output(f"Unification failed: {e}")
     
     def __bool__(self):
         if isinstance(self.left, Term):
@@ -96,14 +114,18 @@ class _Cut(Structure):
         dbg.output("Cut!")
         yield result
         raise PredicateCut()
+    
+    __repr__ = __str__ = lambda s: "cut"
 
 cut = _Cut()
 
 
 class neg(MonoArg):
     def prove(self, result, dbg):
-        for _ in self.arg.prove(result, dbg.next()):
-            return
+        for res in self.arg.prove(result, dbg.next()):
+            if res is not PAUSE:
+                return
+            yield res
         yield result
 
 
@@ -139,6 +161,14 @@ class Evaluation(BinaryArg):
             yield mgu
         except (EvalException, ResultException) as e:
             dbg.output(f"Eval failed: {e}")
+    
+    def prove_many(self, frames, dbg):
+        frames, (values,) = evaluate_columns((self.right,), frames)
+        for (i, result), value in zip(frames, values):
+            try:
+                yield i, (result | {(self.left, value)}).mgu()
+            except ResultException as e:
+                dbg.output(f"Eval failed: {e}")
 
 
 class Comparison(BinaryArg):
@@ -152,7 +182,13 @@ class Comparison(BinaryArg):
                 yield result
         except (EvalException, Uninstantiated) as e:
             dbg.output(f"Comparison failed: {e}")
-        
+    
+    def prove_many(self, frames, dbg):
+        frames, (lefts, rights) = evaluate_columns((self.left, self.right), frames)
+        for frame, l, r in zip(frames, lefts, rights):
+            if self.compare(l, r):
+                yield frame
+
 
 
 class Lower(Comparison):
@@ -175,8 +211,25 @@ class GreaterOrEqual(Comparison):
     compare = lambda s, l, r: l >= r
 
 
-def evaluated(func):
-    "Turns a function into a term that is evaluated at runtime"
+def vectorize(func):
+    """The scalar version of a vectorized function, which takes a list per argument
+    and returns a list of results. The original is kept as its 'vectorized' attribute."""
+    @wraps(func)
+    def scalar(*args):
+        return func(*([a] for a in args))[0]
+    scalar.vectorized = func
+    return scalar
+
+
+def evaluated(func=None, *, vectorized=False):
+    """Turns a function into a term that is evaluated at runtime.
+    With vectorized=True, the function takes a list per argument and returns a list
+    of results, so Universe.query_many can call it once for many rows."""
+    if func is None:
+        return partial(evaluated, vectorized=vectorized)
+    if vectorized:
+        func = vectorize(func)
+    
     @wraps(func)
     def wrapper(*args):
         return EvalCompound(func.__name__, func, args)
@@ -198,10 +251,15 @@ def abs_(x):
     return abs(x)
 
 
-def runnable(func, skip_result_check=True):
+def runnable(func=None, skip_result_check=True, *, vectorized=False):
     """Turns a function into a predicate that is ran with evaluated arguments.
     Does not check the result, always succeeds.
+    With vectorized=True, see evaluated.
     """
+    if func is None:
+        return partial(runnable, skip_result_check=skip_result_check, vectorized=vectorized)
+    if vectorized:
+        func = vectorize(func)
     
     class Runnable(MultiArg):
         def prove(self, result, dbg):
@@ -214,15 +272,1048 @@ def runnable(func, skip_result_check=True):
                     yield result
             except Exception as e:
                 dbg.output(f"Calling {func.__name__} with args {args} failed: {e}")
+        
+        def prove_many(self, frames, dbg):
+            frames, columns = evaluate_columns(self.args, frames)
+            outcomes = None
+            if vectorized and columns and frames:
+                try:
+                    outcomes = func.vectorized(*columns)
+                except Exception as e:
+                    dbg.output(f"Calling {func.__name__} vectorized failed, calling it per row: {e}")
+            if outcomes is None:
+                outcomes = []
+                for args in zip(*columns) if columns else [()] * len(frames):
+                    try:
+                        outcomes.append(func(*args))
+                    except Exception as e:
+                        dbg.output(f"Calling {func.__name__} with args {args} failed: {e}")
+                        outcomes.append(Fail)
+            for frame, func_res in zip(frames, outcomes):
+                if func_res is not Fail and (skip_result_check or func_res):
+                    yield frame
     
+    Runnable.vectorized = vectorized
     return Runnable
 
 
-def provable(func):
+def provable(func=None, *, vectorized=False):
     """Turns a function into a predicate that is ran with evaluated arguments,
     and will fail or succeed based on the thruthiness of the return value.
     """
-    return runnable(func, skip_result_check=False)
+    return runnable(func, skip_result_check=False, vectorized=vectorized)
 
 
 write = runnable(print)
+
+
+class Unbound:
+    "Passed to nondeterministic predicates for the arguments that are unbound variables"
+    
+    def __repr__(self):
+        return 'unbound'
+
+unbound = Unbound()
+
+
+def input_value(arg, result):
+    "The evaluated value of arg, unbound, or arg itself when partially instantiated"
+    arg = result.walk(arg)
+    if isinstance(arg, Variable):
+        return unbound
+    try:
+        return evaluate(instantiate(arg, result))
+    except Uninstantiated:
+        return arg
+
+
+def nondeterministic(func=None, *, batched=False):
+    """Turns a generator function into a predicate with any number of solutions.
+    It is called with the evaluated arguments, with unbound for unbound variables,
+    and yields a tuple with a value for each argument per solution (or, with
+    batched=True, lists of such tuples). These are unified with the arguments.
+    The generator is closed when the caller stops early, e.g. by a cut.
+    """
+    if func is None:
+        return partial(nondeterministic, batched=batched)
+    
+    class Nondeterministic(MultiArg):
+        def prove(self, result, dbg):
+            dbg.prove(self, result)
+            inputs = [input_value(a, result) for a in self.args]
+            solutions = func(*inputs)
+            try:
+                for batch in solutions:
+                    for values in batch if batched else (batch,):
+                        if len(self.args) == 1 and not isinstance(values, (tuple, list)):
+                            values = (values,)
+                        pairs = set()
+                        for arg, inp, value in zip(self.args, inputs, values):
+                            if inp is unbound or isinstance(inp, Term) and not is_ground(inp):
+                                pairs.add((arg, with_scope(value, 0)))
+                            elif inp != value:
+                                break
+                        else:
+                            try:
+                                yield (result | pairs).mgu() if pairs else result
+                            except UnificationFail as e:
+                                dbg.output(f"Solution {values} of {func.__name__} failed: {e}")
+            finally:
+                close = getattr(solutions, 'close', None)
+                if close is not None:
+                    close()
+        
+        def __str__(self):
+            return f"{func.__name__}({', '.join(map(str, self.args))})"
+    
+    Nondeterministic.__name__ = func.__name__
+    return Nondeterministic
+
+
+# Iteration
+# ---------
+#
+# Failure-driven loops like between(1, N, _.X) & work(_.X) & Fail run in constant
+# memory: every answer is a new Result extending the one the loop started from,
+# and once the rest of the conjunction is done with it, nothing refers to it.
+# Each iteration counts as an inference, so the limits of the query (and the
+# budget of engines) hold for loops that call no predicates.
+
+def loop_step(result):
+    "Counts an iteration of a loop, returns whether it should yield PAUSE first"
+    stats = query_stats.get()
+    if stats is None:
+        return False
+    stats.step(result)
+    return stats.should_pause()
+
+
+def integer_input(arg, result, name, dbg):
+    "The integer value of arg, unbound, or None (after telling dbg why) if it's neither"
+    value = input_value(arg, result)
+    if value is unbound or isinstance(value, int) and not isinstance(value, bool):
+        return value
+    dbg.output(f"{name} should be an integer, not {value}")
+    return None
+
+
+INFINITE = (float('inf'), Atom('inf'), Atom('infinite'))
+
+
+class between(MultiArg):
+    """between(Low, High, X): X is an integer from Low up to and including High.
+    High may be inf (or infinite) for no upper limit, but not unbound. When X is
+    unbound, its values are generated one at a time."""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        high = input_value(self.args[1], result)
+        if high is unbound:
+            raise Uninstantiated(f"Uninstantiated: {self.args[1]}, between needs High (inf for no upper limit)")
+        elif high in INFINITE:
+            high = None  # no upper limit
+        elif integer_input(self.args[1], result, "High", dbg) is None:
+            return
+        low, value = (integer_input(a, result, name, dbg) for a, name in ((self.args[0], "Low"), (self.args[2], "X")))
+        if low is None or value is None:
+            return
+        elif low is unbound:
+            dbg.output("between needs Low")
+            return
+        elif value is not unbound:
+            if low <= value and (high is None or value <= high):
+                yield result
+            return
+        
+        for i in count(low) if high is None else range(low, high + 1):
+            if loop_step(result):
+                yield PAUSE
+            res = unify_all(result, [(self.args[2], i)])
+            if res is not None:
+                yield res
+    
+    def __str__(self):
+        return f"between({', '.join(map(str, self.args))})"
+
+
+class succ(BinaryArg):
+    "succ(X, Y): Y is X + 1, for natural numbers X"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        x, y = (integer_input(a, result, name, dbg) for a, name in zip(self.args, "XY"))
+        if x is None or y is None:
+            return
+        elif x is not unbound:
+            pairs = [(self.right, x + 1)] if x >= 0 else None
+        elif y is not unbound:
+            pairs = [(self.left, y - 1)] if y > 0 else None
+        else:
+            dbg.output("succ needs X or Y")
+            return
+        res = unify_all(result, pairs) if pairs else None
+        if res is not None:
+            yield res
+    
+    def __str__(self):
+        return f"succ({self.left}, {self.right})"
+
+
+class plus(MultiArg):
+    "plus(X, Y, Z): Z is X + Y, for integers of which at least two are known"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        x, y, z = (integer_input(a, result, name, dbg) for a, name in zip(self.args, "XYZ"))
+        if x is None or y is None or z is None:
+            return
+        elif x is not unbound and y is not unbound:
+            pair = (self.args[2], x + y)
+        elif x is not unbound and z is not unbound:
+            pair = (self.args[1], z - x)
+        elif y is not unbound and z is not unbound:
+            pair = (self.args[0], z - y)
+        else:
+            dbg.output("plus needs two of X, Y and Z")
+            return
+        res = unify_all(result, [pair])
+        if res is not None:
+            yield res
+    
+    def __str__(self):
+        return f"plus({', '.join(map(str, self.args))})"
+
+
+class RepeatCls(Structure):
+    "repeat: succeeds again every time it is backtracked into, until a cut"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        while True:
+            if loop_step(result):
+                yield PAUSE
+            yield result
+    
+    __repr__ = __str__ = lambda s: "repeat"
+
+repeat = RepeatCls()
+
+
+class forall(BinaryArg):
+    """forall(Condition, Action): Action can be proven for every answer of
+    Condition. Like neg, it binds no variables. Each answer of Condition is
+    dropped once Action is proven for it, so it runs in constant memory."""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        yield from neg(and_(self.left, neg(self.right))).prove(result, dbg)
+    
+    def __str__(self):
+        return f"forall({self.left}, {self.right})"
+
+
+# Proving for many results at once (see Universe.query_many)
+# ----------------------------------------------------------
+
+def evaluate_many(exprs):
+    """Evaluates a column of instantiated expressions, calling vectorized functions
+    once for the whole column. Rows that fail hold their EvalException."""
+    first = exprs[0] if exprs else None
+    if isinstance(first, EvalCompound) and hasattr(first.func, 'vectorized') \
+            and all(isinstance(e, EvalCompound) and e.func is first.func for e in exprs):
+        columns = [evaluate_many(list(col)) for col in zip(*(e.children for e in exprs))]
+        if not any(isinstance(v, EvalException) for col in columns for v in col):
+            try:
+                return list(first.func.vectorized(*columns))
+            except Exception:
+                pass  # find out which rows fail below
+    
+    values = []
+    for expr in exprs:
+        try:
+            values.append(evaluate(expr))
+        except EvalException as e:
+            values.append(e)
+    return values
+
+
+def evaluate_columns(exprs, frames):
+    """Evaluates exprs for each (index, result) frame. Returns the frames for which
+    all could be evaluated, and a column of values for each expression."""
+    rows = []
+    for frame in frames:
+        try:
+            rows.append((frame, tuple(instantiate(e, frame[1]) for e in exprs)))
+        except Uninstantiated:
+            pass
+    columns = [evaluate_many(list(col)) for col in zip(*(args for frame, args in rows))]
+    keep = [k for k in range(len(rows)) if not any(isinstance(col[k], EvalException) for col in columns)]
+    return [rows[k][0] for k in keep], [[col[k] for k in keep] for col in columns] or [[] for e in exprs]
+
+
+def has_vectorized(expr):
+    return isinstance(expr, EvalCompound) and \
+        (hasattr(expr.func, 'vectorized') or any(has_vectorized(c) for c in expr.children))
+
+
+def prove_many(goal, frames, dbg):
+    """Proves goal for each (index, result) frame, yielding the new frames in order.
+    Goals calling vectorized functions are proven for all frames at once."""
+    if hasattr(goal, 'prove_many') and \
+            (getattr(goal, 'vectorized', False) or any(has_vectorized(a) for a in goal.args)):
+        return goal.prove_many(frames, dbg)
+    return ((i, new_result) for i, result in frames for new_result in goal.prove(result, dbg))
+
+
+# Lists
+# -----
+
+def fresh_variables(n):
+    return tuple(Variable('_', Structure.scope_id()) for i in range(n))
+
+
+def unify_all(result, pairs):
+    "The mgu of result extended with the pairs, or None if they don't unify"
+    try:
+        return (result | set(pairs)).mgu()
+    except UnificationFail:
+        return None
+
+
+def flat_items(segments):
+    "A single (items, start, stop) segment with all elements, copying only if needed"
+    if len(segments) == 1:
+        return segments[0]
+    items = tuple(list_elements(segments))
+    return items, 0, len(items)
+
+
+class append(MultiArg):
+    "append(A, B, AB): AB is A followed by B"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        left, right, total = self.args
+        segments, tail = list_segments(left, result.walk)
+        if is_nil(tail):
+            # Shares the elements of left, O(number of segments)
+            res = unify_all(result, [(total, list_from_segments(segments, right, been_scoped=True))])
+            if res is not None:
+                yield res
+            return
+        
+        total_segments, total_tail = list_segments(total, result.walk)
+        if is_nil(total_tail):
+            items, start, stop = flat_items(total_segments)
+            for i in range(start, stop + 1):
+                res = unify_all(result, [(left, ListTerm.view(items, start, i, been_scoped=True)),
+                                         (right, ListTerm.view(items, i, stop, been_scoped=True))])
+                if res is not None:
+                    yield res
+            return
+        
+        # Both open: like Prolog, enumerate ever longer lists
+        known = list(zip(list_elements(segments), list_elements(total_segments)))
+        if unify_all(result, known) is None:
+            return
+        for n in count():
+            elements = fresh_variables(n)
+            res = unify_all(result, [(left, ListTerm.view(elements, been_scoped=True)),
+                                     (total, ListTerm.view(elements, tail=right, been_scoped=True))])
+            if res is not None:
+                yield res
+
+
+class length(BinaryArg):
+    "length(List, N): List has N elements"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        segments, tail = list_segments(self.left, result.walk)
+        known = sum(stop - start for items, start, stop in segments)
+        n = result.walk(self.right)
+        if is_nil(tail):
+            res = unify_all(result, [(self.right, known)])
+            if res is not None:
+                yield res
+        elif isinstance(tail, Variable) and isinstance(n, int):
+            if n >= known:
+                res = unify_all(result, [(tail, ListTerm.view(fresh_variables(n - known), been_scoped=True))])
+                if res is not None:
+                    yield res
+        elif isinstance(tail, Variable) and isinstance(n, Variable):
+            for i in count(known):
+                res = unify_all(result, [(tail, ListTerm.view(fresh_variables(i - known), been_scoped=True)),
+                                         (n, i)])
+                if res is not None:
+                    yield res
+
+
+class nth(MultiArg):
+    "nth(Index, List, Element): Element is at (0-based) Index in List"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        index, lst, element = self.args
+        segments, tail = list_segments(lst, result.walk)
+        i = result.walk(index)
+        if isinstance(i, int):
+            for items, start, stop in segments:
+                if 0 <= i < stop - start:
+                    res = unify_all(result, [(element, items[start + i])])
+                    if res is not None:
+                        yield res
+                    return
+                i -= stop - start
+        elif isinstance(i, Variable):
+            for n, e in enumerate(list_elements(segments)):
+                res = unify_all(result, [(index, n), (element, e)])
+                if res is not None:
+                    yield res
+
+
+class member(BinaryArg):
+    "member(X, List): X is an element of the (known part of the) List"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        segments, tail = list_segments(self.right, result.walk)
+        for e in list_elements(segments):
+            res = unify_all(result, [(self.left, e)])
+            if res is not None:
+                yield res
+
+
+# Text
+# ----
+#
+# The text builtins take Atoms, strs, bytes, memoryviews and Texts (see
+# logicpy.data.Text), and work on offsets into them. The parts they give are
+# Atoms for Atoms (like Prolog) and Text slices otherwise, so a large buffer is
+# never copied. Nondeterministic splits are enumerated one at a time.
+
+def text_input(arg, result, name, dbg):
+    "The Text of arg, unbound, or None (after telling dbg why) if it's neither"
+    value = result.walk(arg)
+    if isinstance(value, Variable):
+        return unbound
+    text = as_text(value)
+    if text is None:
+        dbg.output(f"{name} should be text, not {value}")
+    return text
+
+
+def text_part(source, text, start, stop):
+    "text[start:stop], as an Atom if source (the term text came from) is one"
+    if isinstance(source, Atom):
+        return Atom(text[start:stop].value(), been_scoped=True)
+    return text[start:stop]
+
+
+class atom_length(BinaryArg):
+    "atom_length(Text, Length): Text has Length characters (or bytes)"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        text = text_input(self.left, result, "Text", dbg)
+        if text is unbound:
+            dbg.output("atom_length needs Text")
+        elif text is not None:
+            res = unify_all(result, [(self.right, len(text))])
+            if res is not None:
+                yield res
+    
+    def __str__(self):
+        return f"atom_length({self.left}, {self.right})"
+
+
+class sub_atom(MultiArg):
+    """sub_atom(Text, Before, Length, After, Sub): Sub is the part of Text that is
+    Length long, with Before characters before it and After after it. A known Sub
+    is searched for, the other cases enumerate the possible parts."""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        source, before, length, after, sub = self.args
+        text = text_input(source, result, "Text", dbg)
+        known = [integer_input(a, result, name, dbg) for a, name in ((before, "Before"), (length, "Length"), (after, "After"))]
+        part = text_input(sub, result, "Sub", dbg)
+        if text is None or part is None or any(k is None for k in known):
+            return
+        elif text is unbound:
+            dbg.output("sub_atom needs Text")
+            return
+        
+        n = len(text)
+        source = result.walk(source)
+        for start, stop in self.spans(text, *known, part):
+            pairs = [(before, start), (length, stop - start), (after, n - stop)]
+            if part is unbound:
+                pairs.append((sub, text_part(source, text, start, stop)))
+            res = unify_all(result, pairs)
+            if res is not None:
+                yield res
+    
+    @staticmethod
+    def spans(text, before, length, after, part):
+        "Yields the (start, stop) offsets of the possible parts"
+        n = len(text)
+        if part is not unbound:
+            if not part.same_kind(text) or length is not unbound and length != len(part):
+                return
+            length = len(part)
+            if before is unbound and after is unbound:
+                needle = part.value()
+                i = text.find(needle)
+                while i >= 0:
+                    yield i, i + length
+                    i = text.find(needle, i + 1)
+                return
+        
+        if before is not unbound:
+            starts = (before,)
+        elif length is not unbound and after is not unbound:
+            starts = (n - length - after,)
+        else:
+            starts = range(n + 1)
+        for start in starts:
+            if length is not unbound:
+                stops = (start + length,)
+            elif after is not unbound:
+                stops = (n - after,)
+            else:
+                stops = range(start, n + 1)
+            for stop in stops:
+                if 0 <= start <= stop <= n and (part is unbound or text[start:stop] == part):
+                    yield start, stop
+    
+    def __str__(self):
+        return f"sub_atom({', '.join(map(str, self.args))})"
+
+
+class atom_concat(MultiArg):
+    """atom_concat(A, B, AB): AB is A followed by B. With only AB known, it
+    enumerates the ways to split it"""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        left, right, total = self.args
+        a, b, ab = (text_input(t, result, name, dbg) for t, name in zip(self.args, ("A", "B", "AB")))
+        if a is None or b is None or ab is None:
+            return
+        
+        if ab is unbound:
+            if a is unbound or b is unbound:
+                dbg.output("atom_concat needs A and B, or AB")
+            elif a.same_kind(b):
+                joined = a.value() + b.value()
+                if isinstance(result.walk(left), Atom) and isinstance(result.walk(right), Atom):
+                    joined = Atom(joined, been_scoped=True)
+                res = unify_all(result, [(total, joined)])
+                if res is not None:
+                    yield res
+            return
+        
+        n = len(ab)
+        if a is not unbound:
+            splits = (len(a),) if ab[:len(a)] == a else ()
+        elif b is not unbound:
+            splits = (n - len(b),) if len(b) <= n else ()
+        else:
+            splits = range(n + 1)
+        source = result.walk(total)
+        for i in splits:
+            if b is not unbound and ab[i:] != b:
+                continue
+            pairs = []
+            if a is unbound:
+                pairs.append((left, text_part(source, ab, 0, i)))
+            if b is unbound:
+                pairs.append((right, text_part(source, ab, i, n)))
+            res = unify_all(result, pairs) if pairs else result
+            if res is not None:
+                yield res
+    
+    def __str__(self):
+        return f"atom_concat({', '.join(map(str, self.args))})"
+
+
+class atom_codes(BinaryArg):
+    """atom_codes(Text, Codes): Codes is the list of character codes (or bytes) of
+    Text. That list is a view of Text, not a copy."""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        text = text_input(self.left, result, "Text", dbg)
+        if text is None:
+            return
+        elif text is not unbound:
+            pairs = [(self.right, ListTerm.view(text.codes(), been_scoped=True))]
+        else:
+            segments, tail = list_segments(self.right, result.walk)
+            codes = [result.walk(e) for e in list_elements(segments)]
+            if not is_nil(tail) or not all(isinstance(c, int) for c in codes):
+                dbg.output("atom_codes needs Text or a list of character codes")
+                return
+            try:
+                pairs = [(self.left, Atom(''.join(map(chr, codes)), been_scoped=True))]
+            except ValueError as e:
+                dbg.output(f"Not a character code: {e}")
+                return
+        res = unify_all(result, pairs)
+        if res is not None:
+            yield res
+    
+    def __str__(self):
+        return f"atom_codes({self.left}, {self.right})"
+
+
+class split_string(MultiArg):
+    """split_string(Text, SepChars, PadChars, Parts): Parts are the Text slices
+    between the characters in SepChars, with the characters in PadChars removed from
+    both ends of each. Without SepChars, Parts is Text with its padding removed."""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        text, seps, pad = (text_input(a, result, name, dbg) for a, name in zip(self.args, ("Text", "SepChars", "PadChars")))
+        if text is None or seps is None or pad is None:
+            return
+        elif any(t is unbound for t in (text, seps, pad)):
+            dbg.output("split_string needs Text, SepChars and PadChars")
+            return
+        elif not (text.same_kind(seps) and text.same_kind(pad)):
+            dbg.output("split_string can't mix str and bytes")
+            return
+        
+        bounds = [text.start]
+        if len(seps):
+            separator = re.compile(b'[' + re.escape(seps.value()) + b']' if text.is_bytes else
+                                   '[' + re.escape(seps.value()) + ']')
+            for match in separator.finditer(text.data, text.start, text.stop):
+                bounds.extend((match.start(), match.end()))
+        bounds.append(text.stop)
+        
+        pad, data = set(pad.value()), text.data  # characters, or ints for bytes
+        parts = []
+        for start, stop in zip(bounds[::2], bounds[1::2]):
+            while start < stop and data[start] in pad:
+                start += 1
+            while stop > start and data[stop - 1] in pad:
+                stop -= 1
+            parts.append(Text(data, start, stop))
+        res = unify_all(result, [(self.args[3], ListTerm.view(parts, been_scoped=True))])
+        if res is not None:
+            yield res
+    
+    def __str__(self):
+        return f"split_string({', '.join(map(str, self.args))})"
+
+
+# Standard order of terms
+# -----------------------
+
+ORDERS = {'@<': (False, True), '@=<': (False, False), '@>': (True, True), '@>=': (True, False)}  # reverse, dedupe
+
+
+def sorted_elements(lst, result, dbg, key=order_key, reverse=False, dedupe=False):
+    """The elements of a proper list, sorted on key(element, walk), as a list term
+    sharing the elements, or None (after telling dbg why) if that's impossible"""
+    segments, tail = list_segments(lst, result.walk)
+    if not is_nil(tail):
+        dbg.output(f"Can't sort a list ending in {tail}")
+        return None
+    try:
+        keyed = [(key(e, result.walk), e) for e in list_elements(segments)]
+    except ValueError as e:
+        dbg.output(f"Can't sort: {e}")
+        return None
+    keyed.sort(key=operator.itemgetter(0), reverse=reverse)  # stable, also in reverse
+    if dedupe:
+        keyed = [item for i, item in enumerate(keyed) if i == 0 or item[0] != keyed[i - 1][0]]
+    return ListTerm.view(tuple(e for k, e in keyed), been_scoped=True)
+
+
+def argument_key(n):
+    "The standard order key of argument n (1-based) of a Compound"
+    def key(term, walk):
+        term = walk(term)
+        if not isinstance(term, Compound) or not 1 <= n <= len(term.children):
+            raise ValueError(f"{term} has no argument {n}")
+        return order_key(term.children[n - 1], walk)
+    return key
+
+
+def pair_key(term, walk):
+    "The standard order key of the Key of a Key - Value pair"
+    term = walk(term)
+    if not isinstance(term, Compound) or term.name != '-' or len(term.children) != 2:
+        raise ValueError(f"{term} is not a Key - Value pair")
+    return order_key(term.children[0], walk)
+
+
+class compare(MultiArg):
+    "compare(Order, A, B): Order is the atom <, = or >, comparing A to B in the standard order"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        order, a, b = self.args
+        ka, kb = order_key(a, result.walk), order_key(b, result.walk)
+        res = unify_all(result, [(order, Atom('<' if ka < kb else '>' if ka > kb else '=', been_scoped=True))])
+        if res is not None:
+            yield res
+
+
+class msort(BinaryArg):
+    "msort(List, Sorted): Sorted has the elements of List in standard order"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        lst = sorted_elements(self.left, result, dbg)
+        if lst is not None:
+            res = unify_all(result, [(self.right, lst)])
+            if res is not None:
+                yield res
+
+
+class sort(MultiArg):
+    """sort(List, Sorted): msort without duplicates.
+    sort(Key, Order, List, Sorted): sorts on argument Key (1-based, 0 for the whole
+    term), with Order '@<' or '@>' (dropping duplicate keys), '@=<' or '@>=' (stable)"""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        if len(self.args) == 2:
+            lst, out = self.args
+            key, reverse, dedupe = order_key, False, True
+        else:
+            n, order, lst, out = (result.walk(a) for a in self.args)
+            order = order.name if isinstance(order, Atom) else order
+            if not isinstance(n, int) or order not in ORDERS:
+                dbg.output(f"sort/4 needs an integer key and one of {', '.join(ORDERS)}, got {n} and {order}")
+                return
+            key = order_key if n == 0 else argument_key(n)
+            reverse, dedupe = ORDERS[order]
+        lst = sorted_elements(lst, result, dbg, key, reverse, dedupe)
+        if lst is not None:
+            res = unify_all(result, [(out, lst)])
+            if res is not None:
+                yield res
+
+
+class keysort(BinaryArg):
+    "keysort(Pairs, Sorted): Sorted has the Key - Value pairs of Pairs stably sorted on Key"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        lst = sorted_elements(self.left, result, dbg, pair_key)
+        if lst is not None:
+            res = unify_all(result, [(self.right, lst)])
+            if res is not None:
+                yield res
+
+
+# Coroutining
+# -----------
+#
+# Goals can be delayed until variables are bound: the Result carries them along
+# with its bindings, and and_ and PredicateCall wake them when a new binding
+# triggers them. freeze waits for a variable, when for a condition and dif for
+# its arguments to become identical (fail) or non-unifiable (succeed).
+
+class Delayed:
+    "A goal waiting for one of the variables waiting_on to be bound, and then for condition"
+    
+    def __init__(self, goal, waiting_on, condition=None):
+        self.goal = goal
+        self.waiting_on = waiting_on
+        self.condition = condition
+    
+    def triggered(self, result):
+        return any(result.walk(v) is not v for v in self.waiting_on)
+    
+    def resume(self, result, dbg):
+        if self.condition is not None:
+            waiting = waiting_on(self.condition, result)
+            if waiting:
+                yield result.with_delayed(result.delayed + (Delayed(self.goal, waiting, self.condition),))
+                return
+        yield from self.goal.prove(result, dbg)
+    
+    def occurences(self, O):
+        O.update(self.waiting_on)
+        occurences(self.goal, O)
+        occurences(self.condition, O)
+    
+    def __str__(self):
+        return str(self.goal) if self.condition is None else f"when({self.condition}, {self.goal})"
+    
+    __repr__ = __str__
+
+
+class Frozen(Delayed):
+    """The goal of freeze, waiting for its variable to become a nonvar. Being bound
+    to another variable only makes it wait for that one."""
+    
+    def resume(self, result, dbg):
+        var, = self.waiting_on
+        value = result.walk(var)
+        if isinstance(value, Variable):
+            yield result.with_delayed(result.delayed + (Frozen(self.goal, {value}),))
+        else:
+            yield from self.goal.prove(result, dbg)
+
+
+def wake(result, dbg):
+    "Proves the delayed goals of result that were triggered by new bindings, yields the results"
+    for d in result.delayed:
+        if d.triggered(result):
+            rest = result.with_delayed(other for other in result.delayed if other is not d)
+            for res in d.resume(rest, dbg):
+                if res is PAUSE:
+                    yield res
+                else:
+                    yield from wake(res, dbg)
+            return
+    yield result
+
+
+def free_variables(term, result):
+    "The unbound variables in term, in order of appearance"
+    found = {}
+    todo = [term]
+    while todo:
+        t = result.walk(todo.pop())
+        if isinstance(t, Variable):
+            found.setdefault(t, None)
+        elif isinstance(t, ListTerm):
+            if not t.ground:
+                segments, tail = list_segments(t, result.walk)
+                todo.append(tail)
+                todo.extend(reversed(list(list_elements(segments))))
+        elif isinstance(t, Compound):
+            todo.extend(reversed(t.children))
+    return list(found)
+
+
+def unifier_variables(a, b, result):
+    """The variables that unifying a and b would bind (both sides of variable-variable
+    bindings), the empty set if they are identical, or None if they don't unify"""
+    try:
+        mgu = (result | {(a, b)}).mgu()
+    except UnificationFail:
+        return None
+    variables = set()
+    for A, B in mgu:
+        if isinstance(A, Variable) and result.walk(A) is A:
+            B = result.walk(B)
+            if isinstance(B, Variable):
+                if B.really_equal(A):
+                    continue  # the same aliasing, solved the other way around
+                variables.add(B)
+            variables.add(A)
+    return variables
+
+
+def waiting_on(condition, result):
+    """The variables to wait for until condition (of when/2) can hold, or None if it
+    holds. Conditions: nonvar(X), ground(X), ?=(X, Y) (X and Y are identical or
+    can't unify), conjunctions ','(C1, C2) or all(C1, ...) and disjunctions
+    ';'(C1, C2) or any(C1, ...)"""
+    condition = result.walk(condition)
+    if not isinstance(condition, Compound):
+        raise ValueError(f"Unknown condition {condition}")
+    name, args = condition.name, condition.children
+    if name == 'nonvar' and len(args) == 1:
+        value = result.walk(args[0])
+        return {value} if isinstance(value, Variable) else None
+    elif name == 'ground' and len(args) == 1:
+        free = free_variables(args[0], result)
+        return {free[0]} if free else None
+    elif name == '?=' and len(args) == 2:
+        return unifier_variables(args[0], args[1], result) or None
+    elif name in (',', 'all'):
+        for c in args:
+            waiting = waiting_on(c, result)
+            if waiting:
+                return waiting
+        return None
+    elif name in (';', 'any'):
+        variables = set()
+        for c in args:
+            waiting = waiting_on(c, result)
+            if not waiting:
+                return None
+            variables |= waiting
+        return variables
+    raise ValueError(f"Unknown condition {condition}")
+
+
+class when(BinaryArg):
+    "when(Condition, Goal): proves Goal once Condition holds, see waiting_on"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        try:
+            waiting = waiting_on(self.left, result)
+        except ValueError as e:
+            dbg.output(str(e))
+            return
+        if waiting:
+            yield result.with_delayed(result.delayed + (Delayed(self.right, waiting, self.left),))
+        else:
+            yield from self.right.prove(result, dbg)
+    
+    def __str__(self):
+        return f"when({self.left}, {self.right})"
+
+
+class freeze(BinaryArg):
+    "freeze(X, Goal): proves Goal once X is bound"
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        value = result.walk(self.left)
+        if isinstance(value, Variable):
+            yield result.with_delayed(result.delayed + (Frozen(self.right, {value}),))
+        else:
+            yield from self.right.prove(result, dbg)
+    
+    def __str__(self):
+        return f"freeze({self.left}, {self.right})"
+
+
+class dif(BinaryArg):
+    """dif(A, B): A and B are different. Delayed while they can still become equal,
+    it fails as soon as they are identical"""
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        waiting = unifier_variables(self.left, self.right, result)
+        if waiting is None:
+            yield result
+        elif waiting:
+            yield result.with_delayed(result.delayed + (Delayed(self, waiting),))
+        else:
+            dbg.output(f"{self.left} and {self.right} are identical")
+    
+    def __str__(self):
+        return f"dif({self.left}, {self.right})"
+
+
+# AND-parallelism
+# ---------------
+
+def goal_variables(goal, result):
+    "The unbound variables a goal refers to, directly or through bound ones"
+    V = set()
+    occurences(goal, V)
+    free = set()
+    for var in V:
+        free.update(free_variables(var, result))
+    return free
+
+
+def independent_groups(goals, result):
+    """Splits goals into groups that share no unbound variables, keeping their
+    order. Goals in different groups can be proven independently."""
+    groups = []  # (variables, indices of goals)
+    for i, goal in enumerate(goals):
+        variables, indices = goal_variables(goal, result), [i]
+        for other in [g for g in groups if not g[0].isdisjoint(variables)]:
+            groups.remove(other)
+            variables |= other[0]
+            indices = other[1] + indices
+        groups.append((variables, indices))
+    return [[goals[i] for i in sorted(indices)] for variables, indices in sorted(groups, key=lambda g: min(g[1]))]
+
+
+class par_and(MultiArg):
+    """par_and(A, B, ...): like and_, but goals that share no unbound variables
+    when it is proven (checked every time) are proven concurrently, in the thread
+    pool par_and.executor, and their answers are combined. Dependent goals are
+    proven in order in the same group, like with and_. All answers of each group
+    are computed before the first answer is yielded, so they should be finite, and
+    a cut directly in a goal only cuts that goal. Each thread counts its inferences
+    on its own (QueryStats.fork), added to those of the query when it's done, and
+    stops once its answers aren't needed. Debugging runs it like and_."""
+    
+    executor = None  # a concurrent.futures.Executor, a ThreadPoolExecutor by default
+    
+    def __str__(self):
+        return f"par_and({', '.join(map(str, self.args))})"
+    
+    @classmethod
+    def get_executor(cls):
+        if cls.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            cls.executor = ThreadPoolExecutor(thread_name_prefix='par_and')
+        return cls.executor
+    
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        groups = independent_groups(list(self.args), result)
+        if len(groups) == 1 or dbg or result.delayed:
+            yield from and_(*self.args).prove_arg(0, result, dbg)
+            return
+        
+        import contextvars, threading
+        executor, stats, cancel = self.get_executor(), query_stats.get(), threading.Event()
+        tasks = [(group, executor.submit(contextvars.copy_context().run, worker_answers, group, result, dbg, stats, cancel))
+                 for group in groups[1:]]
+        try:
+            answer_sets = [[]]
+            yield from all_answers(groups[0], result, dbg, answer_sets[0])
+            for group, future in tasks:
+                if not answer_sets[-1]:
+                    return
+                # Run it here if no thread started it yet, so nested par_ands can't deadlock
+                if future.cancel():
+                    answers = []
+                    yield from all_answers(group, result, dbg, answers)
+                else:
+                    answers, child = future.result()
+                    if stats is not None:
+                        stats.merge(child)
+                        if stats.should_pause():
+                            yield PAUSE
+                answer_sets.append(answers)
+        finally:
+            cancel.set()
+            for group, future in tasks:
+                future.cancel()
+        
+        for combination in product(*answer_sets):
+            total = result
+            for res in combination:
+                total = total | res
+            try:
+                yield total.mgu()
+            except UnificationFail as e:
+                if dbg:
+                    dbg.output(f"Independent answers don't unify: {e}")
+
+
+def all_answers(goals, result, dbg, answers):
+    "Appends the results proving the conjunction of goals to answers, yields PAUSE meanwhile"
+    try:
+        for res in and_(*goals).prove_arg(0, result, dbg):
+            if res is PAUSE:
+                yield PAUSE
+            else:
+                answers.append(res)
+    except PredicateCut:
+        pass
+
+
+def worker_answers(goals, result, dbg, stats, cancel):
+    """Proves the conjunction of goals in a thread of par_and, counting with a fork
+    of stats, and returns its results (none if cancel was set) and the fork"""
+    child = (stats or QueryStats()).fork(cancel)
+    query_stats.set(child)
+    answers = []
+    try:
+        for res in all_answers(goals, result, dbg, answers):
+            pass
+    except QueryCancelled:
+        return [], child
+    return answers, child
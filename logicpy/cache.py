@@ -0,0 +1,117 @@
+
+# Answer cache
+# ------------
+#
+# Caches all answers of goals that are a single predicate call. Goals are keyed
+# on their variant-normalised form (variables numbered in order of occurence),
+# so p(a, X) and p(a, Y) share an entry. Each entry remembers the predicates it
+# depends on, so Universe.define only drops the entries it may have changed.
+
+from collections import defaultdict
+
+from logicpy.data import Term, Atom, Compound, Variable, ListTerm, list_elements, is_ground
+from logicpy.result import Result
+from logicpy.limits import PAUSE
+from logicpy.util.lru import LRUCache
+
+
+def variant_key(args):
+    """A hashable key for a sequence of terms in which variables are numbered in
+    order of first occurence, so terms that are variants of each other get the
+    same key. Also returns the variables in that order."""
+    numbers = {}
+    key = []
+    todo = list(reversed(args))
+    while todo:
+        t = todo.pop()
+        if isinstance(t, Variable):
+            key.append(('V', numbers.setdefault(t, len(numbers))))
+        elif isinstance(t, ListTerm):
+            segments, tail = t.segments()
+            elements = list(list_elements(segments))
+            key.append(('L', len(elements)))
+            todo.append(tail)
+            todo.extend(reversed(elements))
+        elif isinstance(t, Compound):
+            key.append((type(t).__name__, t.name, len(t.children)))
+            todo.extend(reversed(t.children))
+        elif isinstance(t, Atom):
+            key.append(('A', t.name))
+        elif isinstance(t, Term):
+            raise TypeError(f"Can't make a key for unscoped term {t!r}")
+        else:
+            key.append((type(t), t))
+    return tuple(key), list(numbers)
+
+
+class AnswerCache(LRUCache):
+    """LRU cache of the answers of (variant) goals. Only goals whose answers are
+    all ground, and no more than max_answers, are cached. Cached goals should be
+    free of side effects: on a hit, nothing is proven."""
+    
+    def __init__(self, maxsize=1024, max_answers=1000):
+        super().__init__(maxsize)
+        self.max_answers = max_answers
+        self.invalidations = 0
+        self.generation = 0  # bumped on every invalidation
+        self._by_signature = defaultdict(set)
+    
+    def store(self, key, answers, dependencies, generation):
+        with self._lock:
+            if generation != self.generation:
+                return  # The universe changed while these answers were computed
+            self.put(key, (answers, dependencies))
+            for sig in dependencies:
+                self._by_signature[sig].add(key)
+    
+    def removed(self, key, value):
+        for sig in value[1]:
+            keys = self._by_signature[sig]
+            keys.discard(key)
+            if not keys:
+                del self._by_signature[sig]
+    
+    def invalidate(self, sig):
+        with self._lock:
+            self.generation += 1
+            for key in list(self._by_signature.get(sig, ())):
+                self.pop(key)
+                self.invalidations += 1
+    
+    def stats(self):
+        return {**super().stats(), 'invalidations': self.invalidations}
+    
+    def query(self, univ, goal, proofs, *options):
+        """Answers goal (a scoped PredicateCall) from the cache, or yields the
+        results of proofs while recording them. Options that influence the
+        answers (like the occurs check mode) are part of the key."""
+        try:
+            key, variables = variant_key(goal.args)
+            key = (goal.signature, key, options)
+            hash(key)
+        except TypeError:
+            yield from proofs
+            return
+        variables = [v for v in variables if v.scope == 0]
+        
+        entry = self.get(key)
+        if entry is not None:
+            for values in entry[0]:
+                yield Result(zip(variables, values))
+            return
+        
+        generation = self.generation
+        answers = []
+        for res in proofs:
+            if res is PAUSE:
+                yield res
+                continue
+            if answers is not None:
+                values = tuple(res.walk(v) for v in variables)
+                if len(answers) < self.max_answers and all(map(is_ground, values)) and not res.delayed:
+                    answers.append(values)
+                else:
+                    answers = None
+            yield res
+        if answers is not None:
+            self.store(key, tuple(answers), univ.dependencies([goal.signature]), generation)
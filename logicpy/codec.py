@@ -0,0 +1,272 @@
+# Binary term codec
+# -----------------
+#
+# A compact encoding of terms (and the Python values in them) to bytes, to move
+# them between processes or store them. Every value starts with a tag byte.
+# Names (of atoms, compounds, variables) and strings go through a symbol table,
+# so each is written once and referred to by number afterwards. Lengths and
+# integers are varints. A compound, list or tuple that occurs more than once (the
+# same object) is written once and referred to by its node number. Encoding and
+# decoding use an explicit stack, so long lists don't hit the recursion limit,
+# and decoding reads a memoryview of the data without copying it.
+#
+#   symbol:    varint 0, varint length, UTF-8 bytes    (new)
+#              varint n                                 (the n-th symbol)
+#   ATOM:      symbol
+#   COMPOUND:  symbol, varint arity, arguments
+#   VARIABLE:  symbol, varint scope + 1 (0 for unscoped)
+#   LIST:      varint n, n elements, tail
+#   TUPLE, PYLIST: varint n, n items
+#   REF:       varint node number (of a COMPOUND, LIST, TUPLE or PYLIST)
+#   INT:       zigzag varint        FLOAT: 8 bytes    STR: symbol
+#   BYTES:     varint length, bytes                   OBJECT: pickled bytes
+#
+# The SCOPED flag on ATOM, COMPOUND and LIST tags marks terms that have been
+# scoped. Texts are written as STR or BYTES. Other objects (like the functions in
+# EvalCompounds) are pickled.
+
+import pickle
+import struct
+
+from logicpy.data import Atom, Compound, Variable, ListTerm, Text, list_segments, list_elements
+from logicpy.result import Result
+
+MAGIC = b'LPT\x01'
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, BYTES, ATOM, COMPOUND, VARIABLE, LIST, TUPLE, PYLIST, REF, OBJECT = range(15)
+SCOPED = 0x80
+
+_double = struct.Struct('<d')
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def dumps(obj):
+    "Encodes a term, or Python value containing terms, to bytes"
+    out = bytearray(MAGIC)
+    symbols = {}  # name -> number
+    nodes = {}  # id of a compound, list or tuple -> node number
+    keep = []  # the objects in nodes, so their ids aren't reused meanwhile
+
+    def varint(n):
+        while n > 0x7f:
+            out.append(n & 0x7f | 0x80)
+            n >>= 7
+        out.append(n)
+
+    def symbol(name):
+        if name in symbols:
+            varint(symbols[name] + 1)
+        else:
+            symbols[name] = len(symbols)
+            data = name.encode('utf-8')
+            out.append(0)
+            varint(len(data))
+            out.extend(data)
+
+    def node(o):
+        "Writes a reference if o was written before, else numbers it"
+        if id(o) in nodes:
+            out.append(REF)
+            varint(nodes[id(o)])
+            return False
+        nodes[id(o)] = len(nodes)
+        keep.append(o)
+        return True
+
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        t = type(o)
+        if t is Text:
+            o = o.value()  # decoded as the str or bytes it is equal to
+            t = type(o)
+        if o is None:
+            out.append(NONE)
+        elif t is bool:
+            out.append(TRUE if o else FALSE)
+        elif t is int:
+            out.append(INT)
+            varint(o << 1 if o >= 0 else (-o << 1) - 1)
+        elif t is float:
+            out.append(FLOAT)
+            out.extend(_double.pack(o))
+        elif t is str:
+            out.append(STR)
+            symbol(o)
+        elif t is Atom:
+            out.append(ATOM | SCOPED if o.been_scoped else ATOM)
+            symbol(o.name)
+        elif t is Variable:
+            out.append(VARIABLE)
+            symbol(o.name)
+            varint(0 if o.scope is None else o.scope + 1)
+        elif t is Compound:
+            if node(o):
+                out.append(COMPOUND | SCOPED if o.been_scoped else COMPOUND)
+                symbol(o.name)
+                varint(len(o.children))
+                todo.extend(reversed(o.children))
+        elif t is ListTerm:
+            if node(o):
+                segments, tail = list_segments(o)
+                elements = list(list_elements(segments))
+                out.append(LIST | SCOPED if o.been_scoped else LIST)
+                varint(len(elements))
+                todo.append(tail)
+                todo.extend(reversed(elements))
+        elif t is tuple or t is list:
+            if node(o):
+                out.append(TUPLE if t is tuple else PYLIST)
+                varint(len(o))
+                todo.extend(reversed(o))
+        elif t is bytes:
+            out.append(BYTES)
+            varint(len(o))
+            out.extend(o)
+        else:
+            data = pickle.dumps(o, pickle.HIGHEST_PROTOCOL)
+            out.append(OBJECT)
+            varint(len(data))
+            out.extend(data)
+    return bytes(out)
+
+
+def loads(data):
+    "Decodes the bytes (or bytearray, memoryview) made by dumps"
+    buf = memoryview(data).cast('B')
+    if buf[:len(MAGIC)] != MAGIC:
+        raise DecodeError("Not an encoded term")
+    decoder = _Decoder(buf)
+    try:
+        value = decoder.run()
+    except IndexError as e:
+        raise DecodeError("Truncated data") from e
+    if decoder.pos != len(buf):
+        raise DecodeError("Data after the end of the term")
+    return value
+
+
+class _Decoder:
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = len(MAGIC)
+        self.symbols = []
+        self.atoms = {}  # (name, scoped) -> Atom, atoms are shared
+    
+    def varint(self):
+        buf, pos = self.buf, self.pos
+        n = shift = 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                self.pos = pos
+                return n
+            shift += 7
+    
+    def chunk(self):
+        n = self.varint()
+        start = self.pos
+        self.pos += n
+        if self.pos > len(self.buf):
+            raise DecodeError("Truncated data")
+        return self.buf[start:self.pos]
+    
+    def symbol(self):
+        n = self.buf[self.pos]
+        if 0 < n < 0x80:  # the common case: a known symbol with a small number
+            self.pos += 1
+            return self.symbols[n - 1]
+        n = self.varint()
+        if n:
+            return self.symbols[n - 1]
+        name = str(self.chunk(), 'utf-8')
+        self.symbols.append(name)
+        return name
+    
+    def run(self):
+        buf, symbol, varint, atoms = self.buf, self.symbol, self.varint, self.atoms
+        nodes = []
+        stack = []  # unfinished containers: (tag, name, length, items, node number)
+        items, length = None, 0  # of the innermost unfinished container
+        while True:
+            tag = buf[self.pos]
+            self.pos += 1
+            if tag == INT:
+                n = varint()
+                value = n >> 1 if not n & 1 else -((n + 1) >> 1)
+            elif tag == STR:
+                value = symbol()
+            elif tag & ~SCOPED == ATOM:
+                key = symbol(), tag
+                value = atoms.get(key)
+                if value is None:
+                    value = atoms[key] = Atom(key[0], been_scoped=tag != ATOM)
+            elif tag == FLOAT:
+                value, = _double.unpack_from(buf, self.pos)
+                self.pos += _double.size
+            elif tag == NONE:
+                value = None
+            elif tag == FALSE or tag == TRUE:
+                value = tag == TRUE
+            elif tag == VARIABLE:
+                name = symbol()
+                scope = varint()
+                value = Variable(name, None if scope == 0 else scope - 1)
+            elif tag & ~SCOPED in (COMPOUND, LIST) or tag in (TUPLE, PYLIST):
+                name = symbol() if tag & ~SCOPED == COMPOUND else None
+                n = varint() + (tag & ~SCOPED == LIST)  # and the tail
+                nodes.append(None)
+                if n:
+                    items, length = [], n
+                    stack.append((tag, name, length, items, len(nodes) - 1))
+                    continue
+                value = nodes[-1] = build(tag, name, [])
+            elif tag == REF:
+                value = nodes[varint()]
+                if value is None:
+                    raise DecodeError("Reference to an unfinished term")
+            elif tag == BYTES:
+                value = bytes(self.chunk())
+            elif tag == OBJECT:
+                value = pickle.loads(self.chunk())
+            else:
+                raise DecodeError(f"Unknown tag {tag}")
+            
+            # Add the value to its container, and finish the containers that are complete
+            while True:
+                if items is None:
+                    return value
+                items.append(value)
+                if len(items) < length:
+                    break
+                tag, name, length, items, number = stack.pop()
+                value = nodes[number] = build(tag, name, items)
+                items, length = (stack[-1][3], stack[-1][2]) if stack else (None, 0)
+
+
+def build(tag, name, items):
+    kind, scoped = tag & ~SCOPED, bool(tag & SCOPED)
+    if kind == COMPOUND:
+        return Compound(name, items, been_scoped=scoped)
+    elif kind == LIST:
+        *elements, tail = items
+        return ListTerm.view(elements, tail=tail, been_scoped=scoped)
+    elif kind == TUPLE:
+        return tuple(items)
+    return items
+
+
+def dumps_result(result):
+    "Encodes the bindings of a Result. Delayed goals can't be encoded."
+    if result.delayed:
+        raise ValueError("Can't encode a result with delayed goals")
+    return dumps(tuple(result.identities))
+
+
+def loads_result(data):
+    return Result(loads(data))
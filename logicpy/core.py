@@ -1,16 +1,63 @@
 
-from logicpy.predicate import Predicate, NoArgument
-from logicpy.data import Variable, Atom, NamedTerm
-from logicpy.builtin import Fail, unify, shell_builtins
-from logicpy.result import Result
+import contextvars
+import sys
+import threading
+from itertools import islice
+
+from logicpy.predicate import Predicate, NoArgument, PredicateCall, Signature, PredicateNotFound
+from logicpy.data import Variable, Atom, NamedTerm, Term, with_scope
+from logicpy.builtin import True_, Fail, unify, and_, prove_many, shell_builtins
+from logicpy.result import Result, UnificationFail, occurs_check as occurs_check_mode, OCCURS_CHECK_MODES
 from logicpy.structure import Structure
 from logicpy.debug import Debugger, NoDebugger
+from logicpy.datalog import materialize
+from logicpy.cache import AnswerCache
+from logicpy.memory import memory_report
+from logicpy.views import View
+from logicpy.sources import ConnectionPool
+from logicpy.limits import QueryStats, ResourceExceeded, query_stats
+from logicpy.engines import Engine
+from logicpy.search import search
 from logicpy.util.getch import getch
 
 
+def run_in_context(ctx, gen):
+    """Runs the steps of generator gen inside the contextvars.Context ctx. Running out
+    of stack is reported as exceeding the depth limit of the query."""
+    try:
+        while True:
+            try:
+                item = ctx.run(next, gen)
+            except StopIteration:
+                return
+            except RecursionError as e:
+                raise ResourceExceeded('depth', sys.getrecursionlimit(), ctx[query_stats]) from e
+            yield item
+    finally:
+        ctx.run(gen.close)
+
+
+class FrozenUniverse(Exception):
+    pass
+
+
 class Universe:
-    def __init__(self):
-        self._predicates = {}
+    def __init__(self, *, occurs_check='true'):
+        """occurs_check is the default unification mode of queries: 'true' fails
+        on cyclic terms, 'false' allows them (rational trees, faster), and 'error'
+        raises an OccursCheckError when one would be created."""
+        self.occurs_check = self._check_mode(occurs_check)
+        self._predicates = {}  # replaced on change (copy-on-write), see define
+        self._materialized = {}  # signature -> signatures its table was computed from
+        self._magic = {}  # (signature, adornment) -> (rewritten program, its fact tables, signatures it was computed from)
+        self._base_tables = {}  # signature -> FactTable of its facts (or None if it has rules), see logicpy.datalog
+        self.answer_cache = None
+        self._pools = {}  # database -> ConnectionPool
+        self._views = []
+        self._optimized = {}  # signature -> ({id(new clause): (new, original)}, signatures unfolded into it)
+        self._generation = 0  # bumped on every change to the predicates
+        self._lock = threading.RLock()  # serializes changes, queries don't take it
+        self.frozen = False
         
     def namespace(self):
         return Namespace(self)
@@ -20,8 +67,79 @@ class Universe:
     
     def define(self, clause):
         sig = clause.signature
-        pred = self._predicates.setdefault(sig, Predicate(sig))
-        pred.add_clause(clause)
+        with self._lock:
+            pred = self._get_or_add(sig)
+            pred.add_clause(clause)
+            self._invalidate(sig)
+            for view in self._views:
+                view.added(clause)
+    
+    def retract(self, goal):
+        """Removes the first fact (clause without body) that unifies with goal, like
+        retract/1 in Prolog. Returns whether there was one."""
+        sig = goal.signature
+        args = [with_scope(a, 0) for a in getattr(goal, 'args', ())]
+        with self._lock:
+            pred = self.get_pred(sig)
+            if pred is None:
+                return False
+            for clause in pred.clauses:
+                if clause.body is not True_:
+                    continue
+                scope = Structure.scope_id()
+                try:
+                    Result(zip((with_scope(a, scope) for a in clause.args), args)).mgu()
+                except UnificationFail:
+                    continue
+                self._remove(pred, clause)
+                return True
+        return False
+    
+    def _remove(self, pred, clause):
+        with self._lock:
+            self._get_or_add(pred.signature)  # checks whether frozen
+            pred.remove_clause(clause)
+            self._invalidate(pred.signature)
+            for view in self._views:
+                view.removed(clause)
+    
+    def _get_or_add(self, sig):
+        if self.frozen:
+            raise FrozenUniverse(f"Can't change {sig}, the universe is frozen")
+        pred = self._predicates.get(sig)
+        if pred is None:
+            # Running queries keep reading the old dictionary
+            pred = Predicate(sig)
+            self._predicates = {**self._predicates, sig: pred}
+        return pred
+    
+    def freeze(self):
+        """Disallows defining clauses and attaching sources from now on. Queries never
+        change a universe, frozen or not, so threads can share it, see the README."""
+        self.frozen = True
+        return self
+    
+    def _invalidate(self, sig):
+        self._generation += 1
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(sig)
+        for mat, deps in list(self._materialized.items()):
+            if sig in deps:
+                self._predicates[mat].source = None
+                del self._materialized[mat]
+        for key, (program, base, deps) in list(self._magic.items()):
+            if sig in deps:
+                del self._magic[key]
+        self._base_tables.pop(sig, None)
+        for opt, (originals, deps) in list(self._optimized.items()):
+            if sig in deps:
+                self._deoptimize(opt)
+    
+    def _deoptimize(self, sig):
+        "Puts back the clauses optimize replaced, keeping those defined since"
+        originals, deps = self._optimized.pop(sig)
+        pred = self._predicates[sig]
+        pred.clauses = tuple(originals[id(c)][1] if id(c) in originals else c for c in pred.clauses)
     
     def get_pred(self, sig):
         if sig in self._predicates:
@@ -29,9 +147,171 @@ class Universe:
         else:
             return None
     
-    def query(self, struc, *, debug=False):
+    def dependencies(self, signatures):
+        "All signatures the given ones (transitively) depend on, including themselves"
+        todo = [Signature.parse(s) for s in signatures]
+        seen = set()
+        while todo:
+            sig = todo.pop()
+            if sig not in seen:
+                seen.add(sig)
+                pred = self.get_pred(sig)
+                if pred is not None:
+                    todo.extend(pred.dependencies())
+        return seen
+    
+    def materialize(self, signatures):
+        """Evaluates the given (Datalog) predicates bottom-up and stores them as fact
+        tables, which are used by calls until a predicate they depend on changes."""
+        with self._lock:
+            return materialize(self, signatures)
+    
+    def optimize(self, signatures=None, *, max_clauses=2, max_nodes=40):
+        """Partially evaluates the clauses of the given predicates (all by default), see
+        logicpy.optimize: calls to non-recursive predicates with at most max_clauses
+        clauses (of max_nodes term nodes together) are unfolded, arithmetic on
+        constants is folded and conjunctions are flattened. Answers stay the same.
+        Defining a clause of an unfolded predicate puts back the original clauses
+        of its callers. Returns the signatures whose clauses changed."""
+        from logicpy.optimize import optimize
+        with self._lock:
+            return optimize(self, signatures, max_clauses=max_clauses, max_nodes=max_nodes)
+    
+    def listing(self, signatures=None):
+        "The clauses of the given predicates (all by default) as text, e.g. to see what optimize did"
+        from logicpy.optimize import listing
+        return listing(self, signatures)
+    
+    def view(self, signatures):
+        """Like materialize, but keeps the tables up to date while facts are defined
+        and retracted, instead of dropping them. Returns the logicpy.views.View,
+        whose subscribers get the inserted and deleted rows on every change."""
+        with self._lock:
+            view = View(self, signatures)
+            self._views.append(view)
+            return view
+    
+    def set_oriented(self, signatures):
+        """Marks (Datalog) predicates for set-oriented evaluation: calls are evaluated
+        bottom-up, using a magic sets rewrite for the bound arguments of the call.
+        Rewritten programs are cached per binding pattern."""
+        for sig in map(Signature.parse, signatures):
+            pred = self.get_pred(sig)
+            if pred is None:
+                raise PredicateNotFound(f"Couldn't find predicate with signature {sig}")
+            pred.set_oriented = True
+    
+    def attach(self, signature, source):
+        """Answers calls of a predicate with an external source of facts instead of
+        its clauses, e.g. a table in a SQLite database. See logicpy.sources."""
+        sig = Signature.parse(signature)
+        with self._lock:
+            pred = self._get_or_add(sig)
+            self._invalidate(sig)
+            self._materialized.pop(sig, None)
+            source.attached(self, sig)
+            pred.source = source
+        return source
+    
+    def connection_pool(self, database):
+        "The pool of connections to a SQLite database, shared by the sources attached to this universe"
+        with self._lock:
+            if database not in self._pools:
+                self._pools[database] = ConnectionPool(database)
+            return self._pools[database]
+    
+    def enable_answer_cache(self, maxsize=1024, max_answers=1000):
+        """Caches the answers of queries for a single predicate call, see
+        logicpy.cache.AnswerCache. Returns the cache, e.g. for its stats()."""
+        self.answer_cache = AnswerCache(maxsize, max_answers)
+        return self.answer_cache
+    
+    @staticmethod
+    def _check_mode(occurs_check):
+        if occurs_check not in OCCURS_CHECK_MODES:
+            raise ValueError(f"occurs_check should be one of {', '.join(OCCURS_CHECK_MODES)}")
+        return occurs_check
+    
+    def _query_context(self, occurs_check, stats, limits):
+        "A context for running a query, with its settings in context variables"
+        mode = self._check_mode(occurs_check or self.occurs_check)
+        if stats is None:
+            stats = QueryStats(**limits)
+        elif limits:
+            raise ValueError("Give the limits to the QueryStats instead")
+        ctx = contextvars.copy_context()
+        ctx.run(occurs_check_mode.set, mode)
+        ctx.run(query_stats.set, stats)
+        return ctx, mode
+    
+    def query(self, struc, *, debug=False, occurs_check=None, stats=None, strategy='dfs', heuristic=None, **limits):
+        """Yields the results proving struc. Limits, checked on every predicate call,
+        make the query raise a logicpy.limits.ResourceExceeded when exceeded:
+          max_inferences: number of predicate calls
+          max_depth:      number of nested predicate calls (running out of stack
+                          raises a ResourceExceeded for depth too)
+          timeout:        seconds
+          max_memory:     growth of the memory of the process, in bytes
+        Pass a logicpy.limits.QueryStats as stats to read the counters afterwards.
+        strategy is 'dfs' (Prolog's), 'iddfs', 'bfs' or 'best_first', which expands
+        the states with the lowest heuristic(goals, result) first, see logicpy.search."""
+        ctx, mode = self._query_context(occurs_check, stats, limits)
+        
+        struc = struc.with_scope(0)
+        dbg = Debugger() if debug else NoDebugger()
+        if strategy != 'dfs':
+            yield from run_in_context(ctx, search(self, struc, dbg, strategy, heuristic))
+            return
+        proofs = struc.prove(Result(), dbg)
+        if self.answer_cache is not None and not debug and isinstance(struc, PredicateCall):
+            proofs = self.answer_cache.query(self, struc, proofs, mode)
+        yield from run_in_context(ctx, proofs)
+    
+    def query_many(self, struc, inputs, columns, *, batch_size=1024, debug=False, occurs_check=None, stats=None, **limits):
+        """Proves struc for many input bindings at once. inputs are variables (or their
+        names), columns holds a sequence of values for each of them (e.g. lists or NumPy
+        arrays). Yields (row index, result) pairs, the results of a row in order.
+        
+        The goal is set up once. The goals of a conjunction are proven for a batch of
+        rows at a time, so those calling vectorized functions (see evaluated and
+        provable) call them once per batch. Limits (see query) hold for all rows together."""
+        ctx, mode = self._query_context(occurs_check, stats, limits)
+        
+        inputs = [Variable(v, 0) if isinstance(v, str) else v.with_scope(0) for v in inputs]
+        columns = [c.tolist() if hasattr(c, 'tolist') else c for c in columns]
+        if len(inputs) != len(columns):
+            raise ValueError(f"Got {len(columns)} columns for {len(inputs)} inputs")
+        
         struc = struc.with_scope(0)
-        yield from struc.prove(Result(), Debugger() if debug else NoDebugger())
+        goals = struc.args if isinstance(struc, and_) else (struc,)
+        dbg = Debugger() if debug else NoDebugger()
+        yield from run_in_context(ctx, self._prove_many(goals, inputs, columns, batch_size, dbg))
+    
+    @staticmethod
+    def _prove_many(goals, inputs, columns, batch_size, dbg):
+        rows = enumerate(zip(*columns))
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            frames = []
+            for i, row in batch:
+                pairs = tuple(zip(inputs, (with_scope(v, 0) for v in row)))
+                if any(isinstance(v, Term) for var, v in pairs):
+                    try:
+                        frames.append((i, Result(pairs).mgu()))
+                    except UnificationFail:
+                        pass
+                else:
+                    frames.append((i, Result(pairs, dict(pairs))))
+            for goal in goals:
+                frames = prove_many(goal, frames, dbg)
+            yield from frames
+    
+    def engine(self, struc, **kwargs):
+        """A logicpy.engines.Engine proving struc, which runs a number of inferences
+        at a time when stepped. Takes the options of query."""
+        return Engine(self, struc, **kwargs)
     
     def simple_query(self, struc, limit=None, **kwargs):
         q = self.query(struc, **kwargs)
@@ -45,6 +325,11 @@ class Universe:
             return True
         return False
     
+    def memory_report(self):
+        """Approximate memory use per predicate: clauses, term nodes, bytes and the
+        sizes of tables answering it. See logicpy.memory, print it for a table."""
+        return memory_report(self)
+    
     def interactive(self):
         namespace = self.namespace()
         underscore = Underscore()
@@ -1,5 +1,7 @@
 
 import operator
+import re
+from itertools import islice
 
 
 # Free functions to enable working with 'foreign' constants
@@ -8,6 +10,8 @@ import operator
 def with_scope(obj, scope):
     if hasattr(obj, 'with_scope'):
         return obj.with_scope(scope)
+    elif isinstance(obj, list):
+        return ListTerm.view(obj).with_scope(scope)  # shares the list, no copy
     else:
         return obj
 
@@ -40,6 +44,15 @@ def instantiate(expr, result):
         return expr
 
 
+def is_ground(obj):
+    if isinstance(obj, (Atom, ListTerm)):
+        return obj.ground
+    elif isinstance(obj, Compound):
+        return all(is_ground(c) for c in obj.children)
+    else:
+        return not isinstance(obj, Term)  # Variables, Underscores
+
+
 
 # Terms and builtin operations
 # ----------------------------
@@ -175,6 +188,7 @@ class Atom(BasicTerm):
         return Compound(self.name, args)
     
     children = []
+    ground = True
 
 
 class NotInstantiated(Exception):
@@ -205,6 +219,9 @@ class Compound(BasicTerm):
         for c in self.children:
             occurences(c, O)
     
+    def with_children(self, children):
+        return Compound(self.name, children, been_scoped=self.been_scoped)
+    
     def replace(self, A, B):
         new_children = tuple(replace(c, A, B) for c in self.children)
         return Compound(self.name, new_children, been_scoped=self.been_scoped)
@@ -221,6 +238,9 @@ class EvalCompound(Compound):
         super().__init__(name, children, been_scoped)
         self.func = func
     
+    def with_children(self, children):
+        return type(self)(self.name, self.func, children, been_scoped=self.been_scoped)
+    
     def replace(self, A, B):
         new_children = tuple(replace(c, A, B) for c in self.children)
         return EvalCompound(self.name, self.func, new_children, been_scoped=self.been_scoped)
@@ -278,3 +298,357 @@ class Variable(NamedTerm):
     def instantiate(self, result):
         return result.get_var(self)
 
+
+
+# Lists
+# -----
+
+nil = Atom('[]')
+
+
+def is_nil(obj):
+    return isinstance(obj, Atom) and obj.name == '[]'
+
+
+def list_segments(term, walk=None):
+    """Returns the elements of a (partial) list as (items, start, stop) segments,
+    together with the tail after the last element. Handles ListTerms and '.'/2
+    Compounds alike. walk (optional) looks up variables, e.g. Result.walk."""
+    segments = []
+    while True:
+        if walk is not None:
+            term = walk(term)
+        if isinstance(term, ListTerm):
+            segments.append((term.items, term.start, term.stop))
+            term = term.tail
+        elif isinstance(term, Compound) and term.name == '.' and len(term.children) == 2:
+            segments.append((term.children, 0, 1))
+            term = term.children[1]
+        else:
+            return segments, term
+
+
+def list_elements(segments):
+    for items, start, stop in segments:
+        for i in range(start, stop):
+            yield items[i]
+
+
+def list_from_segments(segments, tail, been_scoped=False):
+    for items, start, stop in reversed(segments):
+        tail = ListTerm.view(items, start, stop, tail, been_scoped)
+    return tail
+
+
+def cons(*args):
+    "cons(A, B, T) is the list [A, B | T]"
+    *heads, tail = args
+    return ListTerm.view(heads, tail=tail)
+
+
+class ListTerm(BasicTerm):
+    """A list: the elements items[start:stop], followed by tail (the empty list
+    by default). items is any indexable sequence and is shared, not copied, so
+    head/tail views and appending to a list are O(1). A Python list that is used
+    as an argument is wrapped as is, and should not be modified afterwards.
+    Behaves like a chain of '.'/2 Compounds."""
+    
+    def __init__(self, items, start=0, stop=None, tail=None, been_scoped=False):
+        super().__init__('.', been_scoped)
+        self.items = items
+        self.start = start
+        self.stop = len(items) if stop is None else stop
+        self.tail = nil if tail is None else ListTerm.view(tail) if isinstance(tail, list) else tail
+        self._hash = None
+        self._ground = None
+        self._plain = None
+    
+    @classmethod
+    def view(cls, items, start=0, stop=None, tail=None, been_scoped=False):
+        "Like the constructor, but gives the tail itself for an empty view"
+        stop = len(items) if stop is None else stop
+        if start >= stop:
+            return nil if tail is None else ListTerm.view(tail) if isinstance(tail, list) else tail
+        return cls(items, start, stop, tail, been_scoped)
+    
+    @property
+    def children(self):
+        return self.items[self.start], self.drop(1)
+    
+    def drop(self, n):
+        """The list after its first n elements (at most those of this segment), a
+        view of the same items. It knows whether it is ground when this list does,
+        so the views of a long ground list don't each check all elements again."""
+        rest = ListTerm.view(self.items, self.start + n, self.stop, self.tail, self.been_scoped)
+        if isinstance(rest, ListTerm) and rest.items is self.items:
+            if self.ground:
+                rest._ground = True
+            if self._plain:
+                rest._plain = True
+        return rest
+    
+    def segments(self):
+        return list_segments(self)
+    
+    def elements(self):
+        return list_elements(self.segments()[0])
+    
+    @property
+    def plain(self):
+        "True if no element (of this segment) needs scoping: Python constants only"
+        if self._plain is None:
+            self._plain = all(not isinstance(self.items[i], (Term, list)) for i in range(self.start, self.stop))
+        return self._plain
+    
+    @property
+    def ground(self):
+        if self._ground is None:
+            segments, tail = self.segments()
+            self._ground = is_ground(tail) and all(is_ground(e) for e in list_elements(segments))
+        return self._ground
+    
+    def __str__(self):
+        segments, tail = self.segments()
+        elements = ', '.join(map(str, list_elements(segments)))
+        return f"[{elements}]" if is_nil(tail) else f"[{elements} | {tail}]"
+    
+    def __repr__(self):
+        segments, tail = self.segments()
+        elements = list(list_elements(segments))
+        return f"ListTerm({elements!r})" if is_nil(tail) else f"ListTerm({elements!r}, tail={tail!r})"
+    
+    def really_equal(self, other):
+        if not isinstance(other, BasicTerm) or other.name != '.':
+            return False
+        if isinstance(other, ListTerm) and other.items is self.items and other.start == self.start \
+                and other.stop == self.stop and other.tail is self.tail:
+            return True
+        segments, tail = self.segments()
+        other_segments, other_tail = list_segments(other)
+        elements, other_elements = list(list_elements(segments)), list(list_elements(other_segments))
+        return len(elements) == len(other_elements) and all(a == b for a, b in zip(elements, other_elements)) \
+            and bool(tail == other_tail)
+    
+    def __hash__(self):
+        # The length and the first elements only, so the many views of a long list
+        # don't take time linear in its length each
+        if self._hash is None:
+            segments, tail = self.segments()
+            length = sum(stop - start for items, start, stop in segments)
+            self._hash = hash((length, tuple(islice(list_elements(segments), 8)), tail))
+        return self._hash
+    
+    def has_occurence(self, var):
+        if self.ground:
+            return False
+        segments, tail = self.segments()
+        return has_occurence(tail, var) or any(has_occurence(e, var) for e in list_elements(segments))
+    
+    def occurences(self, O):
+        if not self.ground:
+            segments, tail = self.segments()
+            for e in list_elements(segments):
+                occurences(e, O)
+            occurences(tail, O)
+    
+    def map(self, func):
+        "New list with func applied to every element and to the tail"
+        segments, tail = self.segments()
+        return ListTerm.view(tuple(func(e) for e in list_elements(segments)), tail=func(tail),
+                             been_scoped=self.been_scoped)
+    
+    def replace(self, A, B):
+        return self if self.ground else self.map(lambda e: replace(e, A, B))
+    
+    def with_scope(self, scope):
+        if self.been_scoped and self.ground:
+            return self
+        elif self.plain:
+            return ListTerm(self.items, self.start, self.stop, with_scope(self.tail, scope), been_scoped=True)
+        new = self.map(lambda e: with_scope(e, scope))
+        new.been_scoped = True
+        return new
+    
+    def instantiate(self, result):
+        return self if self.ground else self.map(lambda e: instantiate(e, result))
+
+
+
+# Text
+# ----
+
+class Text:
+    """Text: the slice data[start:stop] of a str, bytes, bytearray or memoryview,
+    which is shared, not copied. A Python constant to the engine, equal to (and
+    hashing like) the str or bytes with the same content, so they unify. The text
+    builtins (sub_atom, split_string, ...) give slices of the text they are given,
+    so rules can work on large buffers without copying them. The data should not
+    be modified afterwards."""
+    
+    __slots__ = ('data', 'start', 'stop', '_hash')
+    
+    def __init__(self, data, start=0, stop=None):
+        if isinstance(data, memoryview):
+            data = data.cast('B')
+        self.data = data
+        self.start = start
+        self.stop = len(data) if stop is None else stop
+        self._hash = None
+    
+    @property
+    def is_bytes(self):
+        return not isinstance(self.data, str)
+    
+    def __len__(self):
+        return self.stop - self.start
+    
+    def __getitem__(self, index):
+        "A character (or byte, as an int), or a Text for a slice (without a step)"
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return Text(self.data, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Text index out of range")
+        return self.data[self.start + index]
+    
+    def value(self):
+        "The content as a str or bytes (a copy, unless it's all of a str or bytes)"
+        if self.start == 0 and self.stop == len(self.data) and isinstance(self.data, (str, bytes)):
+            return self.data
+        chunk = self.data[self.start:self.stop]
+        return chunk if isinstance(chunk, str) else bytes(chunk)
+    
+    def codes(self):
+        "The character codes (or bytes) as a sequence, without copying"
+        if self.is_bytes:
+            return memoryview(self.data)[self.start:self.stop]
+        return _Codes(self)
+    
+    def find(self, sub, pos=0):
+        "The offset of the first occurence of the str or bytes sub at or after pos, or -1"
+        if isinstance(self.data, memoryview):
+            match = re.compile(re.escape(sub)).search(self.data, self.start + pos, self.stop)
+            return -1 if match is None else match.start() - self.start
+        i = self.data.find(sub, self.start + pos, self.stop)
+        return i if i < 0 else i - self.start
+    
+    def same_kind(self, other):
+        return self.is_bytes == other.is_bytes
+    
+    def __eq__(self, other):
+        if isinstance(other, Text):
+            if other.data is self.data and other.start == self.start and other.stop == self.stop:
+                return True
+            if len(other) != len(self) or not self.same_kind(other):
+                return False
+            other = other.value()
+        elif not isinstance(other, (str, bytes)) or len(other) != len(self) \
+                or isinstance(other, str) == self.is_bytes:
+            return False
+        if isinstance(self.data, memoryview):
+            return self.data[self.start:self.stop] == other
+        return self.data.startswith(other, self.start, self.stop)
+    
+    def __hash__(self):
+        if self._hash is None:
+            data = self.data
+            if isinstance(data, bytes) or isinstance(data, memoryview) and isinstance(data.obj, bytes):
+                # Hashes the bytes in place, like the bytes with the same content
+                self._hash = hash(memoryview(data)[self.start:self.stop])
+            else:
+                # Mutable buffers can't be hashed in place, and str slices only as str
+                self._hash = hash(self.value())
+        return self._hash
+    
+    def __str__(self):
+        return str(self.value())
+    
+    def __repr__(self):
+        return f"Text({self.value()!r})"
+    
+    def __reduce__(self):
+        return Text, (self.value(),)
+
+
+class _Codes:
+    "The character codes of a str Text, as a sequence"
+    
+    def __init__(self, text):
+        self.text = text
+    
+    def __len__(self):
+        return len(self.text)
+    
+    def __getitem__(self, index):
+        return ord(self.text[index])
+
+
+def as_text(obj):
+    "obj as a Text (an Atom by its name), or None if it isn't text"
+    if isinstance(obj, Text):
+        return obj
+    elif isinstance(obj, Atom):
+        return Text(obj.name)
+    elif isinstance(obj, (str, bytes, bytearray, memoryview)):
+        return Text(obj)
+    return None
+
+
+
+# Standard order of terms
+# -----------------------
+
+def order_key(term, walk=None):
+    """The key of term in the standard order of terms: Variables < numbers < Atoms
+    < strings < Compounds (by arity, name, then arguments), then any other Python
+    objects (by type name and repr). Equal numbers order floats first. walk looks
+    up variables, e.g. Result.walk. Keys of compound terms without variables are
+    cached on them, and lists give flat keys, so long lists don't recurse."""
+    return _order_key(term, walk)[0]
+
+
+def _order_key(term, walk):
+    "(key, whether term has no variables, so the key can be cached)"
+    if isinstance(term, Variable):
+        if walk is not None:
+            value = walk(term)
+            if value is not term:
+                return _order_key(value, walk)[0], False
+        return (0, term.name, -1 if term.scope is None else term.scope), False
+    elif isinstance(term, list):
+        term = ListTerm.view(term)
+    if isinstance(term, (int, float)):
+        return (1, term, 0 if isinstance(term, float) else 1), True
+    elif isinstance(term, str):
+        return (4, 0, term), True
+    elif isinstance(term, bytes):
+        return (4, 1, term), True
+    elif isinstance(term, Text):
+        return (4, int(term.is_bytes), term.value()), True
+    elif not isinstance(term, Term):
+        return (6, type(term).__name__, repr(term)), True
+    elif isinstance(term, Atom):
+        return (3, term.name), True
+    elif not isinstance(term, BasicTerm):
+        return (0, term.name, -1), False  # Underscore
+    
+    key = getattr(term, '_order_key', None)
+    if key is not None:
+        return key, True
+    if isinstance(term, ListTerm) or term.name == '.' and len(term.children) == 2:
+        # '.'(E1, '.'(E2, Tail)) has key (5, 2, '.', K(E1), 5, 2, '.', K(E2), *K(Tail))
+        segments, tail = list_segments(term, walk)
+        parts = []
+        for e in list_elements(segments):
+            parts.extend((5, 2, '.', _order_key(e, walk)[0]))
+        parts.extend(_order_key(tail, walk)[0])
+        key, cacheable = tuple(parts), is_ground(term)
+    else:
+        children = [_order_key(c, walk) for c in term.children]
+        key = (5, len(term.children), term.name) + tuple(k for k, no_vars in children)
+        cacheable = all(no_vars for k, no_vars in children)
+    if cacheable:
+        term._order_key = key
+    return key, cacheable
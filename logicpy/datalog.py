@@ -0,0 +1,624 @@
+
+# Bottom-up evaluation of Datalog predicates
+# ------------------------------------------
+#
+# Function-free, range-restricted predicates can be evaluated set-at-a-time
+# instead of through SLD resolution. A Program is a set of Rules (translated
+# from Clauses), evaluated stratum by stratum with semi-naive iteration: after
+# the first round, recursive rules are only joined against the facts that were
+# new in the previous round. Results are stored in FactTables, which build hash
+# indexes on demand and which PredicateCall.prove reads directly.
+
+from collections import namedtuple, defaultdict
+
+from logicpy.structure import Structure
+from logicpy.builtin import TrueCls, FailCls, and_, or_, unify, neg, _Cut, Comparison, Evaluation, evaluate, EvalException
+from logicpy.data import Variable, with_scope, occurences, instantiate, is_ground
+from logicpy.predicate import PredicateCall, NoArgument, Signature, PredicateNotFound
+from logicpy.result import Result, Uninstantiated, UnificationFail
+from logicpy.debug import NoDebugger
+from logicpy.limits import PAUSE
+
+
+class NotDatalog(Exception):
+    pass
+
+
+# Helpers
+# -------
+
+def variables(*objs):
+    O = set()
+    for obj in objs:
+        occurences(obj, O)
+    return O
+
+
+def literal_variables(lit):
+    if isinstance(lit, Lookup):
+        return variables(*lit.args)
+    elif isinstance(lit, Test):
+        return variables(lit.structure)
+    else:
+        return variables(*lit[:2])
+
+
+class Frame(dict):
+    "Variable bindings of one partial join, usable wherever a Result is expected"
+
+    def get_var(self, var):
+        try:
+            return self[var]
+        except KeyError:
+            raise Uninstantiated(f"Uninstantiated: {var}")
+
+
+# Fact tables
+# -----------
+
+class FactTable:
+    def __init__(self, key, rows=()):
+        self.key = key
+        self.rows = {}  # used as an ordered set
+        self._indexes = {}
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        if row in self.rows:
+            return False
+        self.rows[row] = None
+        for positions, index in self._indexes.items():
+            index.setdefault(tuple(row[i] for i in positions), []).append(row)
+        return True
+
+    def discard(self, row):
+        if row not in self.rows:
+            return False
+        del self.rows[row]
+        for positions, index in self._indexes.items():
+            key = tuple(row[i] for i in positions)
+            rows = index[key]
+            rows.remove(row)
+            if not rows:
+                del index[key]
+        return True
+
+    def lookup(self, positions, key):
+        if not positions:
+            return self.rows
+        try:
+            index = self._indexes[positions]
+        except KeyError:
+            index = {}
+            for row in self.rows:
+                index.setdefault(tuple(row[i] for i in positions), []).append(row)
+            self._indexes[positions] = index  # only published when complete, for other threads
+        return index.get(key, ())
+
+    def copy(self):
+        "A table with the same rows and indexes, to change while readers keep this one"
+        table = FactTable(self.key)
+        table.rows = dict(self.rows)
+        table._indexes = {positions: {k: list(rows) for k, rows in index.items()}
+                          for positions, index in self._indexes.items()}
+        return table
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, row):
+        return row in self.rows
+
+    def __repr__(self):
+        return f"FactTable({self.key}, {len(self.rows)} rows, indexes on {list(self._indexes)})"
+
+    def prove(self, call, result, dbg):
+        dbg.prove(call, result)
+        args = [result.walk(a) for a in call.args]
+        positions = tuple(i for i, a in enumerate(args) if is_ground(a))
+        free = [i for i in range(len(args)) if i not in positions]
+        rows = self.lookup(positions, tuple(args[i] for i in positions))
+        dbg.output(f"Looking up {len(rows)} rows in {self.key}")
+        for row in list(rows):
+            if not free:
+                yield result
+                continue
+            try:
+                yield (result | {(args[i], row[i]) for i in free}).mgu()
+            except UnificationFail as e:
+                if dbg:
+                    dbg.output(f"Failed to unify row {row}: {e}")
+
+
+# Rules
+# -----
+
+Rule = namedtuple('Rule', ('key', 'args', 'body'))
+
+# Body literals
+Lookup = namedtuple('Lookup', ('key', 'args', 'positive'))
+Equal = namedtuple('Equal', ('left', 'right', 'positive'))
+Assign = namedtuple('Assign', ('left', 'expr'))
+Test = namedtuple('Test', ('structure',))
+
+
+def disjuncts(body):
+    "Rewrites a body to disjunctive normal form: a list of lists of goals"
+    if isinstance(body, TrueCls):
+        return [[]]
+    elif isinstance(body, FailCls):
+        return []
+    elif isinstance(body, and_):
+        total = [[]]
+        for arg in body.args:
+            total = [left + right for left in total for right in disjuncts(arg)]
+        return total
+    elif isinstance(body, or_):
+        return [conj for arg in body.args for conj in disjuncts(arg)]
+    else:
+        return [[body]]
+
+
+def check_args(key, args):
+    for a in args:
+        if not isinstance(a, Variable) and not is_ground(a):
+            raise NotDatalog(f"{key} has a non-ground structured argument {a}")
+    return tuple(args)
+
+
+def literal(goal):
+    if isinstance(goal, (PredicateCall, NoArgument)):
+        return Lookup(goal.signature, check_args(goal.signature, getattr(goal, 'args', ())), True)
+    elif isinstance(goal, neg) and isinstance(goal.arg, (PredicateCall, NoArgument)):
+        return Lookup(goal.arg.signature, check_args(goal.arg.signature, getattr(goal.arg, 'args', ())), False)
+    elif isinstance(goal, unify):
+        return Equal(goal.left, goal.right, True)
+    elif isinstance(goal, neg) and isinstance(goal.arg, unify):
+        return Equal(goal.arg.left, goal.arg.right, False)
+    elif isinstance(goal, Evaluation):
+        return Assign(goal.left, goal.right)
+    elif isinstance(goal, _Cut):
+        raise NotDatalog("Cuts can not be evaluated bottom-up")
+    elif isinstance(goal, Structure):
+        return Test(goal)
+    else:
+        raise NotDatalog(f"Unsupported goal {goal!r}")
+
+
+# Stands for variables that only occur in a single negated literal
+ANY = object()
+
+
+def local_wildcards(args, body):
+    "Replaces variables that occur only in one negated lookup by ANY"
+    new_body = []
+    for n, lit in enumerate(body):
+        if isinstance(lit, Lookup) and not lit.positive:
+            others = variables(*args).union(*(literal_variables(l) for m, l in enumerate(body) if m != n))
+            lit = lit._replace(args=tuple(ANY if isinstance(a, Variable) and a not in others else a
+                                          for a in lit.args))
+        new_body.append(lit)
+    return tuple(new_body)
+
+
+def clause_rules(clause):
+    scope = Structure.scope_id()
+    args = check_args(clause.signature, [with_scope(a, scope) for a in clause.args])
+    for conj in disjuncts(clause.body.with_scope(scope)):
+        yield Rule(clause.signature, args, local_wildcards(args, [literal(g) for g in conj]))
+
+
+# Planning and joining
+# --------------------
+
+Step = namedtuple('Step', ('literal', 'bound', 'free', 'checks'))
+
+
+def lookup_step(lit, bound):
+    """Splits the arguments of a Lookup in the positions used as index key and
+    the positions that bind new variables. Repeated new variables become checks."""
+    positions, free, checks, seen = [], [], [], {}
+    for i, a in enumerate(lit.args):
+        if not isinstance(a, Variable) or a in bound:
+            positions.append(i)
+        elif a in seen:
+            checks.append((seen[a], i))
+        else:
+            seen[a] = i
+            free.append((i, a))
+    return Step(lit, tuple(positions), tuple(free), tuple(checks))
+
+
+def is_ready(lit, bound):
+    if isinstance(lit, Lookup):
+        return lit.positive or literal_variables(lit) <= bound
+    elif isinstance(lit, Equal):
+        if not lit.positive:
+            return literal_variables(lit) <= bound
+        return any(variables(side) <= bound and (isinstance(other, Variable) or is_ground(other))
+                   for side, other in ((lit.left, lit.right), (lit.right, lit.left)))
+    elif isinstance(lit, Assign):
+        return variables(lit.expr) <= bound and (isinstance(lit.left, Variable) or is_ground(lit.left))
+    else:
+        return variables(lit.structure) <= bound
+
+
+def plan(rule, first=None, bound=()):
+    """Orders the body of a rule so that every literal can be evaluated with the
+    variables bound by the literals before it. Filters are placed as early as
+    possible, lookups with more bound arguments are preferred."""
+    todo = list(rule.body)
+    steps = []
+    bound = set(bound)
+    if first is not None:
+        todo.remove(first)
+        todo.insert(0, first)
+
+    while todo:
+        ready = [lit for lit in todo if is_ready(lit, bound)]
+        if not ready:
+            raise NotDatalog(f"Rule for {rule.key} is not range-restricted: can't evaluate {todo}")
+        if first is not None:
+            lit, first = first, None
+        else:
+            filters = [lit for lit in ready if not (isinstance(lit, Lookup) and lit.positive)]
+            lit = filters[0] if filters else \
+                max(ready, key=lambda l: sum(1 for a in l.args if not isinstance(a, Variable) or a in bound))
+        todo.remove(lit)
+        if isinstance(lit, Lookup) and lit.positive:
+            steps.append(lookup_step(lit, bound))
+        else:
+            steps.append(Step(lit, (), (), ()))
+        bound |= literal_variables(lit)
+
+    missing = variables(*rule.args) - bound
+    if missing:
+        raise NotDatalog(f"Rule for {rule.key} is not range-restricted: {', '.join(map(str, missing))} unbound")
+    return steps
+
+
+def value(obj, frame):
+    return frame[obj] if isinstance(obj, Variable) else obj
+
+
+def bind(obj, val, frame):
+    "Extends frame so obj equals val, returns whether that's possible"
+    if isinstance(obj, Variable) and obj not in frame:
+        frame[obj] = val
+        return True
+    return value(obj, frame) == val
+
+
+def join(step, frames, table):
+    lit = step.literal
+
+    if isinstance(lit, Lookup) and lit.positive:
+        groups = defaultdict(list)
+        for frame in frames:
+            groups[tuple(value(lit.args[i], frame) for i in step.bound)].append(frame)
+        for key, group in groups.items():
+            for row in table.lookup(step.bound, key):
+                if any(row[i] != row[j] for i, j in step.checks):
+                    continue
+                for frame in group:
+                    new = Frame(frame)
+                    for i, var in step.free:
+                        new[var] = row[i]
+                    yield new
+
+    elif isinstance(lit, Lookup):
+        positions = tuple(i for i, a in enumerate(lit.args) if a is not ANY)
+        for frame in frames:
+            if not table.lookup(positions, tuple(value(lit.args[i], frame) for i in positions)):
+                yield frame
+
+    elif isinstance(lit, Equal):
+        for frame in frames:
+            if lit.positive:
+                new = Frame(frame)
+                if isinstance(lit.left, Variable) and lit.left not in frame:
+                    ok = bind(lit.left, value(lit.right, frame), new)
+                else:
+                    ok = bind(lit.right, value(lit.left, frame), new)
+                if ok:
+                    yield new
+            elif value(lit.left, frame) != value(lit.right, frame):
+                yield frame
+
+    elif isinstance(lit, Assign):
+        for frame in frames:
+            try:
+                val = evaluate(instantiate(lit.expr, frame))
+            except EvalException:
+                continue
+            new = Frame(frame)
+            if bind(lit.left, val, new):
+                yield new
+
+    elif isinstance(lit.structure, Comparison):
+        comp = lit.structure
+        for frame in frames:
+            try:
+                if comp.compare(evaluate(instantiate(comp.left, frame)), evaluate(instantiate(comp.right, frame))):
+                    yield frame
+            except EvalException:
+                pass
+
+    else:
+        for frame in frames:
+            res = Result(frame.items())
+            for r in lit.structure.prove(res, NoDebugger()):
+                if r is not PAUSE:
+                    yield frame
+                    break
+
+
+# Programs
+# --------
+
+def strata(rules):
+    """Groups the keys of a program in strongly connected components (Tarjan),
+    dependencies first. Raises NotDatalog if negation is used within a component."""
+    graph = {key: {lit.key for r in rs for lit in r.body if isinstance(lit, Lookup)} & rules.keys()
+             for key, rs in rules.items()}
+    index, low, on_stack, stack, components = {}, {}, set(), [], []
+
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = low[root] = len(index)
+        stack.append(root); on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child); on_stack.add(child)
+                    work.append((child, iter(graph[child])))
+                    break
+                elif child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    component = set()
+                    while True:
+                        key = stack.pop(); on_stack.discard(key)
+                        component.add(key)
+                        if key == node: break
+                    components.append(component)
+
+    for component in components:
+        for key in component:
+            for r in rules[key]:
+                for lit in r.body:
+                    if isinstance(lit, Lookup) and not lit.positive and lit.key in component:
+                        raise NotDatalog(f"Program is not stratified: {key} negatively depends on {lit.key}")
+    return components
+
+
+class Program:
+    def __init__(self, rules):
+        self.rules = defaultdict(list)
+        for rule in rules:
+            self.rules[rule.key].append(rule)
+        self.strata = strata(self.rules)
+        self._plans = {}
+
+    def plan(self, rule, first=None, bound=frozenset()):
+        try:
+            return self._plans[rule, first, bound]
+        except KeyError:
+            steps = self._plans[rule, first, bound] = plan(rule, first, bound)
+            return steps
+
+    def run(self, rule, tables, first=None, delta=None, frame=None):
+        """Yields the rows rule derives from tables. With first and delta, the
+        Lookup first reads delta instead. frame binds variables beforehand, like
+        those of the head (see head_frame)."""
+        frame = Frame() if frame is None else frame
+        frames = [frame]
+        for n, step in enumerate(self.plan(rule, first, frozenset(frame))):
+            table = delta if n == 0 and delta is not None else tables.get(getattr(step.literal, 'key', None))
+            if table is None and isinstance(step.literal, Lookup):
+                table = tables[step.literal.key] = FactTable(step.literal.key)
+            frames = list(join(step, frames, table))
+            if not frames:
+                return
+        for frame in frames:
+            yield tuple(value(a, frame) for a in rule.args)
+
+    def evaluate(self, tables=None):
+        """Computes all facts of the program, starting from the given tables
+        (for keys the program does not define, e.g. seeds). Semi-naive: after the
+        first round, each recursive rule joins one recursive literal against the
+        delta of the previous round."""
+        tables = dict(tables or {})
+        for component in self.strata:
+            rules = [r for key in component for r in self.rules[key]]
+            for key in component:
+                tables.setdefault(key, FactTable(key))
+
+            delta = {key: FactTable(key) for key in component}
+            for rule in rules:
+                for row in self.run(rule, tables):
+                    if row not in tables[rule.key]:
+                        delta[rule.key].add(row)
+
+            recursive = [(rule, lit) for rule in rules for lit in rule.body
+                         if isinstance(lit, Lookup) and lit.positive and lit.key in component]
+            while any(delta.values()):
+                for key, table in delta.items():
+                    for row in table:
+                        tables[key].add(row)
+                new = {key: FactTable(key) for key in component}
+                for rule, lit in recursive:
+                    if delta[lit.key]:
+                        for row in self.run(rule, tables, lit, delta[lit.key]):
+                            if row not in tables[rule.key]:
+                                new[rule.key].add(row)
+                delta = new
+        return tables
+
+
+def head_frame(rule, row):
+    "The frame binding the head of rule to row, or None if they don't match"
+    frame = Frame()
+    for arg, val in zip(rule.args, row):
+        if not bind(arg, val, frame):
+            return None
+    return frame
+
+
+def universe_rules(univ, signatures):
+    for sig in signatures:
+        pred = univ.get_pred(sig)
+        if pred is None:
+            raise PredicateNotFound(f"Couldn't find predicate with signature {sig}")
+        if pred.source is not None and not isinstance(pred.source, FactTable):
+            raise NotDatalog(f"{sig} is answered by an external source")
+        for clause in pred.clauses:
+            yield from clause_rules(clause)
+
+
+def materialize(univ, signatures):
+    """Evaluates the given predicates (and everything they depend on) bottom-up,
+    after which calls to them are answered from the resulting fact tables."""
+    signatures = [Signature.parse(s) for s in signatures]
+    closure = univ.dependencies(signatures)
+    tables = Program(universe_rules(univ, closure)).evaluate()
+    for sig in closure:
+        univ.get_pred(sig).source = tables[sig]
+        univ._materialized[sig] = closure
+    return {sig: tables[sig] for sig in signatures}
+
+
+# Magic sets
+# ----------
+#
+# Point queries on set-oriented predicates don't need the whole relation. The
+# program is rewritten for the binding pattern ("adornment") of the call: every
+# derived predicate p gets an adorned version p^a, guarded by a magic predicate
+# holding the bound arguments p^a is called with. Seeding the magic predicate
+# with the constants of the call restricts evaluation to relevant facts.
+# Predicates that only have facts aren't part of the rewritten program: their
+# indexed tables are built once (see base_table) and read by every call, so a
+# call only computes the derived facts relevant to it.
+
+class Adorned(namedtuple('_Adorned', ('signature', 'adornment'))):
+    prefix = ''
+
+    # Unlike plain tuples, Adorned and Magic keys of the same predicate differ
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.prefix, *self))
+
+    def __str__(self):
+        return f"{self.prefix}{self.signature.name}^{self.adornment}"
+
+    __repr__ = __str__
+
+
+class Magic(Adorned):
+    prefix = 'magic_'
+
+
+def adornment(args, bound):
+    return ''.join('b' if (variables(a) <= bound and a is not ANY) else 'f' for a in args)
+
+
+def magic_program(univ, sig, pattern):
+    "Rewrites the program below sig for calls with the given adornment"
+    sig = Signature.parse(sig)
+    rules = defaultdict(list)
+    for rule in universe_rules(univ, univ.dependencies([sig])):
+        rules[rule.key].append(rule)
+    derived = {key for key, rs in rules.items() if any(r.body for r in rs)}
+
+    new_rules = []
+    full = set()  # predicates that are evaluated without rewriting
+    todo, done = [(sig, pattern)], set()
+    while todo:
+        key, pattern = todo.pop()
+        if (key, pattern) in done:
+            continue
+        done.add((key, pattern))
+        for rule in rules[key]:
+            head_bound = tuple(a for a, b in zip(rule.args, pattern) if b == 'b')
+            bound = variables(*head_bound)
+            body = [Lookup(Magic(key, pattern), head_bound, True)]
+            for step in plan(rule, bound=bound):
+                lit = step.literal
+                if isinstance(lit, Lookup) and lit.positive and lit.key in derived:
+                    lit_pattern = adornment(lit.args, bound)
+                    lit_bound = tuple(a for a, b in zip(lit.args, lit_pattern) if b == 'b')
+                    new_rules.append(Rule(Magic(lit.key, lit_pattern), lit_bound, tuple(body)))
+                    todo.append((lit.key, lit_pattern))
+                    lit = lit._replace(key=Adorned(lit.key, lit_pattern))
+                elif isinstance(lit, Lookup):
+                    full.add(lit.key)
+                body.append(lit)
+                bound |= literal_variables(lit)
+            new_rules.append(Rule(Adorned(key, pattern), rule.args, tuple(body)))
+
+    closure = univ.dependencies(full)
+    base = {key for key in closure if base_table(univ, key) is not None}
+    new_rules.extend(universe_rules(univ, closure - base))
+    return Program(new_rules), base
+
+
+def base_table(univ, sig):
+    """The facts of sig as a FactTable if it has no rules (or is answered by a
+    table), else None. Kept until sig changes, with the indexes built on it."""
+    pred = univ.get_pred(sig)
+    if pred is None:
+        raise PredicateNotFound(f"Couldn't find predicate with signature {sig}")
+    if isinstance(pred.source, FactTable):
+        return pred.source
+    try:
+        return univ._base_tables[sig]
+    except KeyError:
+        pass
+    generation = univ._generation
+    rules = list(universe_rules(univ, [sig]))
+    if any(rule.body or not all(map(is_ground, rule.args)) for rule in rules):
+        table = None
+    else:
+        table = FactTable(sig, (rule.args for rule in rules))
+    with univ._lock:
+        if univ._generation == generation:  # else a clause was defined meanwhile
+            univ._base_tables[sig] = table
+    return table
+
+
+def prove_set_oriented(univ, call, result, dbg):
+    args = [result.walk(a) for a in call.args]
+    pattern = ''.join('b' if is_ground(a) else 'f' for a in args)
+    dbg.output(f"Evaluating {call.signature} bottom-up for adornment {pattern}")
+    try:
+        program, base, deps = univ._magic[call.signature, pattern]
+    except KeyError:
+        generation = univ._generation
+        program, base = magic_program(univ, call.signature, pattern)
+        deps = univ.dependencies([call.signature])
+        with univ._lock:
+            if univ._generation == generation:  # else a clause was defined meanwhile
+                univ._magic[call.signature, pattern] = program, base, deps
+
+    seed = FactTable(Magic(call.signature, pattern), [tuple(a for a, b in zip(args, pattern) if b == 'b')])
+    tables = {key: base_table(univ, key) for key in base}
+    tables[seed.key] = seed
+    tables = program.evaluate(tables)
+    yield from tables[Adorned(call.signature, pattern)].prove(call, result, dbg)
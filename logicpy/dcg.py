@@ -0,0 +1,265 @@
+# Definite clause grammars
+# ------------------------
+#
+# A grammar rule  n.greeting >> ([_.hello] & n.name)  is Prolog's
+# greeting --> [hello], name.  It is translated to an ordinary clause with two
+# more arguments: the input, and what is left of it after the rule, so
+#   greeting(S0, S) :- terminals([hello], S0, S1), name(S1, S).
+# In a rule body
+#   [a, b]        are terminals (tokens), [] matches nothing
+#   n.x, n.x(A)   are nonterminals, calling x/2 and x/3
+#   {goal}        is an ordinary goal (a Python set holding one goal)
+#   &, |, neg, cut, True_ and Fail work as usual
+# Mind the parentheses around the body: >> binds more tightly than & and |.
+# Without them, n.x >> [_.a] & n.y defines x --> [a] before & sees n.y, so &
+# and | take such a rule back out and raise a TypeError. [_.a] & n.y on its own
+# is a GrammarBody, which only rule and phrase accept.
+#
+# phrase(body, tokens) parses tokens with a body. The input is a list term that
+# is a view of the token list: matching a terminal makes a view starting a few
+# tokens further, O(1), instead of taking cons cells apart. Text is parsed as its
+# list of characters (or bytes), also without copying. phrase resolves the
+# nonterminals itself, with explicit stacks (see parse), so a rule calling itself
+# for the rest of the input, like digits --> [d], digits, parses long inputs
+# without running out of Python stack.
+
+from itertools import count
+
+from logicpy.structure import MultiArg, MonoArg, GrammarBody
+from logicpy.builtin import True_, Fail, and_, or_, unify, neg, cut, wake, PredicateCut
+from logicpy.data import Term, Variable, ListTerm, Text, as_text, list_segments, list_elements, nil, occurences, \
+    with_scope
+from logicpy.result import Result, UnificationFail
+from logicpy.predicate import Clause, NoArgument, PredicateCall, Signature
+from logicpy.limits import query_stats, PAUSE
+
+
+def rule(head, body):
+    "Defines the grammar rule head --> body (head is n.x or n.x(...)), returns its clause"
+    if isinstance(head, NoArgument):
+        args = ()
+    elif isinstance(head, PredicateCall):
+        args = tuple(head.args)
+    else:
+        raise TypeError(f"Not a grammar rule head: {head!r}")
+    start, end = Variable('$S0'), Variable('$S')
+    body = translate(body, start, end)  # checks all of it before defining anything
+    return GrammarRule(head.signature.name, args + (start, end), body, head.univ)
+
+
+class GrammarRule(Clause):
+    "The clause of a grammar rule, see rule"
+    
+    def __and__(self, other):
+        self.refuse('&')
+    
+    def __or__(self, other):
+        self.refuse('|')
+    
+    def refuse(self, op):
+        "n.x >> [_.a] & n.y: takes back the rule defined with only part of its body"
+        if self.univ:
+            self.univ._remove(self.univ.get_pred(self.signature), self)
+        raise TypeError(f"The body of grammar rule {self.signature.name} continues after {op}: "
+                        f"put it in parentheses, n.x >> (... {op} ...)")
+
+
+def phrase(body, tokens, rest=nil):
+    """The goal that tokens (a list, or text) start with a sequence that body
+    describes, followed by rest"""
+    if isinstance(tokens, (str, bytes, memoryview, Text)):
+        tokens = ListTerm.view(as_text(tokens))
+    return Phrase(translate(body, tokens, rest))
+
+
+def translate(body, start, end, numbers=None):
+    "The goal for a grammar rule body, parsing from start to end"
+    numbers = numbers or count(1)
+    if isinstance(body, GrammarBody):
+        body = body.body
+    if isinstance(body, and_):
+        goals = []
+        for i, part in enumerate(body.args):
+            if isinstance(part, GrammarBody):
+                part = part.body
+            if isinstance(part, (set, frozenset)) and i < len(body.args) - 1:
+                goals.append(braced_goal(part))  # reads no input
+                continue
+            between = end if i == len(body.args) - 1 else Variable(f'$S{next(numbers)}')
+            goals.append(translate(part, start, between, numbers))
+            start = between
+        return and_(*goals)
+    elif isinstance(body, or_):
+        return or_(*(translate(b, start, end, numbers) for b in body.args))
+    elif isinstance(body, list) and not body or body is nil:
+        return unify(start, end)
+    elif isinstance(body, (list, ListTerm)):
+        return terminals(body, start, end)
+    elif isinstance(body, (set, frozenset)):
+        return and_(braced_goal(body), unify(start, end))
+    elif body is True_:
+        return unify(start, end)
+    elif body is Fail:
+        return Fail
+    elif body is cut:
+        return and_(cut, unify(start, end))
+    elif isinstance(body, neg):
+        return and_(neg(translate(body.arg, start, Variable(f'$S{next(numbers)}'), numbers)), unify(start, end))
+    elif isinstance(body, NoArgument):
+        return PredicateCall(body.univ, Signature(body.signature.name, 2), (start, end))
+    elif isinstance(body, PredicateCall):
+        return PredicateCall(body.univ, Signature(body.signature.name, len(body.args) + 2),
+                             tuple(body.args) + (start, end))
+    raise TypeError(f"Not a grammar rule body: {body!r}")
+
+
+def braced_goal(body):
+    if len(body) != 1:
+        raise TypeError("{goal} holds a single goal, join goals with & instead")
+    goal, = body
+    return goal
+
+
+def is_position(var):
+    return isinstance(var, Variable) and var.name.startswith('$S')
+
+
+class Phrase(MonoArg):
+    "A translated grammar body, see phrase. Its answers don't show the positions in between."
+
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        positions = set()
+        occurences(self.arg, positions)
+        positions = {v for v in positions if is_position(v)}
+        first_scope = self.scope_id()
+        for res in parse(self.arg, result, first_scope, dbg):
+            yield res if res is PAUSE else res.trim(first_scope, drop=positions)
+
+    def __str__(self):
+        return f"phrase({self.arg})"
+
+
+def parse(goal, result, first_scope, dbg):
+    """Proves goal depth-first, giving the answers in the order its generators would.
+    The goals left are a linked list of (goal, cut barrier, rest), and the choice
+    points a list of iterators of (goals, result), so calling a nonterminal doesn't
+    nest Python calls. A cut drops the choice points from its barrier up: those of
+    the clause it is in. States only keep the bindings of the variables made
+    before first_scope (which the caller sees) and of the goals left."""
+    choices = [iter([((goal, 0, None), result)])]
+    cut_caller = False
+    while choices:
+        try:
+            goals, res = next(choices[-1])
+        except StopIteration:
+            choices.pop()
+            continue
+        if res is PAUSE:
+            yield res
+            continue
+        # Deterministic steps are taken right away, without a choice point
+        while goals is not None:
+            goal, barrier, rest = goals
+            if isinstance(goal, and_):
+                for g in reversed(goal.args):
+                    rest = (g, barrier, rest)
+                goals = rest
+            elif goal is True_:
+                goals = rest
+            elif goal is cut:
+                del choices[barrier:]
+                cut_caller = cut_caller or barrier == 0
+                goals = rest
+            else:
+                choices.append(steps(goal, barrier, rest, res, len(choices), first_scope, dbg))
+                break
+        else:
+            yield res
+    if cut_caller:
+        raise PredicateCut()  # a cut outside the rules, like a cut in the calling clause
+
+
+def steps(goal, barrier, rest, result, height, first_scope, dbg):
+    "Yields the (goals, result) after proving goal one step, see parse"
+    if isinstance(goal, or_):
+        for branch in goal.args:
+            yield (branch, barrier, rest), result
+    elif isinstance(goal, NoArgument):
+        yield (PredicateCall(goal.univ, goal.signature, ()), barrier, rest), result
+    elif isinstance(goal, PredicateCall) and resolvable(goal):
+        dbg.prove(goal, result)
+        stats = query_stats.get()
+        if stats is not None:
+            stats.step(result)
+            if stats.should_pause():
+                yield rest, PAUSE
+        for clause in goal.univ.get_pred(goal.signature).clauses:
+            scope = goal.scope_id()
+            arg_res = Result((with_scope(a, scope), b) for a, b in zip(clause.args, goal.args))
+            try:
+                total = (arg_res | result).mgu()
+            except UnificationFail:
+                continue
+            # Cuts in the body drop the choice points from this iterator's up
+            yield from woken((clause.body.with_scope(scope), height, rest), total, first_scope, dbg)
+    else:
+        for res in goal.prove(result, dbg.next()):
+            if res is PAUSE:
+                yield rest, res
+            else:
+                yield from woken(rest, res, first_scope, dbg)
+
+
+def woken(goals, result, first_scope, dbg):
+    "The (goals, result) after waking the delayed goals that result triggers"
+    for res in wake(result, dbg) if result.delayed else (result,):
+        if res is PAUSE:
+            yield goals, res
+            continue
+        keep = set()
+        rest = goals
+        while rest is not None:
+            occurences(rest[0], keep)
+            rest = rest[2]
+        yield goals, res.trim(first_scope, keep)
+
+
+def resolvable(call):
+    pred = call.univ.get_pred(call.signature)
+    return pred is not None and pred.source is None and not pred.set_oriented
+
+
+class terminals(MultiArg):
+    """terminals(Tokens, S0, S): the list S0 starts with the Tokens, followed by S.
+    When S0 is a view of a token list, S is a view of the same list."""
+
+    def prove(self, result, dbg):
+        dbg.prove(self, result)
+        tokens, start, end = self.args
+        segments, tail = list_segments(tokens)
+        tokens = tuple(list_elements(segments))
+
+        lst = result.walk(start)
+        if isinstance(lst, ListTerm) and lst.stop - lst.start >= len(tokens):
+            # Compare with the tokens in place
+            pairs = set()
+            for i, token in enumerate(tokens):
+                item = lst.items[lst.start + i]
+                if isinstance(token, Term) or isinstance(item, Term):
+                    pairs.add((token, item))
+                elif token != item:
+                    return
+            pairs.add((end, lst.drop(len(tokens))))
+        else:
+            # Partial lists, generating
+            pairs = {(start, ListTerm.view(tokens, tail=end, been_scoped=True))}
+        try:
+            yield (result | pairs).mgu()
+        except UnificationFail as e:
+            if dbg:
+                dbg.output(f"Terminals don't match: {e}")
+
+    def __str__(self):
+        tokens, start, end = self.args
+        return f"terminals({ListTerm.view(tokens) if isinstance(tokens, list) else tokens}, {start}, {end})"
@@ -0,0 +1,126 @@
+# Engines
+# -------
+#
+# An engine is a query that is proven a slice of inferences at a time. When its
+# budget is used up, the next predicate call yields PAUSE (see logicpy.limits)
+# instead of a result. That travels up to the engine, and the query continues
+# from there when the engine is stepped again. A Scheduler runs many engines on
+# one thread, round-robin, so short queries get their answers quickly while long
+# ones are running.
+#
+# Structures that prove other goals themselves (see the README) should pass
+# PAUSE on: `if res is PAUSE: yield res`.
+
+from collections import deque
+
+from logicpy.limits import QueryStats, PAUSE
+
+LIMITS = ('max_inferences', 'max_depth', 'timeout', 'max_memory')
+
+
+class Engine:
+    """A query of univ for goal that runs when stepped. Options are those of
+    Universe.query, including its limits (the timeout counts from the start, also
+    while the engine waits). state is one of
+      new, answered  ready to step
+      paused         used up the budget of the last step
+      done           no more answers
+      cancelled      stopped by cancel()
+      failed         raised the exception in error (e.g. ResourceExceeded)"""
+
+    def __init__(self, univ, goal, *, stats=None, **options):
+        limits = {k: options.pop(k) for k in LIMITS if k in options}
+        self.stats = QueryStats(**limits) if stats is None else stats
+        self.goal = goal
+        self.answers = 0
+        self.state = 'new'
+        self.error = None
+        self._proofs = univ.query(goal, stats=self.stats, **options)
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'cancelled', 'failed')
+
+    @property
+    def inferences(self):
+        return self.stats.inferences
+
+    @property
+    def depth(self):
+        return self.stats.depth
+
+    def step(self, budget=None):
+        """Proves until the next answer, or until budget inferences (unlimited by
+        default) were made. Returns the answer, or None when paused or finished."""
+        if self.finished:
+            return None
+        self.stats.budget = budget
+        try:
+            item = next(self._proofs)
+        except StopIteration:
+            self.state = 'done'
+            return None
+        except Exception as e:
+            self.state, self.error = 'failed', e
+            raise
+        finally:
+            self.stats.budget = None
+        if item is PAUSE:
+            self.state = 'paused'
+            return None
+        self.state = 'answered'
+        self.answers += 1
+        return item
+
+    def cancel(self):
+        "Stops the query, closing what it holds open (like the cursors of sources)"
+        if not self.finished:
+            self._proofs.close()
+            self.state = 'cancelled'
+
+    def __iter__(self):
+        "The remaining answers, proven without pausing"
+        while True:
+            answer = self.step()
+            if answer is None:
+                return
+            yield answer
+
+    def __repr__(self):
+        return f"Engine({self.goal}, {self.state}, answers={self.answers}, inferences={self.inferences})"
+
+
+class Scheduler:
+    """Runs engines on one thread, round-robin: each turn steps the next engine for
+    at most slice inferences, or until it finds an answer. Finished engines leave
+    the queue, failed ones keep their exception in error."""
+
+    def __init__(self, slice=1000):
+        self.slice = slice
+        self.queue = deque()
+
+    def add(self, engine):
+        self.queue.append(engine)
+        return engine
+
+    def __len__(self):
+        return len(self.queue)
+
+    def turn(self):
+        "Steps the next engine, returns it and its answer (or None)"
+        engine = self.queue.popleft()
+        answer = None
+        try:
+            answer = engine.step(self.slice)
+        except Exception:
+            pass  # kept in engine.error
+        if not engine.finished:
+            self.queue.append(engine)
+        return engine, answer
+
+    def run(self):
+        "Runs the engines until all are finished, yields (engine, answer) pairs as they are found"
+        while self.queue:
+            engine, answer = self.turn()
+            if answer is not None:
+                yield engine, answer
@@ -0,0 +1,301 @@
+# Term heap
+# ---------
+#
+# An alternative term store for building and unifying many short-lived terms,
+# without allocating a Python object per node. Terms are tagged cells in one
+# array, like the heap of the WAM, and are referred to by integer handles (the
+# address of a cell). Allocating is appending cells, backtracking truncates
+# the array and resets the variables bound since a mark. Terms only become
+# Atom/Compound/Variable objects again when loaded, e.g. for printing.
+# It is a standalone store: queries don't use it, the resolution engine keeps
+# working on term objects and Results. Unification follows the engine's rules
+# though, so constants are compared with == (1 and 1.0 unify, like in queries).
+#
+# A cell is an int64: the tag in the lowest 3 bits, the value above it.
+#   REF  variable, value is the address it is bound to (itself when unbound)
+#   STR  structure, value is the address of its FUN cell
+#   FUN  functor (name/arity symbol), followed by a cell per argument
+#   ATM  atom symbol
+#   INT  small integer
+#   CON  other Python constant, value indexes Heap.constants
+
+from array import array
+
+from logicpy.data import Term, Atom, Compound, EvalCompound, Variable, ListTerm, list_segments, \
+    list_elements, list_from_segments
+
+REF, STR, FUN, ATM, INT, CON = range(6)
+TAG_BITS = 3
+TAG_MASK = (1 << TAG_BITS) - 1
+INT_MIN, INT_MAX = -(1 << 59), (1 << 59) - 1
+
+
+def cell(tag, value):
+    return (value << TAG_BITS) | tag
+
+
+def tag_of(c):
+    return c & TAG_MASK
+
+
+def value_of(c):
+    return c >> TAG_BITS
+
+
+class Heap:
+    """Terms as tagged cells in an array('q'). store() returns a handle, load()
+    turns a handle back into terms. mark() and undo() implement backtracking."""
+    
+    def __init__(self):
+        self.cells = array('q')
+        self.trail = array('q')  # addresses of bound variables
+        self.symbols = []  # (name, arity)
+        self._symbol_ids = {}
+        self.constants = []
+        self._constant_ids = {}
+    
+    def __len__(self):
+        return len(self.cells)
+    
+    @property
+    def buffer(self):
+        "The cells, without copying"
+        return memoryview(self.cells)
+    
+    # Symbols and constants ............................
+    
+    def symbol(self, name, arity):
+        key = (name, arity)
+        try:
+            return self._symbol_ids[key]
+        except KeyError:
+            self.symbols.append(key)
+            n = self._symbol_ids[key] = len(self.symbols) - 1
+            return n
+    
+    def constant(self, obj):
+        key = (type(obj), obj)
+        try:
+            return self._constant_ids[key]
+        except (KeyError, TypeError) as e:
+            self.constants.append(obj)
+            if isinstance(e, KeyError):
+                self._constant_ids[key] = len(self.constants) - 1
+            return len(self.constants) - 1
+    
+    # Building .........................................
+    
+    def new_var(self):
+        addr = len(self.cells)
+        self.cells.append(cell(REF, addr))
+        return addr
+    
+    def store(self, term, variables=None):
+        """Stores a term, returns its handle. Variables are looked up in (and added
+        to) the dictionary variables, so terms stored with the same one share them."""
+        variables = {} if variables is None else variables
+        c = self._cell(term, variables)
+        addr = len(self.cells)
+        self.cells.append(c)
+        return addr
+    
+    def _cell(self, term, variables):
+        "The cell referring to term, building it on the heap if needed"
+        if isinstance(term, Variable):
+            if term not in variables:
+                variables[term] = self.new_var()
+            return cell(REF, variables[term])
+        elif isinstance(term, ListTerm) or isinstance(term, list):
+            segments, tail = list_segments(ListTerm.view(term) if isinstance(term, list) else term)
+            return self._list_cell(list(list_elements(segments)), tail, variables)
+        elif isinstance(term, EvalCompound):
+            raise TypeError(f"Can't store {term}, evaluate it first")
+        elif isinstance(term, Compound):
+            cells = self.cells
+            start = len(cells)
+            cells.append(cell(FUN, self.symbol(term.name, len(term.children))))
+            cells.extend([0] * len(term.children))
+            for i, child in enumerate(term.children):
+                cells[start + 1 + i] = self._cell(child, variables)
+            return cell(STR, start)
+        elif isinstance(term, Atom):
+            return cell(ATM, self.symbol(term.name, 0))
+        elif isinstance(term, Term):
+            raise TypeError(f"Can't store {term!r}")
+        elif type(term) is int and INT_MIN <= term <= INT_MAX:
+            return cell(INT, term)
+        else:
+            return cell(CON, self.constant(term))
+    
+    def _list_cell(self, elements, tail, variables):
+        "Lists are '.'/2 structures, built without recursing on the tail"
+        cells = self.cells
+        dot = self.symbol('.', 2)
+        first = None
+        previous = None
+        for element in elements:
+            start = len(cells)
+            cells.extend((cell(FUN, dot), 0, 0))
+            cells[start + 1] = self._cell(element, variables)
+            if previous is None:
+                first = cell(STR, start)
+            else:
+                cells[previous] = cell(STR, start)
+            previous = start + 2
+        tail_cell = self._cell(tail, variables)
+        if previous is None:
+            return tail_cell
+        cells[previous] = tail_cell
+        return first
+    
+    # Unification and backtracking .....................
+    
+    def deref(self, addr):
+        "The address of the cell a chain of bound variables ends in"
+        cells = self.cells
+        c = cells[addr]
+        while c & TAG_MASK == REF:
+            target = c >> TAG_BITS
+            if target == addr:
+                return addr
+            addr = target
+            c = cells[addr]
+        return addr
+    
+    def bind(self, var, addr):
+        self.cells[var] = cell(REF, addr)
+        self.trail.append(var)
+    
+    def mark(self):
+        "A point to backtrack to with undo()"
+        return len(self.cells), len(self.trail)
+    
+    def undo(self, mark):
+        "Forgets all cells created and all bindings made since the mark"
+        size, trail_size = mark
+        cells, trail = self.cells, self.trail
+        for i in range(len(trail) - 1, trail_size - 1, -1):
+            var = trail[i]
+            if var < size:
+                cells[var] = cell(REF, var)
+        del trail[trail_size:]
+        del cells[size:]
+    
+    def unify(self, a, b, occurs_check=True):
+        """Unifies the terms with handles a and b, binding variables. Returns whether
+        that succeeded; on failure, bindings already made remain until undo()."""
+        cells = self.cells
+        todo = [(a, b)]
+        while todo:
+            a, b = todo.pop()
+            a, b = self.deref(a), self.deref(b)
+            if a == b:
+                continue
+            ca, cb = cells[a], cells[b]
+            ta, tb = ca & TAG_MASK, cb & TAG_MASK
+            if ta == REF or tb == REF:
+                if ta == REF and (tb != REF or a > b):  # bind the younger variable
+                    var, other = a, b
+                else:
+                    var, other = b, a
+                if occurs_check and self.occurs(var, other):
+                    return False
+                self.bind(var, other)
+            elif ta == STR and tb == STR:
+                fa, fb = ca >> TAG_BITS, cb >> TAG_BITS
+                if cells[fa] != cells[fb]:
+                    return False
+                if fa != fb:
+                    arity = self.symbols[cells[fa] >> TAG_BITS][1]
+                    todo.extend((fa + i, fb + i) for i in range(arity, 0, -1))
+            elif ta in (INT, CON) and tb in (INT, CON):
+                if self.load(a) != self.load(b):
+                    return False
+            elif ca != cb:
+                return False
+        return True
+    
+    def occurs(self, var, addr):
+        "Whether the unbound variable var occurs in the term at addr"
+        cells = self.cells
+        todo = [addr]
+        while todo:
+            addr = self.deref(todo.pop())
+            if addr == var:
+                return True
+            c = cells[addr]
+            if c & TAG_MASK == STR:
+                f = c >> TAG_BITS
+                todo.extend(range(f + 1, f + 1 + self.symbols[cells[f] >> TAG_BITS][1]))
+        return False
+    
+    def copy(self, addr, variables=None):
+        """Copies the term at addr with fresh variables (a renaming), returns its handle.
+        variables maps old variable addresses to new ones."""
+        variables = {} if variables is None else variables
+        c = self._copy_cell(addr, variables)
+        new = len(self.cells)
+        self.cells.append(c)
+        return new
+    
+    def _copy_cell(self, addr, variables):
+        cells = self.cells
+        addr = self.deref(addr)
+        c = cells[addr]
+        tag = c & TAG_MASK
+        if tag == REF:
+            if addr not in variables:
+                variables[addr] = self.new_var()
+            return cell(REF, variables[addr])
+        elif tag == STR:
+            f = c >> TAG_BITS
+            arity = self.symbols[cells[f] >> TAG_BITS][1]
+            start = len(cells)
+            cells.append(cells[f])
+            cells.extend([0] * arity)
+            for i in range(arity):
+                cells[start + 1 + i] = self._copy_cell(f + 1 + i, variables)
+            return cell(STR, start)
+        return c
+    
+    # Back to terms ....................................
+    
+    def load(self, addr, names=None):
+        """The term at addr as Atom/Compound/Variable/ListTerm objects. Unbound
+        variables are named by names (address -> name), or _G<address>."""
+        names = names or {}
+        cells = self.cells
+        addr = self.deref(addr)
+        c = cells[addr]
+        tag, value = c & TAG_MASK, c >> TAG_BITS
+        if tag == REF:
+            return Variable(names.get(addr, f"_G{addr}"), 0)
+        elif tag == ATM:
+            return Atom(self.symbols[value][0], been_scoped=True)
+        elif tag == INT:
+            return value
+        elif tag == CON:
+            return self.constants[value]
+        name, arity = self.symbols[cells[value] >> TAG_BITS]
+        if (name, arity) == ('.', 2):
+            return self._load_list(value, names)
+        return Compound(name, tuple(self.load(value + 1 + i, names) for i in range(arity)), been_scoped=True)
+    
+    def _load_list(self, f, names):
+        cells = self.cells
+        dot = cell(FUN, self.symbol('.', 2))
+        elements = []
+        while True:
+            elements.append(self.load(f + 1, names))
+            tail = self.deref(f + 2)
+            c = cells[tail]
+            if c & TAG_MASK != STR or cells[c >> TAG_BITS] != dot:
+                break
+            f = c >> TAG_BITS
+        tail = self.load(tail, names)
+        return list_from_segments([(elements, 0, len(elements))], tail, been_scoped=True)
+    
+    def bindings(self, variables):
+        "The values of the Variables in variables (as given to store), by name"
+        names = {addr: var.name for var, addr in variables.items()}
+        return {var.name: self.load(addr, names) for var, addr in variables.items()}
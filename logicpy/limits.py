@@ -0,0 +1,165 @@
+import copy
+import os
+import sys
+import time
+from contextvars import ContextVar
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# The QueryStats of the running query, set by Universe.query
+query_stats = ContextVar('query_stats', default=None)
+
+
+class Pause:
+    def __repr__(self):
+        return 'PAUSE'
+
+# Yielded by a predicate call instead of a result when the query has used up its
+# budget of inferences (QueryStats.budget, see logicpy.engines). Goals that prove
+# other goals pass it on, and the query continues when the next one is asked.
+PAUSE = Pause()
+
+
+class ResourceExceeded(Exception):
+    "Raised when a query hits one of its limits, with the counters at that moment"
+    
+    def __init__(self, resource, limit, stats):
+        super().__init__(f"Query exceeded its {resource} limit of {limit}: {stats}")
+        self.resource = resource
+        self.limit = limit
+        self.stats = stats.as_dict()
+
+
+class QueryCancelled(Exception):
+    "Raised by QueryStats.step once the cancel event of the query is set"
+
+
+def memory_usage():
+    "Resident memory of the process in bytes (its peak, where the current size is unknown), or None"
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, else KiB
+    return None
+
+
+class QueryStats:
+    """Counters of a running query, checked against its limits on every predicate call.
+    
+    inferences counts predicate calls (and loop iterations, see step), depth the
+    calls that are still running (each is a generator on the stack) and bindings
+    the size of the Result a call starts from. The peaks of depth and bindings show
+    how much memory the query needed. Memory is checked every memory_interval
+    seconds, and is the growth of the resident memory of the whole process."""
+    
+    memory_interval = 0.01
+    
+    def __init__(self, max_inferences=None, max_depth=None, timeout=None, max_memory=None):
+        self.max_inferences = max_inferences
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.inferences = self.depth = self.peak_depth = self.peak_bindings = 0
+        self.memory = 0
+        self.budget = None  # inferences left before the query pauses, see logicpy.engines
+        self.depth_bound = None  # calls deeper than this fail, see logicpy.search
+        self.bound_hit = False
+        self.cancel = None  # a threading.Event that stops the query when set, see fork
+        self.started = time.monotonic()
+        self._deadline = None if timeout is None else self.started + timeout
+        self._timed = timeout is not None or max_memory is not None
+        self._memory_start = None
+        self._next_memory_check = self.started
+        if max_memory is not None:
+            self._memory_start = memory_usage()
+            if self._memory_start is None:
+                raise ValueError("max_memory isn't supported on this platform")
+    
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+    
+    def enter(self, result):
+        "Called when a predicate call starts, returns whether it is beyond the depth bound"
+        self.depth += 1
+        if self.depth > self.peak_depth:
+            self.peak_depth = self.depth
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise ResourceExceeded('depth', self.max_depth, self)
+        self.step(result)
+        if self.depth_bound is not None and self.depth > self.depth_bound:
+            self.bound_hit = True
+            return True
+        return False
+    
+    def step(self, result):
+        "Counts an inference that doesn't open a call, like an iteration of repeat, and checks the limits"
+        self.inferences += 1
+        if len(result) > self.peak_bindings:
+            self.peak_bindings = len(result)
+        if self.budget is not None:
+            self.budget -= 1
+    
+        if self.max_inferences is not None and self.inferences > self.max_inferences:
+            raise ResourceExceeded('inferences', self.max_inferences, self)
+        if self._timed:
+            if self.cancel is not None and self.cancel.is_set():
+                raise QueryCancelled()
+            now = time.monotonic()
+            if self._deadline is not None and now > self._deadline:
+                raise ResourceExceeded('timeout', self.timeout, self)
+            if self._memory_start is not None and now >= self._next_memory_check:
+                self._next_memory_check = now + self.memory_interval
+                self.memory = memory_usage() - self._memory_start
+                if self.memory > self.max_memory:
+                    raise ResourceExceeded('memory', self.max_memory, self)
+    
+    def should_pause(self):
+        "Whether the running predicate call should yield PAUSE first"
+        return self.budget is not None and self.budget < 0
+    
+    def exit(self):
+        "Called when a predicate call has no more results (or is abandoned)"
+        self.depth -= 1
+    
+    def fork(self, cancel):
+        """Counters for part of the query that runs in another thread (see par_and),
+        with the same limits and no budget. Its calls raise QueryCancelled once the
+        threading.Event cancel is set. Add them back with merge when it's done."""
+        child = copy.copy(self)
+        child.budget = None
+        child.bound_hit = False
+        child.peak_depth, child.peak_bindings = self.depth, 0
+        child.cancel = cancel
+        child._timed = True
+        child._forked_at = self.inferences
+        return child
+    
+    def merge(self, child):
+        "Adds the counters of a fork whose thread is done, and checks the inference limit"
+        inferences = child.inferences - child._forked_at
+        self.inferences += inferences
+        if self.budget is not None:
+            self.budget -= inferences
+        self.peak_depth = max(self.peak_depth, child.peak_depth)
+        self.peak_bindings = max(self.peak_bindings, child.peak_bindings)
+        self.memory = max(self.memory, child.memory)
+        self.bound_hit = self.bound_hit or child.bound_hit
+        if self.max_inferences is not None and self.inferences > self.max_inferences:
+            raise ResourceExceeded('inferences', self.max_inferences, self)
+    
+    def as_dict(self):
+        return {'inferences': self.inferences, 'depth': self.depth, 'peak_depth': self.peak_depth,
+                'peak_bindings': self.peak_bindings, 'elapsed': self.elapsed, 'memory': self.memory}
+    
+    def __repr__(self):
+        return 'QueryStats(' + ', '.join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}"
+                                         for k, v in self.as_dict().items()) + ')'
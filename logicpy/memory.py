@@ -0,0 +1,120 @@
+# Memory accounting
+# -----------------
+#
+# Approximate sizes of what a universe keeps alive: per predicate its clauses,
+# the number of term nodes in them and the tables answering it instead. Sizes
+# are deep sys.getsizeof sums, counting shared objects (like the Python list
+# behind list terms) once per predicate.
+
+import sys
+from types import FunctionType, BuiltinFunctionType, MethodType, ModuleType
+
+from logicpy.structure import MultiArg, MonoArg
+from logicpy.data import Compound, ListTerm, list_elements
+from logicpy.predicate import PredicateCall
+
+
+def deep_sizeof(obj, seen=None, skip=()):
+    """The size in bytes of obj and everything it refers to, except for objects in
+    seen (ids, updated) and instances of the types in skip. Functions, classes and
+    modules aren't counted."""
+    seen = set() if seen is None else seen
+    skip = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType) + tuple(skip)
+    total = 0
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, skip):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            todo.extend(o.keys())
+            todo.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            todo.extend(o)
+        if hasattr(o, '__dict__'):
+            todo.append(o.__dict__)
+        for slot in getattr(type(o), '__slots__', ()):
+            if hasattr(o, slot):
+                todo.append(getattr(o, slot))
+    return total
+
+
+def term_nodes(obj):
+    "The number of nodes (terms, constants, goals) in a term or clause body"
+    count = 0
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        count += 1
+        if isinstance(o, ListTerm):
+            segments, tail = o.segments()
+            elements = list(list_elements(segments))
+            count += len(elements) - 1  # a list cell per element
+            todo.extend(elements)
+            todo.append(tail)
+        elif isinstance(o, list):  # becomes a list term when scoped
+            count += len(o) - 1
+            todo.extend(o)
+        elif isinstance(o, Compound):
+            todo.extend(o.children)
+        elif isinstance(o, (MultiArg, PredicateCall)):
+            todo.extend(o.args)
+        elif isinstance(o, MonoArg):
+            todo.append(o.arg)
+    return count
+
+
+def clause_nodes(clause):
+    return sum(map(term_nodes, clause.args)) + term_nodes(clause.body)
+
+
+def table_report(table, skip):
+    "Rows and index sizes of a FactTable"
+    return {'rows': len(table),
+            'indexes': {positions: len(index) for positions, index in table._indexes.items()},
+            'bytes': deep_sizeof((table.rows, table._indexes), skip=skip)}
+
+
+def predicate_report(pred, skip=()):
+    from logicpy.datalog import FactTable
+    seen = set()
+    report = {'clauses': len(pred.clauses),
+              'nodes': sum(map(clause_nodes, pred.clauses)),
+              'bytes': deep_sizeof(pred.clauses, seen, skip)}
+    if isinstance(pred.source, FactTable):
+        report['table'] = table_report(pred.source, skip)
+    elif pred.source is not None:
+        report['source'] = repr(pred.source)
+        if getattr(pred.source, 'cache', None) is not None:
+            report['source_cache'] = {**pred.source.cache.stats(),
+                                      'bytes': deep_sizeof(pred.source.cache.entries, skip=skip)}
+    return report
+
+
+class MemoryReport(dict):
+    "Signature -> report of Universe.memory_report, printed as a table"
+    
+    @property
+    def total(self):
+        return sum(r['bytes'] + r.get('table', {}).get('bytes', 0) for r in self.values())
+    
+    def __str__(self):
+        lines = [f"{'predicate':<24} {'clauses':>8} {'nodes':>10} {'bytes':>12}  tables"]
+        for sig, r in sorted(self.items(), key=lambda item: -item[1]['bytes']):
+            extra = ''
+            if 'table' in r:
+                extra = f"{r['table']['rows']} rows, {r['table']['bytes']} bytes, indexes {r['table']['indexes']}"
+            elif 'source' in r:
+                extra = r['source']
+            lines.append(f"{str(sig):<24} {r['clauses']:>8} {r['nodes']:>10} {r['bytes']:>12}  {extra}")
+        lines.append(f"{'total':<24} {'':>8} {'':>10} {self.total:>12}")
+        return '\n'.join(lines)
+
+
+def memory_report(univ):
+    """The approximate memory use of each predicate: clause count, term nodes,
+    bytes of the clauses, and the tables or sources answering it"""
+    skip = (type(univ),)
+    return MemoryReport((sig, predicate_report(pred, skip)) for sig, pred in univ._predicates.items())
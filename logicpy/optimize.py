@@ -0,0 +1,354 @@
+# Partial evaluation
+# ------------------
+#
+# Universe.optimize rewrites clause bodies ahead of time, keeping their answers:
+# calls to small non-recursive predicates are unfolded (their clauses inlined,
+# as a disjunction), unifying the head with the arguments as far as that can be
+# done statically, so clauses that can't match are dropped and known constants
+# are substituted. Arithmetic on constants is folded, goals on constants are
+# decided and conjunctions and disjunctions are flattened. The original clauses
+# are kept, and put back when a predicate that was unfolded into them changes.
+
+import operator
+from itertools import count
+
+from logicpy.structure import Structure, MultiArg, MonoArg
+from logicpy.builtin import True_, Fail, and_, or_, unify, neg, cut, Evaluation, Comparison, \
+    EvalException, evaluate, max_, min_, abs_
+from logicpy.data import Term, Variable, Compound, EvalCompound, ListTerm, list_segments, list_elements
+from logicpy.result import Result, UnificationFail, OccursCheckError
+from logicpy.predicate import Clause, NoArgument, PredicateCall, Signature, called_signatures
+from logicpy.memory import clause_nodes
+from logicpy.core import Underscore
+
+# Functions that are folded when all their operands are constants: side effect
+# free, and cheap for any operands
+FOLDABLE = {operator.add, operator.sub, operator.mul, operator.truediv, operator.floordiv,
+            operator.mod, operator.pos, operator.neg, max_.__wrapped__, min_.__wrapped__, abs_.__wrapped__}
+
+_renames = count()
+
+
+def optimize(univ, signatures=None, *, max_clauses=2, max_nodes=40):
+    """Replaces the clauses of the given predicates (all by default) by partially
+    evaluated ones, see Universe.optimize. Returns the signatures that changed."""
+    if signatures is None:
+        signatures = [sig for sig, pred in univ._predicates.items() if pred.source is None and not pred.set_oriented]
+    signatures = [Signature.parse(s) for s in signatures]
+    for sig in signatures:
+        if sig in univ._optimized:
+            univ._deoptimize(sig)
+
+    evaluator = PartialEvaluator(univ, max_clauses, max_nodes)
+    changes = {}
+    for sig in signatures:
+        clauses, inlined = evaluator.clauses(sig)
+        pred = univ.get_pred(sig)
+        if clauses != pred.clauses:
+            changes[sig] = pred, clauses, inlined
+
+    for sig, (pred, clauses, inlined) in changes.items():
+        originals = {id(new): (new, old) for new, old in zip(clauses, pred.clauses) if new is not old}
+        pred.clauses = clauses
+        univ._invalidate(sig)
+        changes[sig] = originals, inlined
+    # Only now, so invalidating one of them doesn't put back the others
+    univ._optimized.update(changes)
+    return set(changes)
+
+
+def listing(univ, signatures=None):
+    "The clauses of the given predicates (all by default), as text"
+    signatures = univ._predicates if signatures is None else map(Signature.parse, signatures)
+    lines = []
+    for sig in signatures:
+        pred = univ.get_pred(sig)
+        if pred is None:
+            continue
+        if pred.source is not None:
+            lines.append(f"% {sig}: answered by {pred.source!r}")
+        lines.extend(map(format_clause, pred.clauses))
+    return "\n".join(lines)
+
+
+def format_clause(clause):
+    head = clause.signature.name
+    if clause.args:
+        head += f"({', '.join(str(ListTerm.view(a)) if isinstance(a, list) else str(a) for a in clause.args)})"
+    return f"{head}." if clause.body is True_ else f"{head} :- {clause.body}."
+
+
+def original_clauses(univ, sig):
+    "The clauses of a predicate as they were defined, before Universe.optimize"
+    pred = univ.get_pred(sig)
+    if sig not in univ._optimized:
+        return pred.clauses
+    originals = univ._optimized[sig][0]
+    return tuple(originals[id(c)][1] if id(c) in originals else c for c in pred.clauses)
+
+
+class PartialEvaluator:
+    def __init__(self, univ, max_clauses, max_nodes):
+        self.univ = univ
+        self.max_clauses = max_clauses
+        self.max_nodes = max_nodes
+        self.done = {}  # signature -> (optimized clauses, signatures unfolded into them)
+
+    def clauses(self, sig):
+        if sig not in self.done:
+            inlined = set()
+            self.done[sig] = tuple(self.clause(c, inlined) for c in original_clauses(self.univ, sig)), inlined
+        return self.done[sig]
+
+    def clause(self, clause, inlined):
+        if clause.body is True_:
+            return clause
+        body = drop_unused(clause.args, simplify(self.unfold_calls(clause.body, inlined)))
+        if repr(body) == repr(clause.body):
+            return clause
+        new = Clause(clause.signature.name, clause.args, body, None)
+        new.univ = clause.univ
+        return new
+
+    def unfoldable(self, sig):
+        "The (optimized) clauses of a predicate that may be unfolded into its callers, or None"
+        pred = self.univ.get_pred(sig)
+        if pred is None or pred.source is not None or pred.set_oriented or not pred.clauses \
+                or len(pred.clauses) > self.max_clauses:
+            return None
+        clauses = original_clauses(self.univ, sig)
+        if sig in self.univ.dependencies({s for c in clauses for s in called_signatures(c.body)}):
+            return None  # recursive
+        if any(not unfoldable_body(c.body) for c in clauses):
+            return None
+        clauses, inlined = self.clauses(sig)
+        if sum(map(clause_nodes, clauses)) > self.max_nodes:
+            return None
+        return clauses, inlined
+
+    def unfold_calls(self, goal, inlined):
+        if isinstance(goal, PredicateCall):
+            found = self.unfoldable(goal.signature)
+            if found is None:
+                return goal
+            clauses, callee_inlined = found
+            inlined.add(goal.signature)
+            inlined.update(callee_inlined)
+            return simplify(unfold(goal, clauses))
+        args = goal_args(goal)
+        if args is None:
+            return goal
+        return rebuild(goal, [self.unfold_calls(a, inlined) if isinstance(a, Structure) else a for a in args])
+
+
+# Goals and terms
+# ---------------
+
+def goal_args(goal):
+    "The arguments of a goal that can be rebuilt with them, None for other goals"
+    if isinstance(goal, MultiArg):
+        return tuple(goal.args)
+    elif isinstance(goal, MonoArg):
+        return (goal.arg,)
+    return None
+
+
+def rebuild(goal, args):
+    if isinstance(goal, PredicateCall):
+        return PredicateCall(goal.univ, goal.signature, tuple(args))
+    return type(goal)(*args)
+
+
+def unfoldable_body(goal):
+    "Whether a clause body can be copied into another clause: no cuts or goals we can't rename"
+    if goal is cut:
+        return False
+    args = goal_args(goal)
+    if args is None:
+        return goal is True_ or goal is Fail or isinstance(goal, NoArgument)
+    return all(unfoldable_body(a) for a in args if isinstance(a, Structure))
+
+
+def is_constant(obj):
+    return not isinstance(obj, (Term, list, Structure))
+
+
+def map_variables(obj, f):
+    "obj with f applied to its variables (and underscores)"
+    if isinstance(obj, (Variable, Underscore)):
+        return f(obj)
+    elif isinstance(obj, list):
+        return [map_variables(o, f) for o in obj]
+    elif isinstance(obj, ListTerm):
+        if obj.ground:
+            return obj
+        segments, tail = list_segments(obj)
+        return ListTerm.view([map_variables(e, f) for e in list_elements(segments)], tail=map_variables(tail, f))
+    elif isinstance(obj, Compound):
+        return obj.with_children([map_variables(c, f) for c in obj.children])
+    elif isinstance(obj, Structure):
+        args = goal_args(obj)
+        return obj if args is None else rebuild(obj, [map_variables(a, f) for a in args])
+    return obj
+
+
+def substitute(obj, S):
+    return map_variables(obj, lambda v: S.get(v, v) if isinstance(v, Variable) else v)
+
+
+def variables(obj):
+    found = []
+    map_variables(obj, found.append)
+    return found
+
+
+# Unfolding
+# ---------
+
+def renamed(clause):
+    "The head arguments and body of clause with fresh variables, and those variables"
+    k = next(_renames)
+    fresh = {}
+
+    def rename(v):
+        if isinstance(v, Underscore):
+            return Variable(f"_#{k}.{next(_renames)}")
+        if v not in fresh:
+            fresh[v] = Variable(f"{v.name}#{k}")
+        return fresh[v]
+
+    args = [map_variables(a, rename) for a in clause.args]
+    body = map_variables(clause.body, rename)
+    return args, body, set(fresh.values())
+
+
+def unfold(call, clauses):
+    "The goal proving call with clauses, a disjunction of their renamed bodies"
+    branches = []
+    for clause in clauses:
+        head, body, fresh = renamed(clause)
+        try:
+            goals, S = head_unifier(head, call.args, fresh)
+        except UnificationFail:
+            continue  # can't match this call
+        branches.append(and_(*goals, substitute(body, S)))
+    return or_(*branches)
+
+
+def head_unifier(head, args, fresh):
+    """Unifies the (renamed) head arguments with the arguments of a call. Returns the
+    goals binding the caller's variables, and the substitution for the fresh ones."""
+    fallback = [unify(h, a) for h, a in zip(head, args)], {}
+    if any(isinstance(v, Underscore) for a in args for v in variables(a)):
+        return fallback  # every occurrence of _ is another variable
+    to_term = lambda t: ListTerm.view(t) if isinstance(t, list) else t
+    try:
+        solved = Result.solve([(to_term(h), to_term(a)) for h, a in zip(head, args)], 'error')
+    except OccursCheckError:
+        return fallback  # whether that fails depends on the occurs check mode of the query
+
+    S = {var: value for var, value in solved if var in fresh}
+    bound = [(var, value) for var, value in solved if var not in fresh]
+    for var, value in bound:
+        # The caller's variable is bound to one of the clause: substitute the other way around
+        if isinstance(value, Variable) and value in fresh and value not in S:
+            S[value] = var
+    S = {var: substitute(value, S) for var, value in S.items()}
+    goals = []
+    for var, value in bound:
+        value = substitute(value, S)
+        if value is not var:
+            goals.append(unify(var, value))
+    return goals, S
+
+
+# Simplification
+# --------------
+
+def fold(expr):
+    "expr with its subexpressions on constants evaluated"
+    if not isinstance(expr, EvalCompound):
+        return expr
+    expr = expr.with_children([fold(c) for c in expr.children])
+    if expr.func in FOLDABLE and all(map(is_constant, expr.children)):
+        try:
+            return evaluate(expr)
+        except EvalException:
+            pass  # fails when proven
+    return expr
+
+
+def simplify(goal):
+    if isinstance(goal, and_):
+        goals = []
+        known = {}  # variable -> constant it is bound to by an earlier goal
+        for g in goal.args:
+            g = simplify(substitute(g, known) if known else g)
+            for part in g.args if isinstance(g, and_) else (g,):
+                if part is True_:
+                    continue
+                goals.append(part)
+                if part is Fail:
+                    break  # the rest is never proven
+                if isinstance(part, unify):
+                    if isinstance(part.left, Variable) and is_constant(part.right):
+                        known[part.left] = part.right
+                    elif isinstance(part.right, Variable) and is_constant(part.left):
+                        known[part.right] = part.left
+            if goals and goals[-1] is Fail:
+                # Goals without effects right before it change nothing either
+                while len(goals) > 1 and isinstance(goals[-2], (unify, Comparison, Evaluation)):
+                    del goals[-2]
+                break
+        return goals[0] if len(goals) == 1 else and_(*goals) if goals else True_
+
+    elif isinstance(goal, or_):
+        branches = [b for g in map(simplify, goal.args) for b in (g.args if isinstance(g, or_) else (g,))
+                    if b is not Fail]
+        return branches[0] if len(branches) == 1 else or_(*branches) if branches else Fail
+
+    elif isinstance(goal, neg):
+        arg = simplify(goal.arg)
+        return Fail if arg is True_ else True_ if arg is Fail else neg(arg)
+
+    elif isinstance(goal, Evaluation):
+        right = fold(goal.right)
+        if is_constant(right):
+            return simplify(unify(goal.left, right))
+        return Evaluation(goal.left, right)
+
+    elif isinstance(goal, Comparison):
+        left, right = fold(goal.left), fold(goal.right)
+        if is_constant(left) and is_constant(right):
+            try:
+                return True_ if goal.compare(left, right) else Fail
+            except Exception:
+                pass  # raises when proven
+        return type(goal)(left, right)
+
+    elif isinstance(goal, unify):
+        if is_constant(goal.left) and is_constant(goal.right):
+            return True_ if goal.left == goal.right else Fail
+        return goal
+
+    args = goal_args(goal)
+    if args is None:
+        return goal
+    return rebuild(goal, [simplify(a) if isinstance(a, Structure) else a for a in args])
+
+
+def drop_unused(head, body):
+    """Drops the conjuncts binding a variable to a constant that occurs nowhere else in
+    the clause: answers don't show clause variables, so they change nothing."""
+    goals = body.args if isinstance(body, and_) else (body,)
+    used = [set(variables(g)) for g in goals]
+    head_vars = set(variables(list(head)))
+    kept = []
+    for i, g in enumerate(goals):
+        if isinstance(g, unify):
+            var = g.left if is_constant(g.right) else g.right if is_constant(g.left) else None
+            if isinstance(var, Variable) and var not in head_vars \
+                    and not any(var in u for j, u in enumerate(used) if j != i):
+                continue
+        kept.append(g)
+    return kept[0] if len(kept) == 1 else and_(*kept) if kept else True_
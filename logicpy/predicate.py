@@ -1,10 +1,11 @@
 
 from collections import namedtuple
 
-from logicpy.structure import Structure, MultiArg
-from logicpy.builtin import True_, Fail, and_, or_, PredicateCut
+from logicpy.structure import Structure, MultiArg, MonoArg, GrammarBody
+from logicpy.builtin import True_, Fail, and_, or_, PredicateCut, wake
 from logicpy.result import Result, UnificationFail
 from logicpy.data import with_scope, Variable
+from logicpy.limits import query_stats, PAUSE
 
 
 class PredicateNotFound(Exception):
@@ -17,6 +18,14 @@ class Signature(namedtuple('_Signature', ('name', 'arity'))):
         return f"{self.name}/{self.arity}"
     
     __repr__ = __str__
+    
+    @classmethod
+    def parse(cls, obj):
+        "Accepts a Signature, a (name, arity) tuple or a 'name/arity' string"
+        if isinstance(obj, str):
+            name, arity = obj.rsplit('/', 1)
+            return cls(name, int(arity))
+        return cls(*obj)
 
 
 class Clause:
@@ -25,7 +34,9 @@ class Clause:
         self.signature = Signature(name, len(args))
         self.args = args
         self.body = True_ if body is True else body
-        if self.body and self.univ:
+        if isinstance(self.body, GrammarBody):
+            raise TypeError(f"{self.body} is a grammar rule body, define grammar rules with >>")
+        if self.body is not None and self.univ:
             self.univ.define(self)
     
     def __str__(self):
@@ -47,25 +58,23 @@ class NoArgument(Clause, Structure):
     """
     
     def __init__(self, name, body, univ):
-        # Protection against unwanted /0 base clauses
-        self.am_i_new = Signature(name, 0) not in univ._predicates and body is not None
-        Clause.__init__(self, name, (), body, univ)  # Covers 1 and 2 (/0 clauses)
-    
-    def del_if_new(self):
-        if self.am_i_new:
-            # Remove the /0 variant since we're actually defining another arity
-            del self.univ._predicates[self.signature]
+        # Only defines a /0 clause when given a body (case 1), so building goals
+        # doesn't change the universe
+        Clause.__init__(self, name, (), body, univ)
     
     def __setitem__(self, args, body):
         # /1 or higher clauses
-        self.del_if_new()
         if not isinstance(args, tuple): args = (args,)
         return Clause(self.signature.name, args, body, self.univ)
     
     def __call__(self, *args):
         # /1 or higher call
-        self.del_if_new()
         return PredicateCall(self.univ, Signature(self.signature.name, len(args)), args)
+    
+    def __rshift__(self, body):
+        # u.greeting >> ([_.hello] & u.name) --> grammar rule, see logicpy.dcg
+        from logicpy.dcg import rule
+        return rule(self, body)
         
     def prove(self, result, dbg):
         # Act like a PredicateCall (/0 structure)
@@ -76,16 +85,24 @@ class NoArgument(Clause, Structure):
 class Predicate:
     def __init__(self, signature):
         self.signature = signature
-        self.clauses = []
+        self.clauses = ()  # replaced, not changed, so running calls keep their snapshot
+        self.source = None  # answers calls instead of the clauses, e.g. a FactTable
+        self.set_oriented = False  # evaluate calls bottom-up (see logicpy.datalog)
     
     def add_clause(self, clause):
-        self.clauses.append(clause)
+        self.clauses = self.clauses + (clause,)
+    
+    def remove_clause(self, clause):
+        self.clauses = tuple(c for c in self.clauses if c is not clause)
+    
+    def dependencies(self):
+        return {sig for clause in self.clauses for sig in called_signatures(clause.body)}
     
     def __str__(self):
         return str(self.signature)
     
     def __repr__(self):
-        return ";  ".join(map(repr, clauses))
+        return ";  ".join(map(repr, self.clauses))
 
 
 class PredicateCall(MultiArg):
@@ -103,37 +120,84 @@ class PredicateCall(MultiArg):
     def with_scope(self, scope):
         return PredicateCall(self.univ, self.signature, [with_scope(a, scope) for a in self.args])
     
+    def __rshift__(self, body):
+        from logicpy.dcg import rule
+        return rule(self, body)
+    
     def prove(self, result, dbg):
         dbg.prove(self, result)
-        pred = self.univ.get_pred(self.signature)
-        
-        if pred is None:
-            raise PredicateNotFound(f"Couldn't find predicate with signature {self.signature}")
-        else:
-            try:
-                for i, clause in enumerate(pred.clauses):
-                    scope = self.scope_id()
-                    structure = clause.body.with_scope(scope)
-                    
-                    arg_res = Result((with_scope(a, scope), b) for a, b in zip(clause.args, self.args))
-                    try:
-                        total_res = (arg_res | result).mgu()
-                        dbg.output(f"Unified arguments for clause {i}")
-                    except UnificationFail as e:
-                        dbg.output(f"Failed to unify arguments for clause {i}: {e}")
-                        continue
-                    
-                    relevant_res = Result((a, b) for a, b in total_res if (a,b) in arg_res or (isinstance(a, Variable) and a.scope == scope))
-                    
-                    clause_dbg = dbg.next()
-                    clause_dbg.prove(clause, relevant_res)
-                    
-                    for new_res in structure.prove(relevant_res, dbg or clause_dbg.from_next()):
+        stats = query_stats.get()  # of the running query, see logicpy.limits
+        beyond_bound = stats is not None and stats.enter(result)
+        try:
+            if beyond_bound:
+                return  # iterative deepening, see logicpy.search
+            if stats is not None and stats.should_pause():
+                yield PAUSE
+            pred = self.univ.get_pred(self.signature)
+            
+            if pred is None:
+                raise PredicateNotFound(f"Couldn't find predicate with signature {self.signature}")
+            elif pred.source is not None:
+                yield from pred.source.prove(self, result, dbg)
+            elif pred.set_oriented:
+                from logicpy.datalog import prove_set_oriented
+                yield from prove_set_oriented(self.univ, self, result, dbg)
+            else:
+                # Answers only keep the bindings of variables the caller can see, which
+                # existed before the call. The clause variables are dead afterwards.
+                first_scope = self.scope_id()
+                try:
+                    for i, clause in enumerate(pred.clauses):
+                        scope = self.scope_id()
+                        structure = clause.body.with_scope(scope)
+                        
+                        arg_res = Result((with_scope(a, scope), b) for a, b in zip(clause.args, self.args))
                         try:
-                            mgu = (new_res | result | arg_res).mgu()
-                            clause_dbg.proven(clause, mgu)
-                            yield mgu
+                            total_res = (arg_res | result).mgu()
+                            dbg.output(f"Unified arguments for clause {i}")
                         except UnificationFail as e:
-                            clause_dbg.output(f"Failed to unify resulting sets: {e}")
-            except PredicateCut:
-                pass  # Look at how easy that is ;)
+                            if dbg:
+                                dbg.output(f"Failed to unify arguments for clause {i}: {e}")
+                            continue
+                        
+                        # Binding the arguments may wake delayed goals of the caller
+                        for woken in wake(total_res, dbg) if total_res.delayed else (total_res,):
+                            if woken is PAUSE:
+                                yield woken
+                                continue
+                            relevant_res = Result((a, b) for a, b in woken if (a,b) in arg_res or (isinstance(a, Variable) and a.scope == scope))
+                            
+                            clause_dbg = dbg.next()
+                            clause_dbg.prove(clause, relevant_res)
+                            
+                            for new_res in structure.prove(relevant_res, dbg or clause_dbg.from_next()):
+                                if new_res is PAUSE:
+                                    yield new_res
+                                    continue
+                                try:
+                                    mgu = (new_res | woken | arg_res).mgu()
+                                    clause_dbg.proven(clause, mgu)
+                                except UnificationFail as e:
+                                    if clause_dbg:
+                                        clause_dbg.output(f"Failed to unify resulting sets: {e}")
+                                    continue
+                                for answer in wake(mgu, dbg) if mgu.delayed else (mgu,):
+                                    yield answer if answer is PAUSE else answer.trim(first_scope)
+                except PredicateCut:
+                    pass  # Look at how easy that is ;)
+        finally:
+            if stats is not None:
+                stats.exit()
+
+
+def called_signatures(structure):
+    "Yields the signature of every predicate called directly from a clause body"
+    todo = [structure]
+    while todo:
+        s = todo.pop()
+        if isinstance(s, (PredicateCall, NoArgument)):
+            yield s.signature
+        elif isinstance(s, MultiArg):
+            todo.extend(s.args)
+        elif isinstance(s, MonoArg):
+            todo.append(s.arg)
@@ -1,13 +1,34 @@
 
-from logicpy.data import Term, Variable, BasicTerm, has_occurence, replace
+from contextvars import ContextVar
+
+from logicpy.data import Term, Variable, BasicTerm, Compound, ListTerm, list_segments, list_elements, is_nil, \
+    list_from_segments, occurences
 from logicpy.debug import NoDebugger
 
+# Unification mode of the current query, set by Universe.query:
+#   'true':  fail on cyclic terms
+#   'false': allow cyclic (rational) terms
+#   'error': raise OccursCheckError on cyclic terms
+OCCURS_CHECK_MODES = ('true', 'false', 'error')
+occurs_check = ContextVar('occurs_check', default='true')
+
+
+class OccursCheckError(Exception):
+    pass
+
+
 class ResultException(Exception):
     pass
 
 
 class UnificationFail(ResultException):
-    pass
+    """UnificationFail(message, *terms). The terms can be large (like the rest of a
+    long input), so they are only formatted into the message when it is shown,
+    and callers only show it while debugging."""
+    
+    def __str__(self):
+        message, *terms = self.args
+        return message.format(*terms) if terms else message
 
 
 class Uninstantiated(ResultException):
@@ -15,8 +36,10 @@ class Uninstantiated(ResultException):
 
 
 class Result:
-    def __init__(self, it = None, var_cache = None):
+    def __init__(self, it = None, var_cache = None, delayed = ()):
         self.var_cache = var_cache or {}
+        self.delayed = delayed  # goals waiting for variables to be bound, see logicpy.builtin.wake
+        self._bindings = None  # variable -> value, built on first use by get_var
         if it:
             self.identities = frozenset(it)
         else:
@@ -29,7 +52,8 @@ class Result:
     for fname in ['__and__', '__xor__', '__sub__',
                   'intersection', 'difference', 'symmetric_difference', 'union']:
         def passthrough(self, other, f = getattr(frozenset, fname)):
-            return type(self)(f(self.identities, other.identities if isinstance(other, Result) else other))
+            return type(self)(f(self.identities, other.identities if isinstance(other, Result) else other),
+                              delayed=self.delayed)
         locals()[fname] = passthrough
     
     def __or__(self, other):
@@ -42,9 +66,11 @@ class Result:
             
             total_var_cache = {**self.var_cache, **other.var_cache}
             total_identities = self.identities | other.identities
-            return type(self)(total_identities, total_var_cache)
+            delayed = self.delayed + tuple(d for d in other.delayed if d not in self.delayed) \
+                if other.delayed else self.delayed
+            return type(self)(total_identities, total_var_cache, delayed)
         else:
-            return type(self)(self.identities | other)
+            return type(self)(self.identities | other, delayed=self.delayed)
     
     def __len__(self):
         return len(self.identities)
@@ -59,12 +85,13 @@ class Result:
     # Representation and easy usage ......................
     
     def __str__(self):
+        delayed = ''.join(f", {d}" for d in self.delayed)
         if len(self) == 0:
-            return 'ok'
-        return '{' + ', '.join(f"{L} = {R}" for L, R in self.identities) + '}'
+            return 'ok' + delayed
+        return '{' + ', '.join(f"{L} = {R}" for L, R in self.identities) + '}' + delayed
     
     def easy_dict(self):
-        return {L.name: R for L, R in self.identities if isinstance(L, Variable) and L.scope == 0}
+        return {L.name: to_python(R) for L, R in self.identities if isinstance(L, Variable) and L.scope == 0}
     
     
     # Prolog additions ....................................
@@ -73,79 +100,230 @@ class Result:
         try:
             return self.var_cache[var]
         except KeyError:
-            for A, B in self.identities:
-                if A == var:
-                    self.var_cache[var] = B
-                    return B
-        raise Uninstantiated(f"Uninstantiated: {var}")
+            pass
+        # Built at once and never changed afterwards, so Results can be shared between threads
+        bindings = self._bindings
+        if bindings is None:
+            bindings = self._bindings = {A: B for A, B in self.identities if isinstance(A, Variable)}
+        try:
+            return bindings[var]
+        except KeyError:
+            raise Uninstantiated(f"Uninstantiated: {var}") from None
+    
+    def with_delayed(self, delayed):
+        "The same bindings with other delayed goals"
+        res = type(self)(self.identities, self.var_cache, tuple(delayed))
+        res._bindings = self._bindings
+        return res
+    
+    def project(self, variables):
+        """Only the bindings of the given variables (and of those in delayed goals).
+        In solved form no bound variable occurs in a value, so the others can't affect
+        them: a caller only knowing these variables sees the same answer, without the
+        bindings of dead ones."""
+        return self._only(variables.__contains__)
+    
+    def trim(self, first_scope, keep=frozenset(), drop=frozenset()):
+        """Without the bindings of variables made since scope first_scope (see
+        Structure.scope_id) unless they are in keep, and of those in drop: project
+        on the variables that existed when a proof started, without finding them."""
+        def live(var):
+            if var in drop:
+                return False
+            return var.scope is None or var.scope < first_scope or var in keep
+        return self._only(live)
+    
+    def _only(self, live):
+        "Only the bindings of the variables for which live is true, see project"
+        if self.delayed:
+            delayed = set()
+            for d in self.delayed:
+                d.occurences(delayed)
+            live = lambda var, live=live: var in delayed or live(var)
+        kept = {(A, B) for A, B in self.identities if live(A)}
+        if len(kept) == len(self.identities):
+            return self
+        if occurs_check.get() == 'false':
+            # Rational trees do refer to bound variables: keep what they refer to
+            bindings = {A: B for A, B in self.identities}
+            todo = [B for A, B in kept]
+            seen = set()
+            while todo:
+                V = set()
+                occurences(todo.pop(), V)
+                for var in V - seen:
+                    seen.add(var)
+                    if var in bindings and not live(var):
+                        kept.add((var, bindings[var]))
+                        todo.append(bindings[var])
+        return Result(kept, delayed=self.delayed)
+    
+    def walk(self, obj):
+        "The value of obj if it is a bound variable, else obj itself"
+        if isinstance(obj, Variable):
+            try:
+                return self.get_var(obj)
+            except Uninstantiated:
+                pass
+        return obj
     
     def mgu(self):
-        return Result(Result.martelli_montanari(set(self.identities)))
+        return Result(Result.solve(self.identities), delayed=self.delayed)
     
     @staticmethod
-    def martelli_montanari(E):
-        from logicpy.structure import Structure
-        
-        if len(E) == 0:
-            return E
+    def solve(E, mode=None):
+        """Unifies all pairs in E. Returns the solved form: pairs (Variable, term),
+        where no bound variable occurs in any term (except in rational trees).
         
-        did_a_thing = True
-        tried = set()
+        Variables are bound in a dictionary first, without substituting, so
+        binding a variable to a term is O(1). Resolving the bindings afterwards
+        doubles as occurs check: it finds the cycles. With occurs_check 'false'
+        these are kept, as rational trees: X = f(X) stays X = f(X)."""
+        mode = mode or occurs_check.get()
+        bindings = {}
+        seen = set()  # ids of the pairs of terms peeled
+        keep = []  # the terms in seen
+        todo = list(E)
         
-        while True:
-            untried = E - tried
-            if len(untried) == 0: break
-            (A, B) = untried.pop()
-            E.remove((A, B))
-            did_a_thing = True  # Assume and unset later
-             
-            if not isinstance(A, Variable) and isinstance(B, Variable):
-                # switch
-                E.add((B, A))
+        while todo:
+            A, B = todo.pop()
+            while isinstance(A, Variable) and A in bindings:
+                A = bindings[A]
+            while isinstance(B, Variable) and B in bindings:
+                B = bindings[B]
+            if A is B:
+                continue
+            
+            if isinstance(A, Variable):
+                if isinstance(B, Variable):
+                    if A.really_equal(B):
+                        continue
+                    if A.scope == 0:
+                        A, B = B, A  # keep variables of the query as representatives
+                bindings[A] = B
+            elif isinstance(B, Variable):
+                bindings[B] = A
             elif isinstance(A, BasicTerm) and isinstance(B, BasicTerm):
-                # peel
-                if A.name == B.name and len(A.children) == len(B.children):
-                    E.update(zip(A.children, B.children))
+                if A.name != B.name:
+                    raise UnificationFail("Conflict {}, {}", A, B)
+                if (id(A), id(B)) in seen:
+                    continue  # already peeled, this only happens with rational trees
+                seen.add((id(A), id(B)))
+                keep.append((A, B))  # so their ids aren't reused meanwhile
+                if A.name == '.' and (isinstance(A, ListTerm) or isinstance(B, ListTerm)):
+                    todo.extend(list_pairs(A, B))  # peel lists all at once
+                elif len(A.children) == len(B.children):
+                    todo.extend(zip(A.children, B.children))
                 else:
-                    raise UnificationFail(f"Conflict {A}, {B}")
-            elif isinstance(A, Variable) and (not isinstance(B, Variable) or not A.really_equal(B)):
-                # substitute
-                if has_occurence(B, A):
-                    raise UnificationFail(f"Occurs check {A}, {B}")
-                # While not very elegant, this is substantially faster in PyPy
-                # In CPython, it's about the same
-                remove_from_E = set()
-                add_to_E = list()
-                did_a_thing = False
-                for t in E:
-                    nt = (replace(t[0], A, B), replace(t[1], A, B))
-                    if t != nt:
-                        did_a_thing = True
-                        remove_from_E.add(t)
-                        add_to_E.append(nt)
-                
-                if did_a_thing:
-                    E -= remove_from_E
-                    E.update(add_to_E)
-                    
-                E.add((A, B))  # Add it back
-            elif (not isinstance(A, (Structure, Term))) and (not isinstance(B, (Structure, Term))):
-                if A != B:
-                    raise UnificationFail(f"Constant Conflict {A}, {B}")
-            else:
-                did_a_thing = False
-            
-            if did_a_thing:
-                tried.clear()
-            else:
-                # Add it back
-                E.add((A, B))
-                tried.add((A, B))
+                    raise UnificationFail("Conflict {}, {}", A, B)
+            elif isinstance(A, Term) or isinstance(B, Term):
+                raise UnificationFail("Conflict {}, {}", A, B)
+            elif A != B:
+                raise UnificationFail("Constant Conflict {}, {}", A, B)
+        
+        resolved = {}
+        path = set()
+        
+        def resolve(term):
+            # Depth-first with explicit stacks, so deep terms don't hit the recursion
+            # limit. todo holds (term, None) to resolve a term, and (term, n) to build
+            # its value from the last n values of its parts.
+            values = []
+            todo = [(term, None)]
+            while todo:
+                t, n = todo.pop()
+                if n is not None:
+                    if isinstance(t, Variable):
+                        resolved[t] = values[-1]
+                        path.discard(t)
+                        continue
+                    parts = values[len(values) - n:]
+                    del values[len(values) - n:]
+                    if isinstance(t, ListTerm):
+                        values.append(ListTerm.view(tuple(parts[:-1]), tail=parts[-1], been_scoped=t.been_scoped))
+                    elif all(a is b for a, b in zip(parts, t.children)):
+                        values.append(t)
+                    else:
+                        values.append(t.with_children(parts))
+                elif isinstance(t, Variable):
+                    if t in resolved:
+                        values.append(resolved[t])
+                    elif t not in bindings:
+                        values.append(t)
+                    elif t in path:
+                        if mode == 'false':
+                            values.append(t)
+                        elif mode == 'error':
+                            raise OccursCheckError(f"Occurs check: {t} = {bindings[t]}")
+                        else:
+                            raise UnificationFail("Occurs check {}, {}", t, bindings[t])
+                    else:
+                        path.add(t)
+                        todo.append((t, 1))
+                        todo.append((bindings[t], None))
+                elif isinstance(t, ListTerm):
+                    if t.ground:
+                        values.append(t)
+                        continue
+                    segments, tail = t.segments()
+                    parts = [*list_elements(segments), tail]
+                    todo.append((t, len(parts)))
+                    todo.extend((part, None) for part in reversed(parts))
+                elif isinstance(t, Compound):
+                    todo.append((t, len(t.children)))
+                    todo.extend((child, None) for child in reversed(t.children))
+                else:
+                    values.append(t)
+            return values[0]
         
-        return E
+        return {(var, resolve(var)) for var in bindings}
+
+
+def list_pairs(A, B):
+    """The pairs of elements to unify when unifying two lists, pairing the
+    shortest list's tail with the rest of the other. Constants are compared
+    right away instead of being added. Takes time linear in the shortest list, and
+    constant time for views of the same items (like the positions of a parse)."""
+    if isinstance(A, ListTerm) and isinstance(B, ListTerm) and A.items is B.items \
+            and A.start == B.start and A.stop == B.stop:
+        return [(A.tail, B.tail)]
+    segments, tail = list_segments(A)
+    other_segments, other_tail = list_segments(B)
+    pairs = []
+    n = 0
+    for a, b in zip(list_elements(segments), list_elements(other_segments)):
+        if isinstance(a, Term) or isinstance(b, Term):
+            pairs.append((a, b))
+        elif a != b:
+            raise UnificationFail("Conflict {}, {}", a, b)
+        n += 1
+    pairs.append((list_from_segments(drop_elements(segments, n), tail, been_scoped=True),
+                  list_from_segments(drop_elements(other_segments, n), other_tail, been_scoped=True)))
+    return pairs
+
+
+def drop_elements(segments, n):
+    "The segments without their first n elements"
+    rest = []
+    for items, start, stop in segments:
+        if n >= stop - start:
+            n -= stop - start
+        else:
+            rest.append((items, start + n, stop))
+            n = 0
+    return rest
+
+
+def to_python(obj):
+    "Converts proper lists to Python lists, for easy usage of answers"
+    if isinstance(obj, BasicTerm) and (obj.name == '.' or is_nil(obj)):
+        segments, tail = list_segments(obj)
+        if is_nil(tail):
+            return [to_python(e) for e in list_elements(segments)]
+    return obj
 
 
 class FailResult(Result):
     def mgu(self, dbg=NoDebugger()):
         dbg.output("Failure to unify was already detected")
-        return None
+        raise UnificationFail("Conflicting variable values")
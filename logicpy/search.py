@@ -0,0 +1,208 @@
+# Search strategies
+# -----------------
+#
+# Queries are proven depth-first by default, which is what the generators of the
+# structures do. An infinite branch then hides every answer after it. These are
+# the other strategies of Universe.query:
+#
+#   iddfs       depth-first with a bound on the depth (the number of predicate
+#               calls open), raised by one each time the search hit it
+#   bfs         keeps a frontier of states (the goals left and their bindings),
+#               expanding those with the fewest resolution steps first
+#   best_first  the same, expanding the state with the lowest heuristic(goals,
+#               result) first
+#
+# bfs and best_first resolve predicate calls themselves, one clause at a time;
+# other goals (builtins, sources) are proven as usual, one answer at a time.
+# States whose goals and bindings are a variant of one seen before are dropped,
+# so cycles in the search space don't matter. All strategies drop duplicate
+# answers. Cuts only make sense depth-first, bfs and best_first refuse them.
+
+import heapq
+from collections import namedtuple
+from itertools import count
+
+from logicpy.structure import Structure, MultiArg, MonoArg
+from logicpy.builtin import True_, and_, or_, par_and, cut, wake
+from logicpy.data import Atom, Compound, Variable, ListTerm, with_scope, occurences
+from logicpy.result import Result, UnificationFail
+from logicpy.predicate import PredicateCall, NoArgument
+from logicpy.cache import variant_key
+from logicpy.limits import query_stats, PAUSE
+
+STRATEGIES = ('dfs', 'iddfs', 'bfs', 'best_first')
+
+
+def search(univ, goal, dbg, strategy, heuristic=None):
+    "Yields the results proving goal (scoped) with strategy, see above"
+    if strategy == 'iddfs':
+        return iterative_deepening(goal, dbg)
+    elif strategy == 'bfs':
+        return FrontierSearch(univ, goal, dbg, lambda state: state.depth).run()
+    elif strategy == 'best_first':
+        if heuristic is None:
+            raise ValueError("best_first needs a heuristic")
+        return FrontierSearch(univ, goal, dbg, lambda state: heuristic(state.goals, state.result)).run()
+    raise ValueError(f"strategy should be one of {', '.join(STRATEGIES)}")
+
+
+def query_variables(goal):
+    V = set()
+    occurences(goal, V)
+    return sorted((v for v in V if v.scope == 0), key=lambda v: v.name)
+
+
+def answer_key(result, variables):
+    "Equal for answers that are the same up to renaming of unbound variables, or None"
+    if result.delayed:
+        return None
+    try:
+        return variant_key([result.walk(v) for v in variables])[0]
+    except TypeError:
+        return None
+
+
+def iterative_deepening(goal, dbg):
+    stats = query_stats.get()
+    variables = query_variables(goal)
+    seen = set()
+    bound = 1
+    while True:
+        stats.depth_bound, stats.bound_hit = bound, False
+        for res in goal.prove(Result(), dbg):
+            if res is PAUSE:
+                yield res
+                continue
+            key = answer_key(res, variables)
+            if key is None or key not in seen:
+                seen.add(key)
+                stats.depth_bound = None  # not while the caller has it
+                yield res
+                stats.depth_bound = bound
+        if not stats.bound_hit:
+            stats.depth_bound = None
+            return  # the whole search space was searched
+        dbg.output(f"Raising the depth bound to {bound + 1}")
+        bound += 1
+
+
+State = namedtuple('State', ('goals', 'result', 'depth'))
+
+
+class FrontierSearch:
+    def __init__(self, univ, goal, dbg, priority):
+        self.univ = univ
+        self.dbg = dbg
+        self.priority = priority
+        self.variables = query_variables(goal)
+        self.start = State((goal,), Result(), 0)
+
+    def run(self):
+        stats = query_stats.get()
+        order = count()
+        frontier = [(0, next(order), self.start)]  # (priority, order, state or iterator of states)
+        seen = set()
+        while frontier:
+            priority, _, item = heapq.heappop(frontier)
+            if isinstance(item, State):
+                key = self.state_key(item)
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                if not item.goals:
+                    yield item.result
+                    continue
+                item = self.children(item)
+            child = next(item, None)
+            if child is not None:
+                heapq.heappush(frontier, (self.priority(child), next(order), child))
+                # Its next sibling, before the children worse than their parent
+                heapq.heappush(frontier, (priority, next(order), item))
+            if stats is not None and stats.should_pause():
+                yield PAUSE
+
+    def state(self, goals, result, depth):
+        "A state, with only the bindings its goals and the query can see"
+        live = set(self.variables)
+        for g in goals:
+            occurences(g, live)
+        return State(goals, result.project(live), depth)
+
+    def children(self, state):
+        "Yields the states after proving the first goal of state one step"
+        goals, result, depth = state
+        goal, rest = goals[0], goals[1:]
+        if isinstance(goal, (and_, par_and)):
+            yield State(goal.args + rest, result, depth)
+        elif isinstance(goal, or_):
+            for branch in goal.args:
+                yield State((branch,) + rest, result, depth)
+        elif goal is True_:
+            yield State(rest, result, depth)
+        elif goal is cut:
+            raise ValueError("Cuts can only be used with the dfs strategy")
+        elif isinstance(goal, NoArgument):
+            yield State((PredicateCall(goal.univ, goal.signature, ()),) + rest, result, depth)
+        elif isinstance(goal, PredicateCall) and self.resolvable(goal):
+            stats = query_stats.get()
+            if stats is not None:
+                stats.step(result)
+            for clause in self.univ.get_pred(goal.signature).clauses:
+                scope = goal.scope_id()
+                arg_res = Result((with_scope(a, scope), b) for a, b in zip(clause.args, goal.args))
+                try:
+                    total = (arg_res | result).mgu()
+                except UnificationFail:
+                    continue
+                yield from self.woken((clause.body.with_scope(scope),) + rest, total, depth + 1)
+        else:
+            for res in goal.prove(result, self.dbg.next()):
+                if res is not PAUSE:
+                    yield from self.woken(rest, res, depth)
+
+    def woken(self, goals, result, depth):
+        "The states after waking the delayed goals that result triggers"
+        for res in wake(result, self.dbg) if result.delayed else (result,):
+            if res is not PAUSE:
+                yield self.state(goals, res, depth)
+
+    def resolvable(self, call):
+        pred = self.univ.get_pred(call.signature)
+        return pred is not None and pred.source is None and not pred.set_oriented
+
+    def state_key(self, state):
+        "Equal for states that are variants of each other, or None"
+        if state.result.delayed:
+            return None
+        walk = state.result.walk
+        try:
+            terms = [resolve(walk(v), walk) for v in self.variables]
+            terms.extend(goal_term(g, walk) for g in state.goals)
+            return variant_key(terms)[0]
+        except TypeError:
+            return None
+
+
+def resolve(term, walk):
+    "term with its bound variables replaced by their values"
+    if isinstance(term, Variable):
+        return walk(term)
+    elif isinstance(term, ListTerm):
+        return term if term.ground else term.map(lambda t: resolve(t, walk))
+    elif isinstance(term, Compound):
+        return term.with_children([resolve(c, walk) for c in term.children])
+    elif isinstance(term, list):
+        return resolve(ListTerm.view(term), walk)
+    return term
+
+
+def goal_term(goal, walk):
+    "A term standing for a goal, to compare goals with variant_key"
+    if isinstance(goal, PredicateCall):
+        return Compound(goal.signature.name, [resolve(a, walk) for a in goal.args])
+    elif isinstance(goal, (MultiArg, MonoArg)):
+        args = goal.args if isinstance(goal, MultiArg) else (goal.arg,)
+        return Compound(f"${type(goal).__name__}:{id(type(goal))}",
+                        [goal_term(a, walk) if isinstance(a, Structure) else resolve(a, walk) for a in args])
+    return Atom(f"${type(goal).__name__}:{id(goal)}")
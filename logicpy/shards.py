@@ -0,0 +1,202 @@
+import itertools
+import threading
+import multiprocessing
+from collections import deque, defaultdict
+from multiprocessing.connection import wait
+
+from logicpy.sources import Source
+from logicpy.codec import dumps, loads
+
+POLL_INTERVAL = 0.05
+
+
+# Sharded facts
+# -------------
+#
+# A fact predicate hash-partitioned on one argument across worker processes,
+# each holding its part of the rows in an indexed FactTable. Calls with the
+# partition argument bound go to one shard, other calls fan out to all of them
+# and merge the answers as they arrive. Rows travel in batches, and shards only
+# send the next batch when asked, so answers are streamed lazily. Open cursors
+# read the table directly, so rows added meanwhile go to a copy of it.
+
+def worker(conn):
+    "Main loop of a shard process"
+    from logicpy.datalog import FactTable
+    table = FactTable('shard')
+    cursors = {}  # query id -> lazy iterator over the rows of a table
+    shared = False  # whether open cursors read table, which adds must then copy first
+
+    def reply(qid, batch_size):
+        cursor = cursors[qid]
+        batch = list(itertools.islice(cursor, batch_size))
+        done = len(batch) < batch_size
+        if done:
+            del cursors[qid]
+        conn.send_bytes(dumps(('rows', qid, batch, done)))
+
+    while True:
+        try:
+            message = loads(conn.recv_bytes())
+        except EOFError:
+            return
+        kind = message[0]
+        if kind == 'add':
+            if shared and cursors:
+                table, shared = table.copy(), False
+            for row in message[1]:
+                table.add(row)
+        elif kind == 'lookup':
+            qid, positions, key, batch_size = message[1:]
+            cursors[qid] = iter(table.lookup(positions, key))
+            shared = True
+            reply(qid, batch_size)
+        elif kind == 'more':
+            reply(message[1], message[2])
+        elif kind == 'close':
+            cursors.pop(message[1], None)
+            conn.send_bytes(dumps(('closed', message[1])))
+        elif kind == 'len':
+            conn.send_bytes(dumps(('len', message[1], len(table), True)))
+        elif kind == 'stop':
+            return
+
+
+class Shard:
+    "The coordinator's end of a shard process"
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.inbox = defaultdict(deque)  # query id -> messages received for it
+        self.closed = set()  # queries closed early, whose answers are dropped
+        self.lock = threading.Lock()
+
+    def send(self, *message):
+        with self.lock:
+            self.conn.send_bytes(dumps(message))
+
+    def poll(self):
+        "Files the messages that have arrived by query id"
+        with self.lock:
+            while self.conn.poll():
+                kind, qid, *rest = loads(self.conn.recv_bytes())
+                if kind == 'closed':
+                    self.closed.discard(qid)
+                    self.inbox.pop(qid, None)
+                elif qid not in self.closed:
+                    self.inbox[qid].append(rest)
+
+    def ready(self, qid):
+        with self.lock:
+            return bool(self.inbox.get(qid))
+
+    def take(self, qid):
+        "The next message for query qid, which must have arrived"
+        with self.lock:
+            inbox = self.inbox[qid]
+            message = inbox.popleft()
+            if not inbox:
+                del self.inbox[qid]
+            return message
+
+    def close(self, qid):
+        "Stops query qid, dropping the answers still on their way"
+        with self.lock:
+            self.closed.add(qid)
+            self.inbox.pop(qid, None)
+            self.conn.send_bytes(dumps(('close', qid)))
+
+    def receive(self, qid):
+        "The next message for query qid, waiting for it"
+        while not self.ready(qid):
+            wait([self.conn], POLL_INTERVAL)
+            self.poll()
+        return self.take(qid)
+
+
+class ShardedSource(Source):
+    """Facts partitioned on argument key across shards worker processes. Add rows
+    with add(), stop the workers with close(). Calls with the key bound ask one
+    shard, others all shards, batch_size rows at a time. Partitions use the hash
+    of the key in this process only, so string hash randomization is no problem."""
+
+    def __init__(self, shards=4, key=0, *, batch_size=256, context='spawn', **kwargs):
+        super().__init__(**kwargs)
+        self.key = key
+        self.batch_size = batch_size
+        context = multiprocessing.get_context(context)
+        self.shards = [Shard(context) for i in range(shards)]
+        self._query_ids = itertools.count()
+
+    def shard_of(self, value):
+        return self.shards[hash(value) % len(self.shards)]
+
+    def add(self, rows):
+        "Adds rows (tuples) of facts, sending them to their shards in batches"
+        parts = defaultdict(list)
+        for row in rows:
+            row = tuple(self.to_value(v) for v in row)
+            shard = self.shard_of(row[self.key])
+            part = parts[shard]
+            part.append(row)
+            if len(part) >= self.batch_size:
+                shard.send('add', part)
+                part.clear()
+        for shard, part in parts.items():
+            if part:
+                shard.send('add', part)
+        self.invalidate()
+
+    def __len__(self):
+        total = 0
+        for shard in self.shards:
+            qid = next(self._query_ids)
+            shard.send('len', qid)
+            total += shard.receive(qid)[0]
+        return total
+
+    def rows(self, bindings):
+        positions = tuple(sorted(bindings))
+        key = tuple(bindings[i] for i in positions)
+        shards = [self.shard_of(bindings[self.key])] if self.key in bindings else self.shards
+
+        open_queries = {}  # connection -> (shard, query id)
+        try:
+            for shard in shards:
+                qid = next(self._query_ids)
+                shard.send('lookup', qid, positions, key, self.batch_size)
+                open_queries[shard.conn] = shard, qid
+            while open_queries:
+                ready = [(shard, qid) for shard, qid in open_queries.values() if shard.ready(qid)]
+                if not ready:
+                    # Another query on the same shard may have received our answers
+                    # meanwhile, so don't wait for long
+                    for conn in wait(list(open_queries), POLL_INTERVAL):
+                        open_queries[conn][0].poll()
+                    continue
+                for shard, qid in ready:
+                    batch, done = shard.take(qid)
+                    if done:
+                        del open_queries[shard.conn]
+                    else:
+                        shard.send('more', qid, self.batch_size)  # prefetch the next batch
+                    yield from batch
+        finally:
+            for shard, qid in open_queries.values():
+                shard.close(qid)
+
+    def close(self):
+        "Stops the worker processes"
+        for shard in self.shards:
+            try:
+                shard.send('stop')
+            except (OSError, ValueError):
+                pass
+            shard.process.join(timeout=5)
+            shard.conn.close()
+
+    def __repr__(self):
+        return f"ShardedSource({len(self.shards)} shards on argument {self.key})"
@@ -0,0 +1,226 @@
+import csv
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from logicpy.data import Term, Atom, Text, is_ground
+from logicpy.result import UnificationFail
+from logicpy.util.lru import LRUCache
+
+
+# External fact sources
+# ---------------------
+#
+# Predicates answered by an external relation instead of clauses: a SQLite table
+# or query, a CSV file or a Python iterable. Attach them with Universe.attach.
+# Arguments bound at call time are pushed down to the source (as WHERE clause
+# for SQLite), and rows are streamed, so memory use doesn't grow with the table.
+
+class Source:
+    """Base class of external relations. Subclasses implement rows(bindings), which
+    yields the rows (tuples) matching bindings, a {position: value} dictionary.
+    Sources that can't filter may ignore bindings, rows are checked again.
+
+    With atoms=True, strings are Atoms inside the universe, so rows match _.alice.
+    With cache > 0, the rows of that many lookups of at most max_rows rows are
+    kept in an LRU cache, until invalidate() is called."""
+
+    def __init__(self, *, atoms=True, cache=0, max_rows=1000):
+        self.atoms = atoms
+        self.cache = LRUCache(cache) if cache else None
+        self.max_rows = max_rows
+
+    def attached(self, univ, signature):
+        "Called by Universe.attach"
+        self.signature = signature
+
+    def rows(self, bindings):
+        raise NotImplementedError
+
+    def invalidate(self):
+        "Drops the cached rows, e.g. after the underlying data changed"
+        if self.cache is not None:
+            self.cache.clear()
+
+    def to_value(self, term):
+        if isinstance(term, Text):
+            return term.value()  # what drivers accept
+        return term.name if isinstance(term, Atom) else term
+
+    def to_term(self, value):
+        return Atom(value, been_scoped=True) if self.atoms and isinstance(value, str) else value
+
+    def lookup(self, bindings):
+        if self.cache is None:
+            yield from self.rows(bindings)
+            return
+
+        key = tuple(sorted(bindings.items()))
+        rows = self.cache.get(key)
+        if rows is not None:
+            yield from rows
+            return
+
+        rows = []
+        for row in self.rows(bindings):
+            if rows is not None:
+                rows.append(row)
+                if len(rows) > self.max_rows:
+                    rows = None
+            yield row
+        if rows is not None:
+            self.cache.put(key, rows)
+
+    def prove(self, call, result, dbg):
+        dbg.prove(call, result)
+        args = [result.walk(a) for a in call.args]
+        bindings = {}
+        for i, arg in enumerate(args):
+            if is_ground(arg):
+                if isinstance(arg, Term) and not isinstance(arg, Atom):
+                    dbg.output(f"{arg} can't be in {self!r}")
+                    return  # compound terms aren't stored
+                bindings[i] = self.to_value(arg)
+        free = [i for i in range(len(args)) if i not in bindings]
+
+        for row in self.lookup(bindings):
+            if len(row) != len(args) or any(row[i] != value for i, value in bindings.items()):
+                continue
+            if not free:
+                yield result
+                continue
+            try:
+                yield (result | {(args[i], self.to_term(row[i])) for i in free}).mgu()
+            except UnificationFail as e:
+                if dbg:
+                    dbg.output(f"Failed to unify row {row}: {e}")
+
+
+class IterableSource(Source):
+    """Rows from calling factory(), or factory(bindings) with pushdown=True,
+    which should return an iterable of tuples."""
+
+    def __init__(self, factory, *, pushdown=False, **kwargs):
+        super().__init__(**kwargs)
+        self.factory = factory
+        self.pushdown = pushdown
+
+    def rows(self, bindings):
+        return iter(self.factory(bindings) if self.pushdown else self.factory())
+
+    def __repr__(self):
+        return f"IterableSource({self.factory.__name__})"
+
+
+class CSVSource(Source):
+    """Rows of a CSV file, read lazily on every call. types holds a function per
+    column to convert its values (e.g. int), header=True skips the first line."""
+
+    def __init__(self, path, *, types=None, header=True, encoding='utf-8', dialect='excel', **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.types = types
+        self.header = header
+        self.encoding = encoding
+        self.dialect = dialect
+
+    def rows(self, bindings):
+        with open(self.path, newline='', encoding=self.encoding) as f:
+            reader = csv.reader(f, self.dialect)
+            if self.header:
+                next(reader, None)
+            for row in reader:
+                if self.types:
+                    row = [t(v) for t, v in zip(self.types, row)]
+                yield tuple(row)
+
+    def __repr__(self):
+        return f"CSVSource({self.path!r})"
+
+
+class ConnectionPool:
+    "Reuses SQLite connections to a database, see Universe.connection_pool"
+
+    def __init__(self, database, max_idle=4):
+        self.database = database
+        self.max_idle = max_idle
+        self.opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.database, check_same_thread=False)
+            self.opened += 1
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteSource(Source):
+    """Rows of a SQLite table, or of a SELECT query. Bound arguments become WHERE
+    constraints on the columns (all columns of the table or query, in order, by
+    default). Rows are fetched arraysize at a time, using a connection from the
+    pool of the universe it is attached to."""
+
+    def __init__(self, database, table=None, *, query=None, columns=None, arraysize=256, **kwargs):
+        if (table is None) == (query is None):
+            raise ValueError("Give either a table or a query")
+        super().__init__(**kwargs)
+        self.database = database
+        self.relation = quote(table) if table is not None else f"({query})"
+        self.columns = columns
+        self.arraysize = arraysize
+        self.pool = None
+
+    def attached(self, univ, signature):
+        super().attached(univ, signature)
+        self.pool = univ.connection_pool(self.database)
+        if self.columns is None:
+            with self.pool.connection() as conn:
+                cursor = conn.execute(f"SELECT * FROM {self.relation} LIMIT 0")
+                self.columns = [d[0] for d in cursor.description]
+        if len(self.columns) != signature.arity:
+            raise ValueError(f"{signature} needs {signature.arity} columns, got {self.columns}")
+
+    def sql(self, bindings):
+        sql = f"SELECT {', '.join(map(quote, self.columns))} FROM {self.relation}"
+        if bindings:
+            sql += " WHERE " + " AND ".join(f"{quote(self.columns[i])} = ?" for i in bindings)
+        return sql
+
+    def rows(self, bindings):
+        if self.pool is None:
+            raise ValueError(f"{self!r} should be attached to a universe first")
+        with self.pool.connection() as conn:
+            cursor = conn.execute(self.sql(bindings), tuple(bindings.values()))
+            try:
+                while True:
+                    rows = cursor.fetchmany(self.arraysize)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                cursor.close()
+
+    def __repr__(self):
+        return f"SQLiteSource({self.database!r}, {self.relation})"
@@ -1,8 +1,12 @@
 
-import random
+import itertools
 
 from logicpy.data import with_scope, occurences, has_occurence
 
+# Scope ids only grow, so variables made during a proof have larger scopes than
+# those that existed when it started (see Result.trim)
+_scope_ids = itertools.count(1)
+
 class Structure:
     # builtin operators, see below
     
@@ -17,12 +21,68 @@ class Structure:
         from logicpy.builtin import or_
         return or_(self, other)
     
+    # [_.a] & u.b only makes a grammar rule body (see logicpy.dcg)
+    
+    def __rand__(self, other):
+        if isinstance(other, (list, set, frozenset)):
+            from logicpy.builtin import and_
+            return GrammarBody(and_(other, self))
+        return NotImplemented
+    
+    def __ror__(self, other):
+        if isinstance(other, (list, set, frozenset)):
+            from logicpy.builtin import or_
+            return GrammarBody(or_(other, self))
+        return NotImplemented
+    
     def with_scope(self, scope):
         return self
     
     @staticmethod
     def scope_id():
-        return random.getrandbits(64)
+        return next(_scope_ids)
+
+
+class GrammarBody:
+    """A grammar rule body starting with terminals or {goal}, like [_.a] & u.b. Only
+    grammar rules and phrase take it: it isn't a goal."""
+    
+    def __init__(self, body):
+        self.body = body
+    
+    def __and__(self, other):
+        from logicpy.builtin import and_
+        return GrammarBody(and_(self.body, unwrap(other)))
+    
+    def __or__(self, other):
+        from logicpy.builtin import or_
+        return GrammarBody(or_(self.body, unwrap(other)))
+    
+    def __rand__(self, other):
+        if isinstance(other, (list, set, frozenset)):
+            from logicpy.builtin import and_
+            return GrammarBody(and_(other, self.body))
+        return NotImplemented
+    
+    def __ror__(self, other):
+        if isinstance(other, (list, set, frozenset)):
+            from logicpy.builtin import or_
+            return GrammarBody(or_(other, self.body))
+        return NotImplemented
+    
+    def prove(self, result, dbg):
+        raise TypeError(f"{self} is a grammar rule body, not a goal (see logicpy.dcg)")
+    
+    def __str__(self):
+        return str(self.body)
+    
+    def __repr__(self):
+        return f"GrammarBody({self.body!r})"
+
+
+def unwrap(body):
+    "The body in a GrammarBody, or body itself"
+    return body.body if isinstance(body, GrammarBody) else body
 
 
 class MultiArg(Structure):
@@ -92,6 +92,38 @@ class Fibonacci(UniverseAndNamespace):
     def test_lots(self):
         for i in range(3, 7):
             self.do_fib(i)
+    
+    def test_trimmed_answers(self):
+        from logicpy.limits import QueryStats
+        stats = QueryStats()
+        answer, = self.u.query(self.n.fib(10, _.X), stats=stats)
+        self.assertEqual(len(answer), 1)  # no bindings of the clause variables of the calls
+        self.assertLess(stats.peak_bindings, 10)
+        # Calls don't look for the variables of the caller's result to trim answers
+        from unittest import mock
+        from logicpy.data import Variable
+        with mock.patch.object(Variable, 'occurences', autospec=True, side_effect=Variable.occurences) as found:
+            self.do_fib(10)
+        self.assertEqual(found.call_count, 0)
+
+
+class Threads(UniverseAndNamespace):
+    setup_universe = Fibonacci.setup_universe
+    
+    def test_shared_universe(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from logicpy.core import FrozenUniverse
+        self.n.answer[42] = True
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda x: self.u.simple_query(self.n.fib(x, _.X)), [6, 7] * 8))
+            self.n.answer[43] = True  # meanwhile
+        self.assertEqual(results, [[{'X': fib(6)}], [{'X': fib(7)}]] * 8)
+        
+        self.u.freeze()
+        self.n.fib(_.X, _.Y)  # only building goals is fine
+        with self.assertRaises(FrozenUniverse):
+            self.n.fib[2, 3] = True
+        self.assertEqual(len(self.u.simple_query(self.n.answer(_.X))), 2)
 
 
 node = _.node
@@ -147,6 +179,858 @@ class BalancedTrees(UniverseAndNamespace):
         out = node(node(empty,7,empty),3,node(empty,4,node(empty,2,empty)))
         res = self.u.simple_query(self.n.add_to(node(empty,3,node(empty,4,node(empty,2,empty))), 7, _.X))[0]['X']
         self.assertTrue(res.really_equal(out))
+    
+    def test_par_and(self):
+        n = self.n
+        n.par_depth[empty, 0] = True
+        n.par_depth[node(_.L, _, _.R), _.MaxDepth] = and_(
+            par_and(n.par_depth(_.L, _.Ld), n.par_depth(_.R, _.Rd)),
+            _.MaxDepth << 1 + max_(_.Ld, _.Rd))
+        tree = node(node(empty, 1, node(empty, 2, empty)), 3, empty)
+        self.assertEqual(self.u.simple_query(n.par_depth(tree, _.D)), [{'D': 3}])
+        # Independent goals give the cross product, dependent ones run in order
+        self.assertEqual(len(self.u.simple_query(par_and(member(_.X, [1, 2]), member(_.Y, [3, 4, 5])))), 6)
+        self.assertEqual(self.u.simple_query(par_and(member(_.X, [1, 2]), _.Y << _.X * 10, member(_.Z, []))), [])
+        self.assertEqual(self.u.simple_query(par_and(member(_.X, [1, 2]), _.Y << _.X * 10)),
+                         [{'X': 1, 'Y': 10}, {'X': 2, 'Y': 20}])
+    
+    def test_par_and_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from logicpy.limits import QueryStats
+        goal = par_and(between(1, 30, _.X), between(1, 20, _.Y), between(1, 10, _.Z))
+        stats = QueryStats()
+        self.assertEqual(len(list(self.u.query(goal, stats=stats))), 6000)
+        # Inferences of the threads count for the query, and for the budget of engines
+        self.assertGreaterEqual(stats.inferences, 60)
+        engine = self.u.engine(goal)
+        answers, pauses = [], 0
+        while not engine.finished:
+            answer = engine.step(10)
+            if answer is not None:
+                answers.append(answer)
+            pauses += engine.state == 'paused'
+        self.assertEqual((len(answers), pauses >= 3), (6000, True))
+        
+        # A thread stops once the other goals have no answers
+        executor, par_and.executor = par_and.executor, ThreadPoolExecutor(1)
+        try:
+            pool = par_and.executor
+            self.assertEqual(self.u.simple_query(par_and(and_(between(1, 2000, _.X), _.X > 2000), repeat & Fail)), [])
+            self.assertEqual(pool.submit(lambda: 1).result(timeout=5), 1)
+        finally:
+            par_and.executor = executor
+            pool.shutdown()
+
+
+class Datalog(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.parent[_.alice, _.bob] = True
+        n.parent[_.alice, _.charlie] = True
+        n.parent[_.bob, _.dave] = True
+        n.sibling[_.X, _.Y] = n.parent(_.P, _.X) & n.parent(_.P, _.Y) & (_.X != _.Y)
+        # Left recursive, would loop forever top-down
+        n.ancestor[_.X, _.Y] = n.ancestor(_.X, _.Z) & n.parent(_.Z, _.Y)
+        n.ancestor[_.X, _.Y] = n.parent(_.X, _.Y)
+        n.person[_.X] = n.parent(_.X, _) | n.parent(_, _.X)
+        n.childless[_.X] = n.person(_.X) & neg(n.parent(_.X, _))
+    
+    def names(self, query, var):
+        return sorted(res[var].name for res in self.u.simple_query(query))
+    
+    def test_recursive(self):
+        self.u.materialize(['ancestor/2'])
+        self.assertEqual(self.names(self.n.ancestor(_.alice, _.X), 'X'), ['bob', 'charlie', 'dave'])
+        self.assertEqual(self.names(self.n.ancestor(_.X, _.dave), 'X'), ['alice', 'bob'])
+    
+    def test_stratified_negation(self):
+        self.u.materialize(['sibling/2', 'childless/1'])
+        self.assertEqual(self.names(self.n.sibling(_.bob, _.X), 'X'), ['charlie'])
+        self.assertEqual(self.names(self.n.childless(_.X), 'X'), ['charlie', 'dave'])
+    
+    def test_invalidated_by_define(self):
+        self.u.materialize(['childless/1'])
+        self.n.parent[_.dave, _.eve] = True
+        self.assertIsNone(self.u.get_pred(('childless', 1)).source)
+        self.assertEqual(self.names(self.n.childless(_.X), 'X'), ['charlie', 'eve'])
+    
+    def test_set_oriented(self):
+        self.n.parent[_.erin, _.frank] = True
+        self.u.set_oriented(['ancestor/2'])
+        self.assertEqual(self.names(self.n.ancestor(_.alice, _.X), 'X'), ['bob', 'charlie', 'dave'])
+        self.assertEqual(self.names(self.n.ancestor(_.X, _.frank), 'X'), ['erin'])
+        self.assertTrue(self.u.ok(self.n.ancestor(_.alice, _.dave)))
+        self.assertFalse(self.u.ok(self.n.ancestor(_.alice, _.frank)))
+        self.assertEqual(set(self.u._magic), {(('ancestor', 2), 'bf'), (('ancestor', 2), 'fb'), (('ancestor', 2), 'bb')})
+        
+        self.n.parent[_.dave, _.erin] = True
+        self.assertEqual(self.u._magic, {})
+        self.assertEqual(self.names(self.n.ancestor(_.alice, _.X), 'X'), ['bob', 'charlie', 'dave', 'erin', 'frank'])
+    
+    def test_set_oriented_work_per_call(self):
+        from unittest import mock
+        from logicpy.datalog import FactTable
+        for i in range(2000):
+            self.n.parent[f"p{i}", f"p{i + 1}"] = True
+        self.u.set_oriented(['ancestor/2'])
+        add = FactTable.add
+        for _call in range(2):
+            with mock.patch.object(FactTable, 'add', autospec=True, side_effect=add) as added:
+                self.assertEqual(len(self.u.simple_query(self.n.ancestor("p1997", _.X))), 3)
+            # The facts of parent are only put in a table once, then each call
+            # derives the few rows relevant to it
+            self.assertLess(added.call_count, 20 if _call else 2020)
+    
+    def test_not_datalog(self):
+        from logicpy.datalog import NotDatalog
+        self.n.wrapped[_.s(_.X)] = self.n.parent(_.X, _)
+        with self.assertRaises(NotDatalog):
+            self.u.materialize(['wrapped/1'])
+
+
+class Views(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.parent[_.alice, _.bob] = True
+        n.parent[_.alice, _.charlie] = True
+        n.sibling[_.X, _.Y] = n.parent(_.P, _.X) & n.parent(_.P, _.Y) & (_.X != _.Y)
+        n.anc[_.X, _.Y] = n.parent(_.X, _.Y)
+        n.anc[_.X, _.Y] = n.anc(_.X, _.Z) & n.parent(_.Z, _.Y)
+        n.only_child[_.X] = n.parent(_.P, _.X) & neg(n.sibling(_.X, _))
+        self.view = u.view(['sibling/2', 'anc/2', 'only_child/1'])
+        self.changes = []
+        self.view.subscribe(lambda sig, inserted, deleted: self.changes.append((str(sig), inserted, deleted)))
+    
+    def test_insert(self):
+        self.n.parent[_.charlie, _.dave] = True
+        self.assertEqual(self.changes, [
+            ('anc/2', {(_.charlie, _.dave), (_.alice, _.dave)}, set()),
+            ('only_child/1', {(_.dave,)}, set())])
+        self.assertEqual(self.u.simple_query(self.n.anc(_.alice, _.dave)), [{}])
+    
+    def test_delete_rederive(self):
+        self.n.parent[_.bob, _.dave] = True
+        self.n.parent[_.charlie, _.dave] = True
+        del self.changes[:]
+        self.assertTrue(self.u.retract(self.n.parent(_.bob, _.X)))
+        self.assertEqual(self.changes, [('anc/2', set(), {(_.bob, _.dave)})])  # alice still reaches dave
+        self.assertTrue(self.u.retract(self.n.parent(_.alice, _.bob)))
+        self.assertFalse(self.u.retract(self.n.parent(_.alice, _.bob)))
+        self.assertEqual(sorted(map(str, self.view['sibling/2'])), [])
+        self.assertEqual(len(self.view['anc/2']), 3)
+        self.assertEqual(self.u.simple_query(self.n.only_child(_.X)), [{'X': _.charlie}, {'X': _.dave}])
+    
+    def test_delete_rederives_only_deleted_rows(self):
+        self.n.parent[_.bob, _.dave] = True
+        self.n.parent[_.charlie, _.dave] = True
+        view = self.u.view(['anc/2'])  # no negation, so maintained incrementally
+        runs = []
+        run = view.program.run
+        view.program.run = lambda rule, tables, *args, **kwargs: runs.append(kwargs.get('frame')) or run(rule, tables, *args, **kwargs)
+        self.u.retract(self.n.parent(_.bob, _.dave))
+        rederive = [frame for frame in runs if frame is not None]
+        self.assertTrue(rederive)
+        self.assertTrue(all(set(frame.values()) <= {_.alice, _.bob, _.dave} for frame in rederive))
+        self.assertIn((_.alice, _.dave), view['anc/2'])
+        self.assertNotIn((_.bob, _.dave), view['anc/2'])
+    
+    def test_running_calls_keep_their_rows(self):
+        self.view.close()
+        self.view = self.u.view(['anc/2'])
+        table = self.view['anc/2']
+        q = self.u.query(self.n.anc(_.alice, _.X))
+        first = next(q)
+        self.n.parent[_.charlie, _.dave] = True
+        self.u.retract(self.n.parent(_.alice, _.bob))
+        self.assertEqual(len(list(q)) + 1, 2)
+        self.assertEqual(len(table), 2)
+        self.assertIsNot(self.view['anc/2'], table)
+        self.assertEqual(sorted(str(res['X']) for res in self.u.simple_query(self.n.anc(_.alice, _.X))), ['charlie', 'dave'])
+
+
+class AnswerCaching(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.parent[_.alice, _.bob] = True
+        n.parent[_.alice, _.charlie] = True
+        n.sibling[_.X, _.Y] = n.parent(_.P, _.X) & n.parent(_.P, _.Y) & (_.X != _.Y)
+        n.unrelated[_.X] = _.X == 1
+        self.cache = u.enable_answer_cache(maxsize=2)
+    
+    def test_hits_and_variants(self):
+        first = self.u.simple_query(self.n.sibling(_.bob, _.X))
+        self.assertEqual(self.u.simple_query(self.n.sibling(_.bob, _.Y)), [{'Y': _.charlie}])
+        self.assertEqual(first, [{'X': _.charlie}])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+    
+    def test_invalidation(self):
+        self.u.simple_query(self.n.sibling(_.bob, _.X))
+        self.u.simple_query(self.n.unrelated(_.X))
+        self.n.parent[_.alice, _.dave] = True
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(len(self.u.simple_query(self.n.sibling(_.bob, _.X))), 2)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+    
+    def test_eviction_and_partial(self):
+        for person in ('alice', 'bob', 'charlie'):
+            self.u.simple_query(self.n.sibling(getattr(_, person), _.X))
+        self.assertEqual((len(self.cache), self.cache.evictions), (2, 1))
+        self.u.ok(self.n.parent(_.X, _.Y))  # stops early, not cached
+        self.assertNotIn(('parent', 2), [key[0] for key in self.cache.entries])
+
+
+class QueryMany(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        self.calls = []
+        
+        @evaluated(vectorized=True)
+        def double(xs):
+            self.calls.append(len(xs))
+            return [2 * x for x in xs]
+        
+        @provable(vectorized=True)
+        def even(xs):
+            self.calls.append(len(xs))
+            return [x % 2 == 0 for x in xs]
+        
+        self.double, self.even = double, even
+        n.pet[1, _.cat] = True
+        n.pet[1, _.dog] = True
+        n.pet[2, _.fish] = True
+    
+    def test_rows(self):
+        res = [(i, r.easy_dict()) for i, r in self.u.query_many(self.n.pet(_.U, _.P), ['U'], [[2, 3, 1]])]
+        self.assertEqual(res, [(0, {'U': 2, 'P': _.fish}), (2, {'U': 1, 'P': _.cat}), (2, {'U': 1, 'P': _.dog})])
+    
+    def test_vectorized(self):
+        goal = self.n.pet(_.U, _.P) & self.even(_.U) & (_.S << self.double(_.U))
+        res = [(i, r.easy_dict()) for i, r in self.u.query_many(goal, [_.U], [range(4)], batch_size=3)]
+        self.assertEqual(res, [(2, {'U': 2, 'P': _.fish, 'S': 4})])
+        self.assertEqual(self.calls, [3, 1])  # once per batch, none for the empty second one
+        # The scalar versions still work
+        self.assertEqual(self.u.simple_query((_.X << self.double(4)) & self.even(_.X)), [{'X': 8}])
+
+
+class Sources(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        import os, sqlite3, tempfile
+        from logicpy.sources import SQLiteSource
+        self.dir = tempfile.TemporaryDirectory()
+        db = os.path.join(self.dir.name, 'cities.db')
+        with sqlite3.connect(db) as conn:
+            conn.execute("CREATE TABLE city (name TEXT, country TEXT, population INTEGER)")
+            conn.executemany("INSERT INTO city VALUES (?, ?, ?)",
+                [('paris', 'france', 2), ('lyon', 'france', 1), ('berlin', 'germany', 3)])
+        conn.close()
+        self.source = u.attach('city/3', SQLiteSource(db, 'city', cache=4))
+        n.french[_.C] = n.city(_.C, _.france, _)
+    
+    def tearDown(self):
+        for pool in self.u._pools.values():
+            pool.close()
+        self.dir.cleanup()
+    
+    def test_sqlite(self):
+        self.assertEqual(self.u.simple_query(self.n.french(_.X)), [{'X': _.paris}, {'X': _.lyon}])
+        self.assertEqual(self.u.simple_query(self.n.city(_.berlin, _.C, _.P)), [{'C': _.germany, 'P': 3}])
+        self.assertFalse(self.u.ok(self.n.city(_.X, _.france, 3)))
+        self.assertEqual(self.source.sql({1: 'france'}),
+            'SELECT "name", "country", "population" FROM "city" WHERE "country" = ?')
+        self.assertEqual(self.u._pools[self.source.database].opened, 1)
+    
+    def test_text_arguments(self):
+        from logicpy.data import Text
+        self.assertEqual(self.u.simple_query(self.n.city(Text("in paris", 3), _.C, _.P)), [{'C': _.france, 'P': 2}])
+    
+    def test_cache_and_iterables(self):
+        from logicpy.sources import IterableSource
+        self.u.simple_query(self.n.french(_.X))
+        self.u.simple_query(self.n.french(_.Y))
+        self.assertEqual(self.source.cache.hits, 1)
+        self.u.attach('square/2', IterableSource(lambda: ((i, i * i) for i in range(10))))
+        self.assertEqual(self.u.simple_query(self.n.square(_.X, 49)), [{'X': 7}])
+
+
+class Limits(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.edge[1, 2] = True
+        n.path[_.X, _.Y] = n.path(_.X, _.Z) & n.edge(_.Z, _.Y)  # left recursive
+        n.path[_.X, _.Y] = n.edge(_.X, _.Y)
+    
+    def test_limits(self):
+        from logicpy.limits import ResourceExceeded
+        with self.assertRaises(ResourceExceeded) as cm:
+            self.u.simple_query(self.n.path(_.A, _.B), max_depth=50)
+        self.assertEqual((cm.exception.resource, cm.exception.stats['peak_depth']), ('depth', 51))
+        with self.assertRaises(ResourceExceeded) as cm:
+            self.u.simple_query(self.n.path(_.A, _.B), max_inferences=20)
+        self.assertEqual(cm.exception.stats['inferences'], 21)
+        with self.assertRaises(ResourceExceeded) as cm:
+            self.u.simple_query(self.n.path(_.A, _.B))  # out of stack
+        self.assertEqual(cm.exception.resource, 'depth')
+        # Still usable afterwards
+        self.assertEqual(self.u.simple_query(self.n.edge(_.A, _.B), max_inferences=1), [{'A': 1, 'B': 2}])
+
+
+class MemoryReport(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.parent[_.alice, _.bob] = True
+        n.parent[_.bob, _.carl] = True
+        n.anc[_.X, _.Y] = n.parent(_.X, _.Y)
+        n.anc[_.X, _.Y] = n.parent(_.X, _.Z) & n.anc(_.Z, _.Y)
+    
+    def test_report(self):
+        from logicpy.limits import QueryStats
+        self.u.materialize(['anc/2'])
+        stats = QueryStats()
+        self.assertEqual(len(self.u.simple_query(self.n.anc(_.alice, _.Y), stats=stats)), 2)
+        self.assertEqual((stats.inferences, stats.peak_depth), (1, 1))  # answered by the table
+        
+        report = self.u.memory_report()
+        self.assertEqual(report[('parent', 2)]['clauses'], 2)
+        self.assertEqual(report[('parent', 2)]['nodes'], 6)
+        self.assertEqual(report[('anc', 2)]['table']['rows'], 3)
+        self.assertEqual(report[('anc', 2)]['table']['indexes'], {(0,): 2})
+        self.assertGreater(report.total, report[('anc', 2)]['bytes'])
+        self.assertIn('anc/2', str(report))
+        self.assertEqual(repr(self.u.get_pred(('parent', 2))), "parent(alice, bob) :- True;  parent(bob, carl) :- True")
+
+
+class TermHeap(unittest.TestCase):
+    def test_unify_and_undo(self):
+        from logicpy.heap import Heap
+        from logicpy.data import Variable
+        heap = Heap()
+        variables = {}
+        X, Y, Z = Variable('X'), Variable('Y'), Variable('Z')
+        a = heap.store(_.f(X, _.g(Y, 1.5), cons(1, 2, Z)), variables)
+        
+        mark = heap.mark()
+        b = heap.store(_.f(_.a, _.g("b", Y), [1, 2, 3]), variables)
+        self.assertFalse(heap.unify(a, b))  # Y can't be both 1.5 and "b"
+        heap.undo(mark)
+        self.assertEqual(len(heap), mark[0])
+        names = {addr: var.name for var, addr in variables.items()}
+        self.assertEqual(str(heap.load(a, names)), "f(X, g(Y, 1.5), [1, 2 | Z])")
+        
+        c = heap.store(_.f(_.a, _.g(Y, 1.5), [1, 2, 3]), variables)
+        self.assertTrue(heap.unify(a, c))
+        self.assertEqual(str(heap.load(a, names)), "f(a, g(Y, 1.5), [1, 2, 3])")
+        self.assertEqual(str(heap.bindings(variables)['Z']), "[3]")
+        self.assertFalse(heap.unify(heap.store(Y, variables), heap.store(_.f(Y), variables)))
+        
+        renamed = heap.copy(a)  # with a fresh Y
+        self.assertTrue(heap.unify(renamed, heap.store(_.f(_.a, _.g(2, 1.5), [1, 2, 3]))))
+        self.assertEqual(str(heap.load(a, names)), "f(a, g(Y, 1.5), [1, 2, 3])")
+    
+    def test_constants_unify_like_queries(self):
+        from logicpy.heap import Heap
+        heap = Heap()
+        u = Universe()
+        for x, y in [(1, 1.0), (True, 1), (1, 2), ("a", "a"), ("a", 1), (2 ** 70, 2.0 ** 70)]:
+            with self.subTest(x=x, y=y):
+                self.assertEqual(heap.unify(heap.store(_.f(x)), heap.store(_.f(y))), u.ok(_.f(x) == _.f(y)))
+
+
+class Engines(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.fib[0, 1] = True
+        n.fib[1, 1] = True
+        n.fib[_.N, _.F] = and_(_.N > 1, _.N1 << _.N - 1, _.N2 << _.N - 2,
+                               n.fib(_.N1, _.F1), n.fib(_.N2, _.F2), _.F << _.F1 + _.F2)
+        n.small[_.X] = member(_.X, [1, 2, 3]) & neg(n.fib(_.X, 100))
+    
+    def test_scheduler(self):
+        from logicpy.engines import Scheduler
+        scheduler = Scheduler(slice=50)
+        heavy = scheduler.add(self.u.engine(self.n.fib(15, _.F)))
+        light = scheduler.add(self.u.engine(self.n.small(_.X)))
+        found = [(engine, answer.easy_dict()) for engine, answer in scheduler.run()]
+        # The light query is done long before the heavy one, which was paused many times
+        self.assertEqual(found, [(light, {'X': 1}), (light, {'X': 2}), (light, {'X': 3}), (heavy, {'F': 987})])
+        self.assertEqual((heavy.state, heavy.answers, light.answers), ('done', 1, 3))
+    
+    def test_pause_and_cancel(self):
+        from logicpy.limits import ResourceExceeded
+        engine = self.u.engine(self.n.fib(15, _.F))
+        self.assertIsNone(engine.step(100))
+        self.assertEqual(engine.state, 'paused')
+        self.assertGreater(engine.depth, 0)
+        engine.cancel()
+        self.assertEqual((engine.state, engine.depth), ('cancelled', 0))
+        
+        engine = self.u.engine(self.n.fib(10, _.F), max_inferences=100)
+        with self.assertRaises(ResourceExceeded):
+            while not engine.finished:
+                engine.step(10)
+        self.assertEqual(engine.state, 'failed')
+    
+    def test_pause_while_waking(self):
+        self.n.five[_.X] = _.X == 5
+        goals = [freeze(_.X, self.n.fib(_.X, _.F)) & (_.X == 5) & (_.Y == 1),  # woken in a conjunction
+                 freeze(_.X, self.n.fib(_.X, _.F)) & self.n.five(_.X)]  # woken by a clause's answer
+        for goal, answers in zip(goals, [[{'X': 5, 'F': 8, 'Y': 1}], [{'X': 5, 'F': 8}]]):
+            for budget in (1, 2):
+                with self.subTest(goal=str(goal), budget=budget):
+                    engine = self.u.engine(goal)
+                    found = []
+                    while not engine.finished:
+                        answer = engine.step(budget)
+                        if answer is not None:
+                            found.append(answer.easy_dict())
+                    self.assertEqual(found, answers)
+
+
+class SearchStrategies(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.edge[_.a, _.b] = True
+        n.edge[_.b, _.c] = True
+        n.edge[_.c, _.a] = True
+        n.edge[_.c, _.d] = True
+        n.path[_.X, _.Y] = n.path(_.X, _.Z) & n.edge(_.Z, _.Y)  # left recursive
+        n.path[_.X, _.Y] = n.edge(_.X, _.Y)
+        n.sum[_.zero, _.X, _.X] = True
+        n.sum[_.s(_.X), _.Y, _.Z] = n.sum(_.X, _.s(_.Y), _.Z)
+    
+    def test_left_recursion(self):
+        from logicpy.limits import ResourceExceeded
+        with self.assertRaises(ResourceExceeded):
+            self.u.simple_query(self.n.path(_.a, _.X), max_inferences=5000)
+        for strategy in ('iddfs', 'bfs'):
+            with self.subTest(strategy=strategy):
+                found = self.u.simple_query(self.n.path(_.a, _.X), strategy=strategy, limit=4)
+                self.assertEqual(found, [{'X': _.b}, {'X': _.c}, {'X': _.a}, {'X': _.d}])
+    
+    def test_complete(self):
+        two = _.s(_.s(_.zero))
+        expected = [{'X': _.zero, 'Y': two}, {'X': _.s(_.zero), 'Y': _.s(_.zero)}, {'X': two, 'Y': _.zero}]
+        for strategy in ('iddfs', 'bfs'):
+            with self.subTest(strategy=strategy):
+                found = self.u.simple_query(self.n.sum(_.X, _.Y, two), strategy=strategy, limit=3)
+                self.assertEqual(found, expected)
+    
+    def test_best_first(self):
+        from logicpy.data import Variable
+        distance = {'a': 3, 'b': 1, 'c': 2}
+        def heuristic(goals, result):
+            return distance.get(getattr(result.walk(Variable('X', 0)), 'name', None), 0)
+        found = self.u.simple_query(member(_.X, [_.a, _.b, _.c]), strategy='best_first', heuristic=heuristic)
+        self.assertEqual(found, [{'X': _.b}, {'X': _.c}, {'X': _.a}])
+        with self.assertRaises(ValueError):
+            self.u.simple_query(cut, strategy='bfs')
+        with self.assertRaises(ValueError):
+            self.u.simple_query(self.n.path(_.a, _.X), strategy='best_first')
+
+
+class Iteration(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.double[_.X, _.Y] = _.Y << _.X * 2
+        n.loop[_.N] = between(1, _.N, _.X) & n.double(_.X, _.Y) & Fail
+        n.loop[_] = True
+        n.first_over[_.Limit, _.X] = between(1, _.inf, _.X) & n.double(_.X, _.Y) & (_.Y > _.Limit) & cut
+    
+    def test_between(self):
+        self.assertEqual(self.u.simple_query(between(1, 3, _.X)), [{'X': 1}, {'X': 2}, {'X': 3}])
+        self.assertEqual(self.u.simple_query(between(1, _.infinite, _.X), limit=2), [{'X': 1}, {'X': 2}])
+        from logicpy.result import Uninstantiated
+        with self.assertRaises(Uninstantiated):
+            self.u.ok(between(1, _.High, _.X))
+        self.assertEqual(self.u.simple_query(self.n.first_over(7, _.X)), [{'X': 4}])
+        self.assertEqual(self.u.simple_query(between(1, 3, 3)), [{}])
+        self.assertEqual(self.u.simple_query(between(1, 3, 4) | between(3, 1, _.X)), [])
+    
+    def test_succ_and_plus(self):
+        self.assertEqual(self.u.simple_query(succ(_.X, 4) & succ(4, _.Y)), [{'X': 3, 'Y': 5}])
+        self.assertEqual(self.u.simple_query(succ(_.X, 0) | succ(_.X, _.Y)), [])
+        self.assertEqual(self.u.simple_query(plus(1, _.Y, 5) & plus(_.Y, 2, _.Z)), [{'Y': 4, 'Z': 6}])
+    
+    def test_forall_and_repeat(self):
+        self.assertEqual(self.u.simple_query(forall(member(_.X, [1, 2, 3]), _.X > 0)), [{}])
+        self.assertEqual(self.u.simple_query(forall(member(_.X, [1, 2, 3]), _.X > 1)), [])
+        ticks = iter(range(10))
+        self.n.poll[_.T] = repeat & (_.T << evaluated(lambda: next(ticks))()) & (_.T >= 3) & cut
+        self.assertEqual(self.u.simple_query(self.n.poll(_.T)), [{'T': 3}])
+    
+    def test_flat_memory(self):
+        from logicpy.limits import QueryStats, ResourceExceeded
+        peaks = []
+        for n in (10, 1000):
+            stats = QueryStats()
+            self.assertEqual(self.u.simple_query(self.n.loop(n), stats=stats), [{}])
+            self.assertGreater(stats.inferences, 2 * n)
+            peaks.append((stats.peak_depth, stats.peak_bindings))
+        self.assertEqual(peaks[0], peaks[1])
+        with self.assertRaises(ResourceExceeded):
+            self.u.simple_query(repeat & Fail, max_inferences=100)
+
+
+class TextBuiltins(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.server_error[_.Line, _.Path] = split_string(_.Line, b" ", b"", [_, _.Path, _.Code]) & \
+            sub_atom(_.Code, 0, 1, _, b"5")
+    
+    def test_text(self):
+        from logicpy.data import Text
+        data = b"xx hello"
+        text = Text(memoryview(data), 3)
+        self.assertEqual((text, len(text), text[1:3]), (b"hello", 5, b"el"))
+        self.assertIs(text[1:3].data.obj, data)  # a view, not a copy
+        self.assertEqual(hash(Text("ab", 1)), hash("b"))
+        self.assertEqual((hash(text), hash(text[1:3]), hash(Text(bytearray(data), 3))), (hash(b"hello"), hash(b"el"), hash(b"hello")))
+        self.assertNotEqual(Text("ab"), b"ab")
+    
+    def test_sub_atom(self):
+        q = self.u.simple_query
+        self.assertEqual(q(sub_atom(_.hello, _.B, 2, 1, _.S)), [{'B': 2, 'S': _.ll}])
+        self.assertEqual(q(sub_atom("abcabc", _.B, _.L, _.A, "bc")), [{'B': 1, 'L': 2, 'A': 3}, {'B': 4, 'L': 2, 'A': 0}])
+        self.assertEqual(q(sub_atom("ab", _.B, _.L, 0, _.S)), [{'B': 0, 'L': 2, 'S': "ab"}, {'B': 1, 'L': 1, 'S': "b"},
+                                                               {'B': 2, 'L': 0, 'S': ""}])
+        self.assertEqual(q(atom_length(b"bytes", _.N)), [{'N': 5}])
+    
+    def test_concat_and_codes(self):
+        from logicpy.data import Atom
+        q = self.u.simple_query
+        self.assertEqual(q(atom_concat(_.X, _.Y, _.ab)), [{'X': Atom(''), 'Y': _.ab}, {'X': _.a, 'Y': _.b},
+                                                          {'X': _.ab, 'Y': Atom('')}])
+        self.assertEqual(q(atom_concat(_.X, "bc", "abc") & atom_concat(_.X, "d", _.Z)), [{'X': "a", 'Z': "ad"}])
+        self.assertEqual(q(atom_codes(_.hi, _.C)), [{'C': [104, 105]}])
+        self.assertEqual(q(atom_codes(_.X, [104, 105])), [{'X': _.hi}])
+    
+    def test_split_string(self):
+        q = self.u.simple_query
+        self.assertEqual(q(split_string("a, b,,c ", ",", " ", _.P)), [{'P': ["a", "b", "", "c"]}])
+        self.assertEqual(q(split_string("/home//jan///nice/path", "/", "", _.P)),
+                         [{'P': ["", "home", "", "jan", "", "", "nice", "path"]}])
+        log = memoryview(b"GET /a 200\nPOST /b 503\nGET /c 500\n")
+        lines = q(split_string(log, b"\n", b"", _.L))[0]['L']
+        found = [q(self.n.server_error(line, _.Path)) for line in lines]
+        self.assertEqual(found, [[], [{'Path': b"/b"}], [{'Path': b"/c"}], []])
+
+
+class Grammars(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.greeting >> ([_.hello] & n.name(_.Name))
+        n.name(_.world) >> [_.world]
+        n.name(_.X) >> and_([_.dear], {n.person(_.X)}, [_.X])
+        n.person[_.alice] = True
+        n.person[_.bob] = True
+        
+        n.number(_.N) >> (n.digit(_.D) & n.digits(_.D, _.N))
+        n.digits(_.Acc, _.N) >> ((n.digit(_.D) & {_.Acc1 << _.Acc * 10 + _.D} & n.digits(_.Acc1, _.N)) | {_.N == _.Acc})
+        for d in range(10):
+            n.digit(d) >> [str(d)]
+        n.anbn >> or_([], [_.a] & n.anbn & [_.b])
+    
+    def test_parse(self):
+        q = self.u.simple_query
+        self.assertEqual(q(phrase(self.n.greeting, [_.hello, _.dear, _.bob])), [{}])
+        self.assertEqual(q(phrase(self.n.greeting, [_.hello, _.dear, _.carol])), [])
+        self.assertEqual(q(phrase(self.n.number(_.N), "2024")), [{'N': 2024}])
+        self.assertEqual(q(phrase(self.n.digit(_.D) & self.n.digit(_.E), "12x", _.Rest)),
+                         [{'D': 1, 'E': 2, 'Rest': ['x']}])
+        self.assertEqual(q(phrase(neg([_.b]) & self.n.anbn, [_.a, _.b])), [{}])
+    
+    def test_generate(self):
+        q = self.u.simple_query
+        self.assertEqual(q(phrase(self.n.greeting, _.L)), [{'L': [_.hello, _.world]}, {'L': [_.hello, _.dear, _.alice]},
+                                                           {'L': [_.hello, _.dear, _.bob]}])
+        self.assertEqual(q(phrase(self.n.anbn, _.L), limit=3), [{'L': []}, {'L': [_.a, _.b]}, {'L': [_.a, _.a, _.b, _.b]}])
+    
+    def test_positions(self):
+        from logicpy.predicate import Signature
+        # Rules are clauses with two more arguments
+        clause, = self.u.get_pred(Signature('greeting', 2)).clauses
+        self.assertEqual(str(clause.body), "(terminals([hello], $S0, $S1) & name(Name, $S1, $S))")
+        # The input is a view of the tokens, so only the parsed part costs time
+        tokens = [_.a] * 100000 + [_.b] * 100000
+        found = self.u.simple_query(phrase([_.a, _.a], tokens, _.Rest))
+        self.assertEqual(len(found[0]['Rest']), 199998)
+    
+    def test_body_without_parentheses(self):
+        from logicpy.structure import GrammarBody
+        for mistake in (lambda: self.n.polite >> [_.please] & self.n.name(_.N),
+                        lambda: self.n.polite >> [_.please] | self.n.name(_.N)):
+            with self.assertRaises(TypeError):
+                mistake()
+            self.assertEqual(self.u.get_pred(('polite', 2)).clauses, ())  # not half defined
+        # Outside grammar rules, terminals and terms don't combine with goals
+        for operand in (1, _.X, [1]):
+            with self.assertRaises(TypeError):
+                self.n.plain[_.X] = operand & self.n.name(_.N)
+        self.assertIsInstance({self.n.name(_.N)} | self.n.name(_.N), GrammarBody)
+    
+    def test_long_input(self):
+        # Right recursive, each token is a nested call
+        self.n.count(_.N0, _.N) >> and_([_.d], {_.N1 << _.N0 + 1}, self.n.count(_.N1, _.N))
+        self.n.count(_.N, _.N) >> []
+        self.assertEqual(self.u.simple_query(phrase(self.n.count(0, _.N), [_.d] * 10000)), [{'N': 10000}])
+        self.assertFalse(self.u.ok(phrase(self.n.count(0, _.N), [_.d] * 100 + [_.e])))
+
+
+class Codec(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        pass
+    
+    def test_round_trip(self):
+        from logicpy.codec import dumps, loads, dumps_result, loads_result, DecodeError
+        from logicpy.data import Compound, with_scope
+        term = _.f(_.a, [1, -2, 2**70, 2.5, "x", b"y", None, True], cons(_.H, _.T), (_.b, "b"))
+        for t in (term, with_scope(term, 7)):
+            self.assertEqual(repr(loads(dumps(t))), repr(t))
+        self.assertTrue(loads(dumps(with_scope(term, 7))).been_scoped)
+        
+        shared = _.g(*range(20))
+        data = dumps([shared] * 10)
+        self.assertLess(len(data), 2 * len(dumps(shared)))
+        first, second, *rest = loads(memoryview(data))
+        self.assertIs(first, second)
+        
+        deep = 0
+        for i in range(100000):
+            deep = Compound('s', (deep,))
+        self.assertEqual(loads(dumps(deep)).name, 's')  # no recursion
+        
+        answer, = self.u.query((_.X == _.f(_.Y)) & (_.Y == [1, 2]))
+        self.assertEqual(loads_result(dumps_result(answer)).easy_dict(), answer.easy_dict())
+        with self.assertRaises(DecodeError):
+            loads(dumps(term)[:-1])
+
+
+class Nondeterministic(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        self.closed = 0
+        
+        @nondeterministic
+        def in_range(low, high, x):
+            try:
+                if x is unbound:
+                    for i in range(low, high + 1):
+                        yield low, high, i
+                elif low <= x <= high:
+                    yield low, high, x
+            finally:
+                self.closed += 1
+        
+        @nondeterministic(batched=True)
+        def number_name(number, name):
+            yield [(1, _.one), (2, _.two)]
+            yield [(3, _.three)]
+        
+        self.in_range, self.number_name = in_range, number_name
+        n.first[_.X] = in_range(1, 10**9, _.X) & cut
+    
+    def test_modes(self):
+        self.assertEqual(self.u.simple_query(self.in_range(1, 3, _.X)), [{'X': 1}, {'X': 2}, {'X': 3}])
+        self.assertTrue(self.u.ok(self.in_range(1, 3, 2)))
+        self.assertFalse(self.u.ok(self.in_range(1, 3, 4)))
+        self.assertEqual(self.u.simple_query(self.number_name(_.N, _.two)), [{'N': 2}])
+        self.assertEqual(len(self.u.simple_query(self.number_name(_.N, _.Name))), 3)
+    
+    def test_cleanup(self):
+        self.assertEqual(self.u.simple_query(self.n.first(_.X)), [{'X': 1}])
+        self.assertEqual(self.closed, 1)
+
+
+class Shards(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        from logicpy.shards import ShardedSource
+        self.source = u.attach('edge/2', ShardedSource(shards=3, batch_size=4))
+        self.source.add((i, i + 1) for i in range(20))
+        self.source.add([(_.a, _.b), (_.b, _.c)])
+        n.path[_.X, _.Y] = n.edge(_.X, _.Y)
+        n.path[_.X, _.Y] = n.edge(_.X, _.Z) & n.path(_.Z, _.Y)
+    
+    def tearDown(self):
+        self.source.close()
+    
+    def test_routing_and_fan_out(self):
+        self.assertEqual(len(self.source), 22)
+        self.assertEqual(self.u.simple_query(self.n.edge(7, _.Y)), [{'Y': 8}])
+        answers = self.u.simple_query(self.n.edge(_.X, _.Y))
+        self.assertEqual(sorted(r['X'] for r in answers if isinstance(r['X'], int)), list(range(20)))
+        self.assertEqual(self.u.simple_query(self.n.edge(_.X, 10)), [{'X': 9}])
+        self.assertEqual(self.u.simple_query(self.n.path(_.a, _.Y)), [{'Y': _.b}, {'Y': _.c}])
+        self.assertEqual(len(self.u.simple_query(self.n.path(0, _.Y))), 20)
+        self.assertTrue(self.u.ok(self.n.edge(_.X, _.Y)))  # stops early
+        self.assertEqual(self.u.simple_query(self.n.edge(_.X, 3)), [{'X': 2}])
+    
+    def test_add_while_reading(self):
+        answers = self.u.query(self.n.edge(_.X, _.Y))
+        first = [next(answers)]
+        self.source.add((i, -i) for i in range(100))
+        # Open cursors keep reading the rows they started with
+        self.assertEqual(len(first + list(answers)), 22)
+        self.assertEqual(len(self.u.simple_query(self.n.edge(_.X, _.Y))), 122)
+
+
+class Coroutining(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.p[1] = True
+        n.p[2] = True
+        n.all_different[[]] = True
+        n.all_different[cons(_.H, _.T)] = n.different_from(_.H, _.T) & n.all_different(_.T)
+        n.different_from[_, []] = True
+        n.different_from[_.X, cons(_.H, _.T)] = dif(_.X, _.H) & n.different_from(_.X, _.T)
+    
+    def test_freeze_and_when(self):
+        self.assertEqual(self.u.simple_query(freeze(_.X, _.X > 2) & member(_.X, [1, 2, 3, 4])), [{'X': 3}, {'X': 4}])
+        self.assertEqual(self.u.simple_query(freeze(_.X, _.X > 1) & self.n.p(_.X)), [{'X': 2}])  # woken by head unification
+        self.assertEqual(self.u.simple_query(when(_.ground(_.f(_.A, _.B)), _.C << _.A + _.B) & (_.A == 1) & (_.B == 2)),
+                         [{'A': 1, 'B': 2, 'C': 3}])
+        self.assertEqual(self.u.simple_query(when(_.any(_.nonvar(_.A), _.nonvar(_.B)), _.C == 1) & (_.B == 2)),
+                         [{'B': 2, 'C': 1}])
+        answer, = self.u.query(freeze(_.X, _.Y == 1))  # stays delayed
+        self.assertEqual((len(answer), len(answer.delayed)), (0, 1))
+    
+    def test_aliasing_doesnt_wake(self):
+        for alias in (_.X == _.Y, _.Y == _.X):
+            answer, = self.u.query(freeze(_.X, _.Z == 1) & alias)
+            self.assertEqual((answer.easy_dict().get('Z'), len(answer.delayed)), (None, 1))
+        self.assertEqual(self.u.simple_query(freeze(_.X, _.Z == 1) & (_.X == _.Y) & (_.Y == 2)), [{'X': 2, 'Y': 2, 'Z': 1}])
+        self.assertEqual(self.u.simple_query(freeze(_.X, _.Z == 1) & (_.Y == _.X) & (_.X == 2)), [{'X': 2, 'Y': 2, 'Z': 1}])
+        self.assertFalse(self.u.ok(freeze(_.X, _.X > 1) & (_.X == _.Y) & (_.Y == 1)))
+        answer, = self.u.query(when(_.nonvar(_.X), _.Z == 1) & (_.Y == _.X))
+        self.assertEqual((answer.easy_dict().get('Z'), len(answer.delayed)), (None, 1))
+        self.assertEqual(self.u.simple_query(when(_.nonvar(_.X), _.Z == 1) & (_.X == _.Y) & (_.Y == 2)),
+                         [{'X': 2, 'Y': 2, 'Z': 1}])
+    
+    def test_woken_by_a_call(self):
+        self.n.five[_.X] = _.X == 5
+        self.assertEqual(self.u.simple_query(freeze(_.X, _.F << _.X + 1) & self.n.five(_.X)), [{'X': 5, 'F': 6}])
+        self.assertEqual(self.u.simple_query(freeze(_.X, _.F << _.X + 1) & phrase({self.n.five(_.X)}, [])),
+                         [{'X': 5, 'F': 6}])
+    
+    def test_dif(self):
+        self.assertEqual(self.u.simple_query(dif(_.X, _.a) & member(_.X, [_.a, _.b])), [{'X': _.b}])
+        self.assertEqual(self.u.simple_query(dif(_.f(_.X, _.Y), _.f(1, 2)) & (_.X == 1) & member(_.Y, [1, 2, 3])),
+                         [{'X': 1, 'Y': 1}, {'X': 1, 'Y': 3}])
+        self.assertFalse(self.u.ok(dif(_.X, _.Y) & (_.X == _.Y)))
+        self.assertTrue(self.u.ok(dif(_.X, _.Y)))
+        res = self.u.simple_query(self.n.all_different([_.A, _.B, _.C]) & member(_.A, [1, 2]) & member(_.B, [1, 2])
+                                  & member(_.C, [1, 2, 3]))
+        self.assertEqual(res, [{'A': 1, 'B': 2, 'C': 3}, {'A': 2, 'B': 1, 'C': 3}])
+
+
+class Optimize(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.double[_.X, _.Y] = _.Y << _.X * 2
+        n.inc[_.X, _.Y] = _.Y << _.X + 1
+        n.calc[_.Y] = n.double(3, _.A) & n.inc(_.A, _.Y)
+        n.primary[_.red] = True
+        n.primary[_.blue] = True
+        n.pair[_.X, [_.X, _.Y]] = n.primary(_.Y)
+        n.pairs[_.Z] = n.pair(_.red, _.Z) & (_.Z != [_.red, _.red])
+        n.count[0] = True
+        n.dec[_.X, _.Y] = _.Y << _.X - 1
+        n.count[_.N] = (_.N > 0) & n.dec(_.N, _.M) & n.count(_.M)
+    
+    def test_same_answers(self):
+        goals = [self.n.calc(_.Y), self.n.pairs(_.Z), self.n.count(3)]
+        before = [self.u.simple_query(g) for g in goals]
+        self.assertEqual(self.u.optimize(), {('calc', 1), ('pair', 2), ('pairs', 1), ('count', 1)})
+        self.assertEqual([self.u.simple_query(g) for g in goals], before)
+        self.assertIn("calc(Y) :- (Y == 7).", self.u.listing())
+        self.assertIn("count(N) :- ((N > 0) & (M << (N - 1)) & count(M)).", self.u.listing(['count/1']))
+    
+    def test_redefinition(self):
+        self.u.optimize()
+        self.n.inc[_.X, _.Y] = _.Y << _.X + 100
+        self.assertEqual(self.u.listing(['calc/1']), "calc(Y) :- (double(3, A) & inc(A, Y)).")
+        self.assertEqual(self.u.simple_query(self.n.calc(_.Y)), [{'Y': 7}, {'Y': 106}])
+    
+    def test_fail_and_cut(self):
+        from logicpy.optimize import simplify
+        self.assertIs(simplify((_.X == _.c) & Fail), Fail)
+        self.assertIs(simplify((_.X == _.c) & (_.Y << _.X + 1) & (_.Y > 2) & Fail & self.n.calc(_.X)), Fail)
+        self.assertEqual(str(simplify(self.n.calc(_.X) & (_.X == _.c) & Fail)), "(calc(X) & Fail)")
+        self.n.first[_.X] = self.n.primary(_.X) & cut
+        self.assertEqual(self.u.listing(['first/1']), "first(X) :- (primary(X) & cut).")
+
+
+class OccursCheck(unittest.TestCase):
+    def test_modes(self):
+        from logicpy.result import OccursCheckError
+        u, n = Universe().and_namespace()
+        n.cyclic[_.X] = _.X == _.f(_.X)
+        self.assertFalse(u.ok(n.cyclic(_.A)))
+        self.assertEqual(str(u.simple_query(_.X == _.f(_.X), occurs_check='false')[0]['X']), "f(X)")
+        with self.assertRaises(OccursCheckError):
+            u.ok(n.cyclic(_.A), occurs_check='error')
+        with self.assertRaises(ValueError):
+            u.ok(n.cyclic(_.A), occurs_check='maybe')
+    
+    def test_long_chains(self):
+        from logicpy.data import Variable, Compound
+        from logicpy.result import Result, UnificationFail
+        # Resolving X0 = X1, ..., X20000 = f(...) doesn't recurse per variable
+        V = [Variable('V', i + 1) for i in range(20001)]
+        chain = [(V[i], V[i + 1]) for i in reversed(range(20000))]  # solved last to first
+        solved = dict(Result.solve([(V[-1], Compound('f', (1,)))] + chain))
+        self.assertEqual((len(solved), str(solved[V[0]])), (20001, "f(1)"))
+        with self.assertRaises(UnificationFail):
+            Result.solve([(V[-1], Compound('f', (V[0],)))] + chain)
+    
+    def test_rational_trees(self):
+        u, n = Universe(occurs_check='false').and_namespace()
+        self.assertTrue(u.ok((_.X == _.f(_.X)) & (_.Y == _.f(_.f(_.Y))) & (_.X == _.Y)))
+        self.assertFalse(u.ok((_.X == _.f(_.X)) & (_.Y == _.f(_.g(_.Y))) & (_.X == _.Y)))
+        res = u.simple_query((_.X == cons(1, _.X)) & (_.Y == cons(1, 1, _.Y)) & (_.X == _.Y))
+        self.assertEqual(len(res), 1)
+        self.assertTrue(str(res[0]['X']).startswith("[1"))
+        # The cycle through a clause variable survives trimming the clause's bindings
+        n.wrapped[_.A] = (_.B == _.f(_.B)) & (_.A == _.g(_.B))
+        self.assertTrue(u.ok(n.wrapped(_.X) & n.wrapped(_.Y) & (_.X == _.Y)))
+        self.assertFalse(u.ok(n.wrapped(_.X) & (_.X == _.g(_.f(_.a)))))
+
+
+class Lists(UniverseAndNamespace):
+    def setup_universe(self, u, n):
+        n.rev[[], _.A, _.A] = True
+        n.rev[cons(_.H, _.T), _.A, _.R] = n.rev(_.T, cons(_.H, _.A), _.R)
+        n.sum_list[[], 0] = True
+        n.sum_list[cons(_.H, _.T), _.S] = n.sum_list(_.T, _.S1) & (_.S << _.S1 + _.H)
+    
+    def test_python_interop(self):
+        self.assertEqual(self.u.simple_query(self.n.rev([1, 2, 3], [], _.R)), [{'R': [3, 2, 1]}])
+        self.assertEqual(self.u.simple_query(self.n.sum_list([1, 2, 3, 4], _.S)), [{'S': 10}])
+        self.assertEqual(self.u.simple_query(cons(_.H, _.T) == [1, [2], 3]), [{'H': 1, 'T': [[2], 3]}])
+        self.assertEqual(str(cons(1, 2, _.T)), "[1, 2 | T]")
+    
+    def test_long_lists(self):
+        big = list(range(100000))
+        self.assertEqual(self.u.simple_query(length(big, _.N)), [{'N': 100000}])
+        self.assertTrue(self.u.ok((_.X == big) & (_.X == big)))
+        self.assertFalse(self.u.ok((_.X == big) & (_.X == big[:-1])))
+        res = self.u.simple_query(append(big, [1, 2], _.X) & nth(100001, _.X, _.E))
+        self.assertEqual(res[0]['E'], 2)
+        self.assertEqual(len(res[0]['X']), 100002)
+    
+    def test_append(self):
+        splits = self.u.simple_query(append(_.A, _.B, [1, 2]))
+        self.assertEqual(splits, [{'A': [], 'B': [1, 2]}, {'A': [1], 'B': [2]}, {'A': [1, 2], 'B': []}])
+        self.assertEqual(self.u.simple_query(append([1], _.B, [1, 2])), [{'B': [2]}])
+        self.assertEqual(len(self.u.simple_query(append(_.A, [3], _.C), limit=3)), 3)
+        self.assertFalse(self.u.ok(append(cons(1, _.T), _.B, cons(2, _.C))))
+    
+    def test_length_nth_member(self):
+        self.assertEqual(len(self.u.simple_query(length(_.L, 3))[0]['L']), 3)
+        first, second = self.u.simple_query(length(cons(1, _.T), _.N), limit=2)
+        self.assertEqual(first, {'N': 1, 'T': []})
+        self.assertEqual((second['N'], len(second['T'])), (2, 1))
+        self.assertEqual(self.u.simple_query(nth(_.I, [_.a, _.b], _.b)), [{'I': 1}])
+        self.assertEqual(self.u.simple_query(member(_.X, [1, 2]) & (_.X > 1)), [{'X': 2}])
+    
+    def test_standard_order(self):
+        from logicpy.data import Atom
+        S = lambda goal: self.u.simple_query(goal)[0]['S']
+        self.assertEqual(S(msort([3, _.b, 1.0, 1, _.a(1), 'x', _.a, [1, 2], 1], _.S)),
+                         [1.0, 1, 1, 3, _.a, _.b, 'x', _.a(1), [1, 2]])
+        self.assertEqual(S(sort([3, 1, 3, 2, 1], _.S)), [1, 2, 3])
+        self.assertEqual(S(sort(0, '@>=', [3, 1, 3, 2], _.S)), [3, 3, 2, 1])
+        self.assertEqual(S(sort(1, '@<', [_.f(2, _.a), _.f(1, _.b), _.f(2, _.c)], _.S)), [_.f(1, _.b), _.f(2, _.a)])
+        self.assertEqual(S(keysort([_.b - 1, _.a - 2, _.b - 0, _.a - 1], _.S)), [_.a - 2, _.a - 1, _.b - 1, _.b - 0])
+        self.assertEqual(S((_.X == 3) & msort([2, _.X, 1], _.S)), [1, 2, 3])
+        self.assertEqual(self.u.simple_query(compare(_.O, _.f(_.a), _.g(_.a)) & compare(_.P, [1], [1])),
+                         [{'O': Atom('<'), 'P': Atom('=')}])
+        self.assertEqual(S(msort(list(range(10000, 0, -1)), _.S))[:3], [1, 2, 3])
+        self.assertFalse(self.u.ok(sort(cons(1, _.T), _.S)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    "A least recently used cache, with counters to help sizing it"
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.RLock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            if key in self.entries:
+                self.pop(key)
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                old_key, old_value = self.entries.popitem(last=False)
+                self.evictions += 1
+                self.removed(old_key, old_value)
+    
+    def pop(self, key):
+        with self._lock:
+            value = self.entries.pop(key)
+            self.removed(key, value)
+            return value
+    
+    def removed(self, key, value):
+        "Called after an entry was evicted or popped"
+        pass
+    
+    def clear(self):
+        with self._lock:
+            for key in list(self.entries):
+                self.pop(key)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, key):
+        return key in self.entries
+    
+    def stats(self):
+        return {'size': len(self.entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,222 @@
+# Incremental views
+# -----------------
+#
+# A view materializes derived predicates like Universe.materialize, but keeps
+# their tables up to date when facts are defined or retracted, instead of
+# dropping them. Added facts are propagated with delta rules: each rule is run
+# with one of its lookups restricted to the new rows. Removed facts use
+# delete-rederive (DRed): first everything derivable from them is deleted,
+# then whatever still has another derivation is put back. Programs with
+# negation, and changes to rules, are recomputed from scratch and compared.
+# Like clauses, tables are replaced rather than changed in place: a change
+# works on copies, so calls that are running keep the rows they started with.
+
+from collections import defaultdict
+
+from logicpy.datalog import FactTable, Program, Lookup, universe_rules, clause_rules, head_frame
+from logicpy.predicate import Signature
+from logicpy.data import is_ground
+
+
+class View:
+    """The tables of some predicates and everything they depend on, kept up to date.
+    Subscribers are called as callback(signature, inserted, deleted) with the sets
+    of rows that changed, for every change to one of the view's predicates."""
+    
+    def __init__(self, univ, signatures):
+        self.univ = univ
+        self.signatures = {Signature.parse(s) for s in signatures}
+        self.subscribers = []
+        self._changes = None
+        self._copied = set()
+        self.recompute()
+    
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return callback
+    
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+    
+    def close(self):
+        "Stops maintaining the view, calls use the clauses again"
+        self.univ._views.remove(self)
+        for sig in self.closure:
+            pred = self.univ.get_pred(sig)
+            if pred.source is self.tables.get(sig):
+                pred.source = None
+    
+    def __getitem__(self, signature):
+        return self.tables[Signature.parse(signature)]
+    
+    def __repr__(self):
+        return f"View({', '.join(map(str, sorted(self.signatures)))})"
+    
+    # Changes ..........................................
+    
+    def added(self, clause):
+        "Called by Universe.define"
+        if clause.signature in self.closure:
+            row = fact_row(clause)
+            with self.changes():
+                if row is None or not self.incremental:
+                    self.recompute()
+                else:
+                    self.program.rules[clause.signature].append(next(clause_rules(clause)))
+                    self.insert({clause.signature: {row}})
+    
+    def removed(self, clause):
+        "Called by Universe.retract"
+        if clause.signature in self.closure:
+            row = fact_row(clause)
+            with self.changes():
+                if row is None or not self.incremental:
+                    self.recompute()
+                else:
+                    rules = self.program.rules[clause.signature]
+                    rules.remove(next(r for r in rules if r.args == row and not r.body))
+                    self.delete({clause.signature: {row}})
+    
+    def changes(self):
+        return _Changes(self)
+    
+    def note(self, key, row, inserted):
+        if self._changes is None or key not in self.signatures:
+            return
+        ins, dels = self._changes[key]
+        if inserted:
+            if row in dels:
+                dels.remove(row)
+            else:
+                ins.add(row)
+        else:
+            if row in ins:
+                ins.remove(row)
+            else:
+                dels.add(row)
+    
+    # Maintenance ......................................
+    
+    def recompute(self):
+        self.closure = self.univ.dependencies(self.signatures)
+        self.program = Program(universe_rules(self.univ, self.closure))
+        self.incremental = not any(isinstance(lit, Lookup) and not lit.positive
+                                   for rules in self.program.rules.values() for r in rules for lit in r.body)
+        tables = {key: table for key, table in self.program.evaluate().items() if key in self.closure}
+    
+        old = getattr(self, 'tables', {})
+        for key in self.signatures:
+            old_rows, new_rows = old.get(key, ()), tables.get(key, ())
+            for row in old_rows:
+                if row not in new_rows:
+                    self.note(key, row, False)
+            for row in new_rows:
+                if row not in old_rows:
+                    self.note(key, row, True)
+    
+        self.tables = tables
+        self._copied = set()
+        for sig in self.closure:
+            pred = self.univ.get_pred(sig)
+            if pred is not None:
+                pred.source = tables.setdefault(sig, FactTable(sig))
+    
+    def uses(self, keys):
+        "The rules with a positive lookup of one of keys, and that lookup"
+        return [(rule, lit) for rules in self.program.rules.values() for rule in rules
+                for lit in rule.body if isinstance(lit, Lookup) and lit.positive and lit.key in keys]
+    
+    def insert(self, delta):
+        "Adds the rows in delta (key -> rows) and everything derivable from them"
+        delta = {key: FactTable(key, [row for row in rows if row not in self.tables[key]])
+                 for key, rows in delta.items()}
+        while any(delta.values()):
+            for key, table in delta.items():
+                for row in table:
+                    self.writable(key).add(row)
+                    self.note(key, row, True)
+            new = defaultdict(set)
+            for rule, lit in self.uses({key for key, table in delta.items() if table}):
+                for row in self.program.run(rule, self.tables, lit, delta[lit.key]):
+                    if row not in self.tables[rule.key]:
+                        new[rule.key].add(row)
+            delta = {key: FactTable(key, rows) for key, rows in new.items()}
+    
+    def delete(self, delta):
+        "Removes the rows in delta (key -> rows) and what can no longer be derived (DRed)"
+        # 1. Everything with a derivation using a deleted row
+        deleted = {key: FactTable(key, [row for row in rows if row in self.tables[key]])
+                   for key, rows in delta.items()}
+        pending = deleted
+        while any(pending.values()):
+            new = defaultdict(set)
+            for rule, lit in self.uses({key for key, table in pending.items() if table}):
+                for row in self.program.run(rule, self.tables, lit, pending[lit.key]):
+                    if row in self.tables[rule.key] and row not in deleted.get(rule.key, ()):
+                        new[rule.key].add(row)
+            pending = {key: FactTable(key, rows) for key, rows in new.items()}
+            for key, table in pending.items():
+                deleted.setdefault(key, FactTable(key))
+                for row in table:
+                    deleted[key].add(row)
+    
+        for key, table in deleted.items():
+            for row in table:
+                self.writable(key).discard(row)
+                self.note(key, row, False)
+    
+        # 2. Put back the deleted rows that can be derived from the remaining ones,
+        # running each rule with its head bound to the row
+        rederived = defaultdict(set)
+        for key, table in deleted.items():
+            for row in table:
+                for rule in self.program.rules[key]:
+                    frame = head_frame(rule, row)
+                    if frame is not None and next(self.program.run(rule, self.tables, frame=frame), None) is not None:
+                        rederived[key].add(row)
+                        break
+        self.insert(rederived)
+    
+    def writable(self, key):
+        """The table of key, to change. Calls that started before the change keep
+        reading the old table: it's copied once per change, and the copies are
+        published when the change ends (see publish)."""
+        if key not in self._copied:
+            self.tables[key] = self.tables[key].copy()
+            self._copied.add(key)
+        return self.tables[key]
+    
+    def publish(self):
+        "Makes calls read the tables changed since the last publish"
+        for key in self._copied:
+            pred = self.univ.get_pred(key)
+            if pred is not None:
+                pred.source = self.tables[key]
+        self._copied = set()
+
+
+class _Changes:
+    "Collects the changes made to a view, and reports them to its subscribers at the end"
+    
+    def __init__(self, view):
+        self.view = view
+    
+    def __enter__(self):
+        self.view._changes = defaultdict(lambda: (set(), set()))
+    
+    def __exit__(self, *exc):
+        changes, self.view._changes = self.view._changes, None
+        self.view.publish()
+        if exc[0] is None:
+            for key, (inserted, deleted) in sorted(changes.items()):
+                if inserted or deleted:
+                    for callback in list(self.view.subscribers):
+                        callback(key, inserted, deleted)
+
+
+def fact_row(clause):
+    "The row of a ground fact, or None for a rule"
+    rules = list(clause_rules(clause))
+    if len(rules) == 1 and not rules[0].body and all(map(is_ground, rules[0].args)):
+        return rules[0].args
+    return None